@@ -2,28 +2,17 @@ import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify, render_template
 from flask_socketio import SocketIO
-from threading import Lock, Thread, Event
+from threading import Thread
 import time
 import os
-import json
-import mysql.connector
-from datetime import datetime
+import agama_core as core
+from agama_core import fanout, stop_event
+from agama_fanout import ACK_EVENT, SUBSCRIBE_EVENT, UNSUBSCRIBE_EVENT, requested_rooms
+from agama_wire import UnsupportedFormat
 from flask_cors import cross_origin
 from flask_cors import CORS
 
-
-# === Configuration ===
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'User',
-    'password': 'P@$$w0rd',
-    'database': 'agamadb'
-}
-
-AGENT_STATE_TABLE = "agents"
-# Cache to hold metrics for interval writing
-cached_metrics = {}
-stop_event = Event()
+# Configuration (database, storage backend, retention, fan-out, ...) lives in agama_core.
 
 # === Setup ===
 os.makedirs('logs', exist_ok=True)
@@ -51,183 +40,149 @@ CORS(app, resources={
 app.config['SECRET_KEY'] = 'secret!'
 socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
 
-lock = Lock()
-post_requests = {}
-agent_last_seen = {}
-offline_timeout = 5
-
-# === DB Helpers ===
-def get_db_connection():
-    return mysql.connector.connect(**DB_CONFIG)
-
-def upsert_agent_status(hostname, status, timestamp):
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(f"""
-            INSERT INTO {AGENT_STATE_TABLE} (hostname, status, last_seen)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                status = VALUES(status),
-                last_seen = VALUES(last_seen)
-        """, (hostname, status, timestamp))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f"MySQL upsert error for {hostname}: {str(e)}", exc_info=True)
-
-def load_all_agents_from_db():
-    agents = {}
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(f"SELECT hostname, status, UNIX_TIMESTAMP(last_seen) as last_seen FROM {AGENT_STATE_TABLE}")
-        for row in cursor.fetchall():
-            agents[row['hostname']] = {
-                "status": row["status"],
-                "last_seen": float(row["last_seen"])
-            }
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Error loading agents from DB: {str(e)}", exc_info=True)
-    return agents
-
-# === Utility ===
-def save_agent_data(hostname, data):
-    try:
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"data/{hostname}_{timestamp}.json"
-        with open(filename, 'w') as f:
-            json.dump(data, f)
-        logger.info(f"Saved data for {hostname} to {filename}")
-    except Exception as e:
-        logger.error(f"Error saving data for {hostname}: {str(e)}")
-
 # === Threads ===
-def check_agent_status():
-    logger.info("Starting agent status monitoring thread")
-    while True:
+def run_fanout_actions(actions):
+    """Carry out the Socket.IO emits and room changes decided by the fan-out scheduler."""
+    for action in actions:
+        if action[0] == "emit":
+            _, event, data, to = action
+            socketio.emit(event, data, to=to)
+        elif action[0] == "join":
+            socketio.server.enter_room(action[1], action[2], namespace="/")
+        elif action[0] == "leave":
+            socketio.server.leave_room(action[1], action[2], namespace="/")
+
+def fanout_worker():
+    logger.info(f"Starting dashboard fan-out thread (tick {core.FANOUT_INTERVAL}s)")
+    while not stop_event.wait(core.FANOUT_INTERVAL):
         try:
-            with lock:
-                current_time = time.time()
-                for hostname, info in agent_last_seen.items():
-                    if info['status'] == 'online' and current_time - info['last_seen'] > offline_timeout:
-                        logger.warning(f"Agent {hostname} marked as offline")
-                        agent_last_seen[hostname]['status'] = 'offline'
-                        upsert_agent_status(hostname, 'offline', datetime.fromtimestamp(current_time))
-                        socketio.emit('agentStatus', {hostname: 'offline'})
+            run_fanout_actions(fanout.tick(time.time()))
         except Exception as e:
-            logger.error(f"Error in agent status check: {str(e)}")
-        time.sleep(5)
-
-# def log_to_mysql_snapshot():
-#     logger.info("Started full-snapshot MySQL logger thread")
-#     while True:
-#         try:
-#             with lock:
-#                 if post_requests:
-#                     snapshot = [{hostname: metrics} for hostname, metrics in post_requests.items()]
-#                     combined_json = json.dumps(snapshot)
-#                     timestamp = datetime.now()
-#
-#                     conn = get_db_connection()
-#                     cursor = conn.cursor()
-#                     cursor.execute("""
-#                         INSERT INTO metricstable (metricsdata, created_at)
-#                         VALUES (%s, %s)
-#                     """, (combined_json, timestamp))
-#                     conn.commit()
-#                     cursor.close()
-#                     conn.close()
-#
-#                     logger.info(f"Logged snapshot of {len(snapshot)} agents to database")
-#         except Exception as e:
-#             logger.error(f"MySQL snapshot logging error: {str(e)}", exc_info=True)
-#             time.sleep(5)
-
+            logger.error(f"Error in dashboard fan-out: {str(e)}", exc_info=True)
 
 # === Endpoints ===
+# Largest read from a report stream at a time
+STREAM_READ_BYTES = 64 * 1024
 
-def log_metrics_to_db():
-    while not stop_event.is_set():
-        try:
-            with lock:
-                timestamp = datetime.now()
-                if not cached_metrics:
-                    time.sleep(5)
-                    continue
-
-                # Format as list of {"agent-name": data}
-                payload = [{host: data} for host, data in cached_metrics.items()]
-                payload_json = json.dumps(payload)
-
-            # Insert into MySQL
-            conn = mysql.connector.connect(**DB_CONFIG)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO metricstable (metricsdata, created_at) VALUES (%s, %s)",
-                (payload_json, timestamp)
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
-
-            logger.info("Logged metrics to database.")
-
-        except Exception as e:
-            logger.error(f"Error logging metrics to DB: {str(e)}", exc_info=True)
-
-        time.sleep(5)  # Interval
-
-
+def respond(result):
+    body, status, headers = result
+    return jsonify(body), status, headers
 
 @app.route("/report", methods=["POST"])
 def report_metrics():
     try:
-        data = request.json
-        logger.info(f"Received data from agent: {str(data)[:200]}...")
+        # JSON, or MessagePack with an application/msgpack Content-Type
+        return respond(core.handle_report_body(request.mimetype, request.get_data()))
+    except Exception as e:
+        logger.error(f"Error in report_metrics: {str(e)}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-        if not data or "hostname" not in data or "data" not in data:
-            return jsonify({"error": "Invalid payload"}), 400
+@app.route("/report/batch", methods=["POST"])
+def report_metrics_batch():
+    try:
+        return respond(core.handle_report_batch_body(request.mimetype, request.get_data()))
+    except Exception as e:
+        logger.error(f"Error in report_metrics_batch: {str(e)}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-        hostname = data["hostname"]
-        metrics = data["data"]
+def body_chunks(body):
+    """
+    Yield request body data as it arrives, not split on newlines: MessagePack streams
+    have none. Buffered streams hand over what they hold through read1(); raw ones,
+    like the dev server's chunked input, only return once a read is full, so they
+    are read a byte at a time.
+    """
+    read1 = getattr(body, "read1", None)
+    while True:
+        chunk = read1(STREAM_READ_BYTES) if read1 else body.read(1)
+        if not chunk:
+            return
+        yield chunk
+
+@app.route("/report/stream", methods=["POST"])
+def report_metrics_stream():
+    # One thread per open stream here; the ASGI server holds them as coroutines
+    try:
+        try:
+            stream = core.ReportStreamIngest(request.remote_addr, request.mimetype)
+        except UnsupportedFormat as e:
+            return jsonify({"error": str(e)}), 415
+        logger.info(f"Report stream opened by {request.remote_addr}")
+        for chunk in body_chunks(request.stream):
+            result = stream.feed(chunk)
+            if result:
+                return respond(result)
+        return respond(stream.finish())
+    except Exception as e:
+        logger.error(f"Error in report_metrics_stream: {str(e)}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-        with lock:
-            post_requests[hostname] = metrics
-            cached_metrics[hostname] = metrics
-            now = time.time()
-            agent_last_seen[hostname] = {"last_seen": now, "status": "online"}
-            upsert_agent_status(hostname, 'online', datetime.fromtimestamp(now))
+@app.route("/agents", methods=["GET"])
+def list_agents():
+    try:
+        return respond(core.list_agents())
+    except Exception as e:
+        logger.error(f"Error in list_agents: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
 
-        save_agent_data(hostname, data)
-        socketio.emit("newPostRequest", {hostname: metrics})
-        socketio.emit('agentStatus', {hostname: 'online'})
+@app.route("/snapshot", methods=["GET"])
+def dashboard_snapshot():
+    try:
+        return respond(core.dashboard_snapshot(request.args))
+    except Exception as e:
+        logger.error(f"Error in dashboard_snapshot: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
 
-        return jsonify({"message": "Data received"}), 200
+@app.route("/metrics/<hostname>", methods=["GET"])
+def query_metrics(hostname):
+    try:
+        return respond(core.query_metrics(hostname, request.args))
+    except Exception as e:
+        logger.error(f"Error in query_metrics: {str(e)}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
+@app.route("/alerts", methods=["GET"])
+def list_alerts():
+    try:
+        return respond(core.list_alerts())
     except Exception as e:
-        logger.error(f"Error in report_metrics: {str(e)}", exc_info=True)
+        logger.error(f"Error in list_alerts: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route("/agents", methods=["GET"])
-def list_agents():
+@app.route("/stats", methods=["GET"])
+def server_stats():
     try:
-        result = []
-        with lock:
-            for hostname, info in agent_last_seen.items():
-                result.append({
-                    "hostname": hostname,
-                    "status": info["status"],
-                    "last_seen": datetime.fromtimestamp(info["last_seen"]).strftime("%Y-%m-%d %H:%M:%S")
-                })
-        return jsonify({"agents": result, "count": len(result)}), 200
+        return respond(core.server_stats())
     except Exception as e:
-        logger.error(f"Error in list_agents: {str(e)}")
+        logger.error(f"Error in server_stats: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
+# === Socket.IO ===
+@socketio.on("connect")
+def on_dashboard_connect(auth=None):
+    run_fanout_actions(core.dashboard_connected(request.sid, auth))
+
+@socketio.on("disconnect")
+def on_dashboard_disconnect(*args):
+    fanout.remove_client(request.sid)
+
+@socketio.on(ACK_EVENT)
+def on_frame_ack(data):
+    if isinstance(data, dict):
+        fanout.ack(request.sid, data.get("seq"))
+
+@socketio.on(SUBSCRIBE_EVENT)
+def on_subscribe(data):
+    added, actions = fanout.subscribe(request.sid, requested_rooms(data))
+    run_fanout_actions(actions)
+    return {"rooms": added}
+
+@socketio.on(UNSUBSCRIBE_EVENT)
+def on_unsubscribe(data):
+    dropped, actions = fanout.unsubscribe(request.sid, requested_rooms(data))
+    run_fanout_actions(actions)
+    return {"hosts": dropped}
+
 @app.route("/")
 def index():
     try:
@@ -239,13 +194,13 @@ def index():
 
 # === Server Runner ===
 def run_server():
-    global agent_last_seen
-    agent_last_seen = load_all_agents_from_db()
-
-    Thread(target=check_agent_status, name="AgentStatusThread", daemon=True).start()
-    Thread(target=log_metrics_to_db, name="MySQLLoggerThread", daemon=True).start()
+    core.start_services()
+    Thread(target=fanout_worker, name="FanoutThread", daemon=True).start()
 
-    socketio.run(app, host="0.0.0.0", port=5000, debug=False)
+    try:
+        socketio.run(app, host="0.0.0.0", port=5000, debug=False)
+    finally:
+        core.stop_services()
 
 if __name__ == "__main__":
     run_server()
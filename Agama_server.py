@@ -2,10 +2,11 @@ import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify, render_template
 from flask_socketio import SocketIO
-from threading import Lock, Thread
+from threading import Thread
 import time
 import os
-from datetime import datetime
+from agama_segment_log import SegmentLog
+from agama_state import AgentStateStore
 
 # Setup directories
 os.makedirs('logs', exist_ok=True)
@@ -26,20 +27,18 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
 socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
 
-# Thread-safe data storage
-lock = Lock()
-post_requests = {}
-agent_last_seen = {}
+# Thread-safe data storage, hash-partitioned so reports for different hosts don't share a lock
+agent_state = AgentStateStore(shards=16)
 offline_timeout = 5  # Seconds after which an agent is considered offline
 
+# Append-only report log (NDJSON segments, rotated hourly or at 64 MB and gzipped once closed)
+report_log = SegmentLog('data/reports', max_segment_bytes=64 * 1024 * 1024, max_segment_age=3600)
+
 def save_agent_data(hostname, data):
-    """Save agent data to a file with timestamp"""
+    """Append agent data to the report log"""
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"data/{hostname}_{timestamp}.json"
-        with open(filename, 'w') as f:
-            json.dump(data, f)
-        logger.info(f"Saved data for {hostname} to {filename}")
+        report_log.append(data)
+        logger.info(f"Logged data for {hostname}")
     except Exception as e:
         logger.error(f"Error saving data for {hostname}: {str(e)}")
 
@@ -50,21 +49,12 @@ def check_agent_status():
     logger.info("Starting agent status monitoring thread")
     while True:
         try:
-            with lock:
-                current_time = time.time()
-                offline_agents = []
-                
-                for hostname, last_seen in agent_last_seen.items():
-                    if current_time - last_seen > offline_timeout:
-                        logger.warning(f"Agent {hostname} marked as offline")
-                        socketio.emit('agentStatus', {hostname: 'offline'})
-                        offline_agents.append(hostname)
-                
-                #Remove offline agents do not remove offline agents
-                for hostname in offline_agents:
-                    del agent_last_seen[hostname]
-                    if hostname in post_requests:
-                        del post_requests[hostname]
+            # Offline agents are removed from the store; the emits happen outside its locks
+            for hostname in agent_state.remove_stale(time.time() - offline_timeout):
+                logger.warning(f"Agent {hostname} marked as offline")
+                socketio.emit('agentStatus', {hostname: 'offline'})
+            # Appends only sync as they arrive; catch up on the last ones once reports go quiet
+            report_log.sync_due()
 
         except Exception as e:
             logger.error(f"Error in agent status check: {str(e)}")
@@ -76,8 +66,6 @@ def report_metrics():
     """
     Endpoint for agents to report system metrics.
     """
-    global post_requests, agent_last_seen
-    
     try:
         data = request.json
         logger.info(f"Received data from agent: {str(data)[:200]}...")  # Log first 200 chars
@@ -89,10 +77,8 @@ def report_metrics():
         hostname = data["hostname"]
         metrics = data["data"]
         
-        with lock:
-            post_requests[hostname] = metrics
-            agent_last_seen[hostname] = time.time()
-            logger.info(f"Updated data for {hostname}")
+        agent_state.report(hostname, metrics, time.time())
+        logger.info(f"Updated data for {hostname}")
 
         # Save the data to disk
         save_agent_data(hostname, data)
@@ -114,13 +100,12 @@ def list_agents():
     Endpoint to list all active agents.
     """
     try:
-        with lock:
-            agents = list(agent_last_seen.keys())
-            logger.info(f"Listing {len(agents)} active agents")
-            return jsonify({
-                "active_agents": agents,
-                "count": len(agents)
-            }), 200
+        agents = agent_state.hostnames()
+        logger.info(f"Listing {len(agents)} active agents")
+        return jsonify({
+            "active_agents": agents,
+            "count": len(agents)
+        }), 200
     except Exception as e:
         logger.error(f"Error in list_agents: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
@@ -150,6 +135,7 @@ def run_server():
     except Exception as e:
         logger.critical(f"Server crashed: {str(e)}", exc_info=True)
     finally:
+        report_log.close()
         logger.info("Server shutting down")
 
 if __name__ == "__main__":
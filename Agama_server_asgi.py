@@ -0,0 +1,298 @@
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import socket
+import time
+
+import socketio
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
+from starlette.responses import FileResponse, HTMLResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import agama_core as core
+from agama_cluster import reuseport_socket, run_workers
+from agama_core import fanout, stop_event
+from agama_fanout import ACK_EVENT, SUBSCRIBE_EVENT, UNSUBSCRIBE_EVENT, requested_rooms
+from agama_wire import UnsupportedFormat
+
+# asyncio server mode: the same HTTP and Socket.IO contract as Agama_server-v1-my.py, served
+# by uvicorn with python-socketio's AsyncServer so idle agent and dashboard connections cost
+# a coroutine each instead of a thread. Run it directly, or e.g.
+#     uvicorn Agama_server_asgi:app --host 0.0.0.0 --port 5000
+# Ingest never touches the database or disk on the event loop: reports go to in-memory state
+# and the report writer queue, and the background threads from agama_core do the I/O.
+# Requests that would wait (a full report queue, history queries) run in the thread pool.
+
+# === Configuration ===
+ASGI_HOST = "0.0.0.0"
+ASGI_PORT = 5000
+UVICORN_CONFIG = {
+    'backlog': 8192,              # pending TCP connections while the loop is busy
+    'timeout_keep_alive': 75,     # agents reporting every few seconds reuse their connection
+    'limit_concurrency': 50000,   # answer 503 beyond this many open connections
+    'timeout_graceful_shutdown': 5,  # then cut agent report streams, which never end on their own
+    'log_level': 'warning'
+}
+# Worker processes: more than one binds each its own SO_REUSEPORT socket to the port and shares
+# agent state over agama_core.CLUSTER_BUS_URL (AGAMA_BUS_URL), which must then be a Redis URL.
+# Socket.IO long-polling needs every request of a session on the same worker, so with several
+# workers the dashboard is served set to websocket only (custom clients must do the same, or use a
+# sticky load balancer); a single worker keeps the long-polling fallback for proxies without websocket.
+WORKERS = int(os.environ.get("AGAMA_WORKERS", "1"))
+# Open file descriptors to allow, one per connection plus files and DB sockets (capped by the hard limit)
+NOFILE_LIMIT = 65536
+# Page and static assets are served from next to this file, as Flask does
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# === Setup ===
+os.makedirs('logs', exist_ok=True)
+os.makedirs('data', exist_ok=True)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s',
+    handlers=[
+        RotatingFileHandler('logs/server.log', maxBytes=1000000, backupCount=5),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+
+# === Fan-out ===
+async def run_fanout_actions(actions):
+    """Carry out the Socket.IO emits and room changes decided by the fan-out scheduler."""
+    for action in actions:
+        if action[0] == "emit":
+            _, event, data, to = action
+            await sio.emit(event, data, to=to)
+        elif action[0] == "join":
+            await sio.enter_room(action[1], action[2])
+        elif action[0] == "leave":
+            await sio.leave_room(action[1], action[2])
+
+async def fanout_task():
+    logger.info(f"Starting dashboard fan-out task (tick {core.FANOUT_INTERVAL}s)")
+    while not stop_event.is_set():
+        await asyncio.sleep(core.FANOUT_INTERVAL)
+        try:
+            await run_fanout_actions(fanout.tick(time.time()))
+        except Exception as e:
+            logger.error(f"Error in dashboard fan-out: {str(e)}", exc_info=True)
+
+# === Endpoints ===
+def respond(result):
+    body, status, headers = result
+    return Response(json.dumps(body), status_code=status, headers=headers, media_type="application/json")
+
+def error_response(status=500, message="Internal server error"):
+    return Response(json.dumps({"error": message}), status_code=status, media_type="application/json")
+
+def mimetype(request):
+    return request.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+
+async def ingest(handler, payload, count):
+    # Only a full queue under the "block" policy makes ingest wait; do that waiting off the loop
+    if core.report_writer.would_block(count):
+        return await run_in_threadpool(handler, payload)
+    return handler(payload)
+
+async def report_metrics(request):
+    try:
+        # JSON, or MessagePack with an application/msgpack Content-Type
+        handler = functools.partial(core.handle_report_body, mimetype(request))
+        return respond(await ingest(handler, await request.body(), 1))
+    except Exception as e:
+        logger.error(f"Error in report_metrics: {str(e)}", exc_info=True)
+        return error_response()
+
+async def report_metrics_batch(request):
+    try:
+        entries = core.parse_batch_body(mimetype(request), await request.body())
+        return respond(await ingest(core.handle_report_batch, entries, len(entries or ())))
+    except UnsupportedFormat as e:
+        return error_response(415, str(e))
+    except Exception as e:
+        logger.error(f"Error in report_metrics_batch: {str(e)}", exc_info=True)
+        return error_response()
+
+async def report_metrics_stream(request):
+    try:
+        peer = request.client.host if request.client else "unknown"
+        stream = core.ReportStreamIngest(peer, mimetype(request))
+        logger.info(f"Report stream opened by {peer}")
+        try:
+            async for chunk in request.stream():
+                result = await ingest(stream.feed, chunk, chunk.count(b"\n"))
+                if result:
+                    # Cut short: close the connection, else uvicorn drains the rest of the body
+                    # and the agent keeps writing reports into it without seeing the answer
+                    body, status, headers = result
+                    return respond((body, status, dict(headers, Connection="close")))
+        except ClientDisconnect:
+            pass  # the agent went away; what it sent so far is ingested, it reconnects
+        return respond(stream.finish())
+    except UnsupportedFormat as e:
+        return error_response(415, str(e))
+    except Exception as e:
+        logger.error(f"Error in report_metrics_stream: {str(e)}", exc_info=True)
+        return error_response()
+
+async def list_agents(request):
+    try:
+        # Walks the whole fleet; keep the loop free for reports meanwhile
+        return respond(await run_in_threadpool(core.list_agents))
+    except Exception as e:
+        logger.error(f"Error in list_agents: {str(e)}")
+        return error_response()
+
+async def dashboard_snapshot(request):
+    try:
+        return respond(core.dashboard_snapshot(request.query_params))
+    except Exception as e:
+        logger.error(f"Error in dashboard_snapshot: {str(e)}")
+        return error_response()
+
+async def query_metrics(request):
+    try:
+        return respond(await run_in_threadpool(core.query_metrics, request.path_params["hostname"],
+                                               request.query_params))
+    except Exception as e:
+        logger.error(f"Error in query_metrics: {str(e)}", exc_info=True)
+        return error_response()
+
+async def list_alerts(request):
+    try:
+        return respond(core.list_alerts())
+    except Exception as e:
+        logger.error(f"Error in list_alerts: {str(e)}")
+        return error_response()
+
+async def server_stats(request):
+    try:
+        return respond(core.server_stats())
+    except Exception as e:
+        logger.error(f"Error in server_stats: {str(e)}")
+        return error_response()
+
+@functools.lru_cache(maxsize=1)
+def websocket_only_page():
+    with open(os.path.join(BASE_DIR, "templates", "index.html"), encoding="utf-8") as handle:
+        page = handle.read()
+    return page.replace('<meta name="socketio-transports" content="polling,websocket">',
+                        '<meta name="socketio-transports" content="websocket">')
+
+async def index(request):
+    try:
+        logger.info("Serving index page")
+        if WORKERS > 1:
+            return HTMLResponse(websocket_only_page())
+        return FileResponse(os.path.join(BASE_DIR, "templates", "index.html"), media_type="text/html")
+    except Exception as e:
+        logger.error(f"Error serving index page: {str(e)}")
+        return PlainTextResponse("Internal Server Error", status_code=500)
+
+# === Socket.IO ===
+@sio.event
+async def connect(sid, environ, auth=None):
+    await run_fanout_actions(core.dashboard_connected(sid, auth))
+
+@sio.event
+async def disconnect(sid, *args):
+    fanout.remove_client(sid)
+
+@sio.on(ACK_EVENT)
+async def on_frame_ack(sid, data):
+    if isinstance(data, dict):
+        fanout.ack(sid, data.get("seq"))
+
+@sio.on(SUBSCRIBE_EVENT)
+async def on_subscribe(sid, data):
+    added, actions = fanout.subscribe(sid, requested_rooms(data))
+    await run_fanout_actions(actions)
+    return {"rooms": added}
+
+@sio.on(UNSUBSCRIBE_EVENT)
+async def on_unsubscribe(sid, data):
+    dropped, actions = fanout.unsubscribe(sid, requested_rooms(data))
+    await run_fanout_actions(actions)
+    return {"hosts": dropped}
+
+# === Application ===
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Opening storage and loading agents block, so they run in the thread pool
+    await run_in_threadpool(core.start_services)
+    task = asyncio.create_task(fanout_task())
+    try:
+        yield
+    finally:
+        stop_event.set()
+        task.cancel()
+        await run_in_threadpool(core.stop_services)
+
+http_app = Starlette(
+    routes=[
+        Route("/report", report_metrics, methods=["POST"]),
+        Route("/report/batch", report_metrics_batch, methods=["POST"]),
+        Route("/report/stream", report_metrics_stream, methods=["POST"]),
+        Route("/agents", list_agents, methods=["GET"]),
+        Route("/snapshot", dashboard_snapshot, methods=["GET"]),
+        Route("/metrics/{hostname}", query_metrics, methods=["GET"]),
+        Route("/alerts", list_alerts, methods=["GET"]),
+        Route("/stats", server_stats, methods=["GET"]),
+        Route("/", index, methods=["GET"]),
+        Mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static"), check_dir=False), name="static"),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"],
+                   allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+                   allow_headers=["Content-Type", "Authorization"])
+    ],
+    lifespan=lifespan,
+)
+app = socketio.ASGIApp(sio, other_asgi_app=http_app)
+
+# === Server Runner ===
+def raise_nofile_limit():
+    """Raise the soft open-files limit towards NOFILE_LIMIT so many agents can stay connected."""
+    try:
+        import resource
+    except ImportError:
+        return  # Windows: no per-process descriptor limit to raise
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = NOFILE_LIMIT if hard == resource.RLIM_INFINITY else min(NOFILE_LIMIT, hard)
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        logger.info(f"Raised open file limit from {soft} to {target}")
+
+def run_worker(index):
+    """Body of one worker process; worker 0 is the primary."""
+    core.configure_worker(f"{socket.gethostname()}-w{index}", primary=index == 0)
+    raise_nofile_limit()
+    sock = reuseport_socket(ASGI_HOST, ASGI_PORT, backlog=UVICORN_CONFIG['backlog'])
+    uvicorn.Server(uvicorn.Config(app, **UVICORN_CONFIG)).run(sockets=[sock])
+
+def run_server():
+    if WORKERS <= 1:
+        raise_nofile_limit()
+        uvicorn.run(app, host=ASGI_HOST, port=ASGI_PORT, **UVICORN_CONFIG)
+        return
+    if core.CLUSTER_BUS_URL.startswith("loopback:"):
+        raise SystemExit("AGAMA_WORKERS > 1 needs a shared bus: set AGAMA_BUS_URL to a Redis URL")
+    logger.info(f"Starting {WORKERS} workers on port {ASGI_PORT}")
+    run_workers(WORKERS, run_worker)
+
+if __name__ == "__main__":
+    run_server()
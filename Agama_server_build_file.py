@@ -2,16 +2,16 @@ import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify, render_template
 from flask_socketio import SocketIO
-from threading import Lock, Thread, Event
+from threading import Thread, Event
 import time
 import os
-from datetime import datetime
-import json
 import win32serviceutil
 import win32service
 import win32event
 import servicemanager
 import sys
+from agama_segment_log import SegmentLog
+from agama_state import AgentStateStore
 
 class FlaskMonitoringService(win32serviceutil.ServiceFramework):
     _svc_name_ = "FlaskMonitoringService"
@@ -40,6 +40,7 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
         self.app = None
         self.socketio = None
         self.server_thread = None
+        self.report_log = None
 
     def SvcStop(self):
         self.logger.info("Stopping service...")
@@ -47,6 +48,8 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
         self.is_running = False
         if self.socketio:
             self.socketio.stop()
+        if self.report_log:
+            self.report_log.close()
         win32event.SetEvent(self.hWaitStop)
 
     def SvcDoRun(self):
@@ -62,12 +65,13 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
     def start_flask_server(self):
         """Initialize and start the Flask server"""
         try:
-            # Thread-safe data storage
-            self.lock = Lock()
-            self.post_requests = {}
-            self.agent_last_seen = {}
+            # Thread-safe data storage, hash-partitioned so reports for different hosts don't share a lock
+            self.agent_state = AgentStateStore(shards=16)
             self.offline_timeout = 5  # Seconds
 
+            # Append-only report log (NDJSON segments, rotated hourly or at 64 MB and gzipped once closed)
+            self.report_log = SegmentLog('data/reports', max_segment_bytes=64 * 1024 * 1024, max_segment_age=3600)
+
             # Create Flask app
             self.app = Flask(__name__)
             self.app.config['SECRET_KEY'] = 'secret!'
@@ -103,10 +107,8 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
                 hostname = data["hostname"]
                 metrics = data["data"]
                 
-                with self.lock:
-                    self.post_requests[hostname] = metrics
-                    self.agent_last_seen[hostname] = time.time()
-                    self.logger.info(f"Updated data for {hostname}")
+                self.agent_state.report(hostname, metrics, time.time())
+                self.logger.info(f"Updated data for {hostname}")
 
                 self.save_agent_data(hostname, data)
                 self.socketio.emit("newPostRequest", {hostname: metrics})
@@ -121,13 +123,12 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
         @self.app.route("/agents", methods=["GET"])
         def list_agents():
             try:
-                with self.lock:
-                    agents = list(self.agent_last_seen.keys())
-                    self.logger.info(f"Listing {len(agents)} active agents")
-                    return jsonify({
-                        "active_agents": agents,
-                        "count": len(agents)
-                    }), 200
+                agents = self.agent_state.hostnames()
+                self.logger.info(f"Listing {len(agents)} active agents")
+                return jsonify({
+                    "active_agents": agents,
+                    "count": len(agents)
+                }), 200
             except Exception as e:
                 self.logger.error(f"Error in list_agents: {str(e)}")
                 return jsonify({"error": "Internal server error"}), 500
@@ -142,13 +143,10 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
                 return "Internal Server Error", 500
 
     def save_agent_data(self, hostname, data):
-        """Save agent data to a file with timestamp"""
+        """Append agent data to the report log"""
         try:
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"data/{hostname}_{timestamp}.json"
-            with open(filename, 'w') as f:
-                json.dump(data, f)
-            self.logger.info(f"Saved data for {hostname} to {filename}")
+            self.report_log.append(data)
+            self.logger.info(f"Logged data for {hostname}")
         except Exception as e:
             self.logger.error(f"Error saving data for {hostname}: {str(e)}")
 
@@ -157,21 +155,12 @@ class FlaskMonitoringService(win32serviceutil.ServiceFramework):
         self.logger.info("Starting agent status monitoring thread")
         while self.is_running:
             try:
-                with self.lock:
-                    current_time = time.time()
-                    offline_agents = []
-                    
-                    for hostname, last_seen in self.agent_last_seen.items():
-                        if current_time - last_seen > self.offline_timeout:
-                            self.logger.warning(f"Agent {hostname} marked as offline")
-                            self.socketio.emit('agentStatus', {hostname: 'offline'})
-                            offline_agents.append(hostname)
-                    
-                    # Remove offline agents
-                    for hostname in offline_agents:
-                        del self.agent_last_seen[hostname]
-                        if hostname in self.post_requests:
-                            del self.post_requests[hostname]
+                # Remove offline agents; the emits happen outside the store's locks
+                for hostname in self.agent_state.remove_stale(time.time() - self.offline_timeout):
+                    self.logger.warning(f"Agent {hostname} marked as offline")
+                    self.socketio.emit('agentStatus', {hostname: 'offline'})
+                # Appends only sync as they arrive; catch up on the last ones once reports go quiet
+                self.report_log.sync_due()
 
             except Exception as e:
                 self.logger.error(f"Error in agent status check: {str(e)}")
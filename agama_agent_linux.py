@@ -1,15 +1,44 @@
 import psutil
-import requests
 import time
 from datetime import datetime
 import socket
 import platform
+import zlib
+from agama_agent_transport import StreamingReporter
+from agama_collectors import CollectorRegistry, run_on_ticks
+from agama_procfs import ProcReader
 
 SERVER_URL = "http://127.0.0.1:5000/report"  # Change to your server IP in production
-
-
-def get_uptime():
-    boot_time = psutil.boot_time()
+STREAM_URL = "http://127.0.0.1:5000/report/stream"  # One long-lived connection; SERVER_URL is the fallback
+BATCH_URL = "http://127.0.0.1:5000/report/batch"  # Reports buffered during an outage are uploaded here
+SPILL_PATH = "/var/tmp/agama_agent_backlog.ndjson"  # Buffer beyond the in-memory queue; None keeps memory only
+WIRE_FORMAT = "msgpack"  # Compact MessagePack reports, or "json"; falls back to JSON without msgpack or server support
+DELTA_REPORTS = True  # Send only changed fields between full keyframes; needs a server with delta support
+AGENT_GROUP = ""  # Optional host group, dashboards can watch it as "group:<name>"
+AGENT_TAGS = []   # Optional tags, dashboards can watch them as "tag:<name>"
+REPORT_INTERVAL = 5  # Seconds between reports, on fixed wall-clock ticks; each carries every collector's latest values
+# Seconds between runs of each collector; cpu is sampled more often than reports go out,
+# disks and processes less often (see agama_collectors)
+COLLECTOR_INTERVALS = {
+    "identity": 300,  # IP address (a DNS lookup) and boot time
+    "cpu": 1,
+    "memory": 5,
+    "load": 5,
+    "net": 5,
+    "disk": 60,
+    "processes": 30
+}
+# Aggregation mode: these collectors are sampled every so many seconds instead, and each report
+# carries the mean since the previous report as the value, plus min/max/mean/p95/count of the
+# samples under "summaries". CPU samples come in whole clock ticks (usually 10ms per core), so
+# very short intervals make single samples coarse; {} reports plain latest values.
+SUMMARY_INTERVALS = {"cpu": 0.1, "memory": 1}
+PROCFS_FAST_PATH = True  # Read cpu, memory, network and disks straight from /proc on Linux instead of via psutil
+
+collectors = CollectorRegistry()
+
+
+def get_uptime(boot_time):
     current_time = time.time()
     uptime_seconds = int(current_time - boot_time)
 
@@ -20,62 +49,152 @@ def get_uptime():
     return f"{days}D {hours}H {minutes}M {seconds}S"
 
 
+@collectors.collector("identity", interval=COLLECTOR_INTERVALS["identity"], cost="high")
+def collect_identity():
+    try:
+        ip_address = socket.gethostbyname(socket.gethostname())
+    except socket.gaierror:
+        ip_address = "0.0.0.0"
+    return {"ip_address": ip_address, "boot_time": psutil.boot_time()}
+
+
+@collectors.collector("cpu", interval=COLLECTOR_INTERVALS["cpu"])
+def collect_cpu():
+    # CPU use since the previous call, without blocking (report_metrics makes the first call)
+    return {"cpu_usage": psutil.cpu_percent(interval=None)}
+
+
+@collectors.collector("memory", interval=COLLECTOR_INTERVALS["memory"])
+def collect_memory():
+    return {"memory_usage": psutil.virtual_memory().percent}
+
+
+@collectors.collector("load", interval=COLLECTOR_INTERVALS["load"])
+def collect_load():
+    load1, load5, load15 = psutil.getloadavg()
+    return {"load_average": {"1m": load1, "5m": load5, "15m": load15}}
+
+
+@collectors.collector("net", interval=COLLECTOR_INTERVALS["net"])
+def collect_net():
+    # Cumulative counters; the server turns them into per-second network_rates
+    interfaces = {
+        name: {
+            "bytes_sent": counters.bytes_sent,
+            "bytes_received": counters.bytes_recv,
+            "packets_sent": counters.packets_sent,
+            "packets_received": counters.packets_recv,
+            "errors_in": counters.errin,
+            "errors_out": counters.errout,
+            "drops_in": counters.dropin,
+            "drops_out": counters.dropout
+        }
+        for name, counters in psutil.net_io_counters(pernic=True).items()
+    }
+    return {
+        "network_io": {
+            "bytes_sent": sum(counters["bytes_sent"] for counters in interfaces.values()),
+            "bytes_received": sum(counters["bytes_received"] for counters in interfaces.values())
+        },
+        "net_interfaces": interfaces
+    }
+
+
+@collectors.collector("disk", interval=COLLECTOR_INTERVALS["disk"], cost="high")
 def get_disk_infos():
     disk_info = {}
-    partitions = psutil.disk_partitions(all=False)
-    for idx, partition in enumerate(partitions, start=1):
+    for partition in psutil.disk_partitions(all=False):
         try:
             disk_usage = psutil.disk_usage(partition.mountpoint)
             disk_info[partition.mountpoint] = {
                 "disk_label": partition.device,
                 "disk_usage": disk_usage.percent
             }
-        except PermissionError:
+        except OSError:
             # Skip partitions that are not accessible
             continue
-    return disk_info
+    return {"disk_usage": disk_info}
 
 
-def collect_metrics():
-    computer_name = platform.node()
-    try:
-        ip_address = socket.gethostbyname(socket.gethostname())
-    except socket.gaierror:
-        ip_address = "0.0.0.0"
+@collectors.collector("processes", interval=COLLECTOR_INTERVALS["processes"], cost="high")
+def collect_processes():
+    return {"process_count": len(psutil.pids())}
 
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory_usage = psutil.virtual_memory().percent
-    disk_usage = get_disk_infos()
-    network_io = psutil.net_io_counters()
-    uptime = get_uptime()
 
-    return {
-        "hostname": computer_name,
-        "data": {
-            "ip_address": ip_address,
-            "cpu_usage": cpu_usage,
-            "memory_usage": memory_usage,
-            "uptime": uptime,
+def use_procfs(reader):
+    """Replace the psutil collectors that have a /proc fast path with ones reading through `reader`."""
+    def collect_net():
+        interfaces = reader.net_interfaces()
+        return {
             "network_io": {
-                "bytes_sent": network_io.bytes_sent,
-                "bytes_received": network_io.bytes_recv
+                "bytes_sent": sum(counters["bytes_sent"] for counters in interfaces.values()),
+                "bytes_received": sum(counters["bytes_received"] for counters in interfaces.values())
             },
-            "disk_usage": disk_usage
+            "net_interfaces": interfaces
         }
-    }
+
+    def collect_disks():
+        disk_info = {}
+        for mountpoint, device in reader.partitions():
+            try:
+                disk_info[mountpoint] = {"disk_label": device, "disk_usage": reader.disk_percent(mountpoint)}
+            except OSError:
+                continue
+        return {"disk_usage": disk_info}
+
+    reader.cpu_percent()
+    collectors.register("cpu", lambda: {"cpu_usage": reader.cpu_percent()}, COLLECTOR_INTERVALS["cpu"])
+    collectors.register("memory", lambda: {"memory_usage": reader.memory_percent()}, COLLECTOR_INTERVALS["memory"])
+    collectors.register("net", collect_net, COLLECTOR_INTERVALS["net"])
+    collectors.register("disk", collect_disks, COLLECTOR_INTERVALS["disk"], cost="high")
+
+
+def build_payload(data):
+    if "boot_time" in data:
+        data["uptime"] = get_uptime(data["boot_time"])
+    payload = {"hostname": platform.node(), "data": data}
+    if AGENT_GROUP:
+        payload["group"] = AGENT_GROUP
+    if AGENT_TAGS:
+        payload["tags"] = AGENT_TAGS
+    return payload
+
+
+def collect_metrics():
+    """Run the collectors that are due and return a report with everyone's latest values."""
+    return build_payload(collectors.collect(time.time()))
 
 
 def report_metrics():
-    while True:
+    reporter = StreamingReporter(STREAM_URL, report_url=SERVER_URL, wire_format=WIRE_FORMAT,
+                                 delta=DELTA_REPORTS, batch_url=BATCH_URL, spill_path=SPILL_PATH).start()
+    reader = ProcReader.open() if PROCFS_FAST_PATH else None
+    if reader:
+        use_procfs(reader)
+    else:
+        psutil.cpu_percent(interval=None)
+    for name, interval in SUMMARY_INTERVALS.items():
+        collectors.summarize(name, interval)
+
+    tick = collectors.tick_interval
+    ticks_per_report = max(round(REPORT_INTERVAL / tick), 1)
+    # Each host keeps its own phase within the report interval, so agents do not all report at once
+    phase = zlib.crc32(platform.node().encode("utf-8")) % 1000 / 1000 * REPORT_INTERVAL
+
+    def on_tick():
+        now = time.time()
         try:
-            payload = collect_metrics()
-            response = requests.post(SERVER_URL, json=payload, timeout=5)
-            if response.status_code != 200:
-                print(f"Failed to post metrics: {response.status_code}")
+            collectors.run_due(now)
+            if round((now - phase) / tick) % ticks_per_report == 0:
+                reporter.send(build_payload(collectors.report()))
         except Exception as e:
-            print(f"[{datetime.now()}] Error reporting metrics: {e}")
+            print(f"[{datetime.now()}] Error collecting metrics: {e}")
 
-        time.sleep(5)  # Adjust as needed (e.g., every 5 seconds)
+    try:
+        run_on_ticks(tick, on_tick, phase % tick)
+    finally:
+        # Reports not sent yet are kept in the spill file for the next run
+        reporter.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,394 @@
+import collections
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from agama_delta import DeltaEncoder
+from agama_wire import MSGPACK_MIMETYPE, UnsupportedFormat, encode_report, packb
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Reconnect delays: doubled after every failed attempt up to the maximum, then jittered
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+# A stream is closed and reopened after this many seconds, so the agent picks up
+# server restarts and new workers, and the server reports what it accepted
+STREAM_MAX_AGE = 300
+# Reports kept in memory while the server is unreachable (an hour at 5s); beyond this the
+# oldest move to the spill file if there is one, else they are dropped
+QUEUE_SIZE = 720
+# Spill file size limit; reports that do not fit are dropped
+SPILL_MAX_BYTES = 50 * 1024 * 1024
+# Buffered reports are uploaded to /report/batch this many at a time, before the stream reopens
+BATCH_SIZE = 500
+# Upper bound of the random delay before uploading a backlog, so agents that buffered through
+# the same outage do not all upload the moment the server is back
+BACKLOG_JITTER = 10.0
+# Seconds to wait for the connection, and for the server's answer once a stream or report is sent
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+# Servers without /report/stream get one keep-alive POST per report; the stream is retried after this long
+FALLBACK_RETRY = 600
+# Delta mode sends a full report at least every this many reports, besides every new stream
+KEYFRAME_INTERVAL = 60
+
+
+class StreamingReporter:
+    """
+    Sends reports to the server from a background thread over one long-lived
+    chunked HTTP request: POST /report/stream with one NDJSON line per report,
+    so each sample costs a small chunk on an open connection instead of a new
+    connection and a full request.
+
+    send() only queues a report. When the connection fails, the reporter
+    reconnects with jittered exponential backoff and re-sends the report that
+    was in flight; when the server ends the stream early with 409 or 503, it
+    re-sends every report the server's answer does not count. Against a
+    server without the streaming endpoint it posts each report to
+    `report_url` over a keep-alive session instead.
+
+    Reports queued while the server is unreachable are kept up to QUEUE_SIZE
+    in memory, and beyond that in `spill_path` (NDJSON, up to SPILL_MAX_BYTES)
+    if given; the spill file also keeps what is left when the agent stops.
+    Once the server answers again, after a random delay of up to
+    BACKLOG_JITTER seconds, everything but the newest report is posted to
+    `batch_url` in batches of BATCH_SIZE, each report with the "ts" it was
+    taken at, so the server files it as history rather than as the current
+    state. Then the stream reopens for live reports.
+
+    wire_format "msgpack" sends compact MessagePack reports (see agama_wire);
+    the reporter drops back to JSON if msgpack is not installed or the server
+    answers 415.
+
+    With delta=True only the fields that changed since the previous report are
+    sent, plus a full keyframe every `keyframe_interval` reports, on every new
+    stream and after anything that may have lost a report (see agama_delta).
+    The server must support delta reports; it answers 409 when it cannot expand
+    one, and the reporter then starts over with a keyframe.
+    """
+
+    def __init__(self, stream_url, report_url=None, session=None, wire_format="json",
+                 delta=False, keyframe_interval=KEYFRAME_INTERVAL, batch_url=None, spill_path=None):
+        self.stream_url = stream_url
+        self.report_url = report_url
+        self.batch_url = batch_url
+        self.spill_path = spill_path
+        self.session = session or requests.Session()
+        self.wire_format = wire_format
+        self._deltas = DeltaEncoder(keyframe_interval) if delta else None
+        if wire_format == "msgpack":
+            try:
+                packb(None)
+            except UnsupportedFormat as e:
+                self._use_json(e)
+        self._queue = collections.deque(maxlen=QUEUE_SIZE)
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._failures = 0
+        self._fallback_until = 0.0
+        # Spilled reports before _spill_offset are uploaded; the file is emptied once all are
+        self._spill_offset = 0
+        self._spill_bytes = os.path.getsize(spill_path) if spill_path and os.path.exists(spill_path) else 0
+        self.stats = {"sent": 0, "streams": 0, "reconnects": 0, "dropped": 0, "spilled": 0, "backfilled": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ReportStream", daemon=True)
+        self._thread.start()
+        return self
+
+    def send(self, payload):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self._spill([self._queue.popleft()])
+            self._queue.append((time.time(), payload))
+            self._cond.notify_all()
+
+    def stop(self, timeout=10):
+        """Close the stream once the queued reports are written; what is left is spilled, or dropped and counted."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._cond:
+            if self._queue:
+                if not self.spill_path:
+                    print(f"[{datetime.now()}] Dropping {len(self._queue)} unsent reports on stop")
+                self._spill(list(self._queue))
+                self._queue.clear()
+
+    # --- buffering ---
+    def _spill(self, entries):
+        """Append (taken_at, payload) entries to the spill file, or drop them. Caller holds _cond."""
+        blob = "".join(json.dumps(dict(payload, ts=taken_at)) + "\n" for taken_at, payload in entries).encode("utf-8")
+        if not self.spill_path or self._spill_bytes + len(blob) > SPILL_MAX_BYTES:
+            self.stats["dropped"] += len(entries)
+            return
+        try:
+            with open(self.spill_path, "ab") as f:
+                f.write(blob)
+        except OSError as e:
+            print(f"[{datetime.now()}] Cannot write {self.spill_path}: {e}")
+            self.stats["dropped"] += len(entries)
+            return
+        self._spill_bytes += len(blob)
+        self.stats["spilled"] += len(entries)
+
+    def _read_spill(self, limit):
+        """Up to `limit` spilled reports from _spill_offset on, and the offset after them. Caller holds _cond."""
+        if self._spill_offset >= self._spill_bytes:
+            return [], self._spill_offset
+        reports = []
+        with open(self.spill_path, "rb") as f:
+            f.seek(self._spill_offset)
+            offset = self._spill_offset
+            while len(reports) < limit:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # end of file, or a line cut short by a crash
+                offset += len(line)
+                try:
+                    reports.append(json.loads(line))
+                except ValueError:
+                    self.stats["dropped"] += 1
+        if not reports and offset == self._spill_offset:
+            offset = self._spill_bytes  # only a torn last line is left
+        return reports, offset
+
+    def _has_backlog(self):
+        with self._cond:
+            return bool(self.batch_url) and (self._spill_offset < self._spill_bytes or len(self._queue) > 1)
+
+    def _take_backlog(self):
+        """The oldest buffered reports, at most BATCH_SIZE: (records, queued entries, spill offset after them)."""
+        with self._cond:
+            spilled, offset = self._read_spill(BATCH_SIZE)
+            # The newest queued report is left for the stream: it is the current state
+            count = max(min(BATCH_SIZE - len(spilled), len(self._queue) - 1), 0)
+            entries = [self._queue.popleft() for _ in range(count)]
+        return spilled + [dict(payload, ts=taken_at) for taken_at, payload in entries], entries, offset
+
+    def _commit_backlog(self, offset):
+        with self._cond:
+            self._spill_offset = offset
+            if self._spill_offset >= self._spill_bytes and self._spill_bytes:
+                open(self.spill_path, "wb").close()
+                self._spill_offset = self._spill_bytes = 0
+
+    def _restore(self, entries):
+        """Put entries taken for an upload that failed back in front of the queue."""
+        with self._cond:
+            for entry in reversed(entries):
+                if len(self._queue) == self._queue.maxlen:
+                    self._spill([entry])
+                else:
+                    self._queue.appendleft(entry)
+
+    def _upload_backlog(self):
+        if self._failures:
+            # Reconnecting: the server may just be back, with every other agent's backlog
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping, timeout=random.uniform(0, BACKLOG_JITTER))
+        records, entries, offset = self._take_backlog()
+        if not records:
+            self._commit_backlog(offset)
+            return
+        try:
+            if self.wire_format == "msgpack":
+                response = self.session.post(self.batch_url, data=packb(records),
+                                             headers={"Content-Type": MSGPACK_MIMETYPE},
+                                             timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            else:
+                response = self.session.post(self.batch_url, json=records, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except Exception:
+            self._restore(entries)
+            raise
+        if response.status_code in (200, 400):
+            # 400: none of them was usable, and they never will be
+            self._commit_backlog(offset)
+            self.stats["backfilled"] += response.json().get("accepted", 0) if response.status_code == 200 else 0
+            self._failures = 0
+            return
+        self._restore(entries)
+        if response.status_code == 415 and self.wire_format != "json":
+            self._use_json(f"{self.batch_url} cannot decode {self.wire_format}")
+        elif response.status_code in (404, 405):
+            print(f"[{datetime.now()}] {self.batch_url} not available, sending buffered reports as they are")
+            self.batch_url = None
+        else:
+            print(f"[{datetime.now()}] Failed to upload buffered reports: {response.status_code}")
+            self._failures += 1
+
+    def _use_json(self, reason):
+        print(f"[{datetime.now()}] Sending JSON reports: {reason}")
+        self.wire_format = "json"
+
+    def _content_type(self):
+        return MSGPACK_MIMETYPE if self.wire_format == "msgpack" else NDJSON_MIMETYPE
+
+    def _report(self, payload):
+        return self._deltas.encode(payload) if self._deltas else payload
+
+    def _encode(self, payload):
+        report = self._report(payload)
+        if self.wire_format == "msgpack":
+            return packb(encode_report(report))
+        return (json.dumps(report) + "\n").encode("utf-8")
+
+    def _resync(self):
+        """The server may have missed a report: make the next one a keyframe."""
+        if self._deltas:
+            self._deltas.reset()
+
+    def _next(self, deadline):
+        """Wait for the next queued (taken_at, payload) entry; None once the stream should end."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self._stopping, timeout=max(deadline - time.time(), 0))
+            return self._queue.popleft() if self._queue else None
+
+    def _requeue(self, entries):
+        self._resync()
+        self._restore(entries)
+
+    def _lines(self, sent, in_flight):
+        """Encode queued reports for the stream, keeping the ones written in `sent`."""
+        deadline = time.time() + STREAM_MAX_AGE
+        while time.time() < deadline:
+            entry = self._next(deadline)
+            if entry is None:
+                return
+            in_flight[0] = entry
+            yield self._encode(entry[1])
+            # Resumed: the previous chunk was written to the socket
+            in_flight[0] = None
+            sent.append(entry)
+            self.stats["sent"] += 1
+            self._failures = 0
+
+    def _untaken(self, response, entries):
+        """The stream's entries past those the server counted before ending it early; None if it did not say."""
+        try:
+            body = response.json()
+            # The report a 409 names was rejected, but it is the one to send again as a keyframe
+            taken = body["accepted"] + body["rejected"] - (1 if body.get("resync") else 0)
+        except (ValueError, KeyError, TypeError):
+            return None
+        return entries[max(taken, 0):]
+
+    def _stream(self):
+        # An empty stream checks the endpoint exists before a report is committed to it
+        probe = self.session.post(self.stream_url, data=b"", headers={"Content-Type": self._content_type()},
+                                  timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        if probe.status_code == 415 and self.wire_format != "json":
+            self._use_json(f"{self.stream_url} cannot decode {self.wire_format}")
+            return
+        if probe.status_code in (404, 405) and self.report_url:
+            print(f"[{datetime.now()}] {self.stream_url} not available, posting reports one by one")
+            self._fallback_until = time.time() + FALLBACK_RETRY
+            return
+        probe.raise_for_status()
+
+        sent, in_flight = [], [None]
+        self.stats["streams"] += 1
+        # A new stream may reach another worker or a restarted server
+        self._resync()
+        try:
+            response = self.session.post(self.stream_url, data=self._lines(sent, in_flight),
+                                         headers={"Content-Type": self._content_type()},
+                                         timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except Exception:
+            # Cut off while writing one: the ones before it were written whole and are ingested as they arrive
+            if in_flight[0] is not None:
+                self._requeue(in_flight)
+            raise
+        if response.status_code == 200:
+            return
+        # The server ended the stream early: it has the reports it counted, not the ones after them
+        unsent = [entry for entry in in_flight if entry is not None]
+        untaken = self._untaken(response, sent + unsent)
+        if untaken is None:
+            # Not an answer from the report server (e.g. a proxy's): only the one being written surely got lost
+            self._requeue(unsent)
+        elif response.status_code == 503 or (response.status_code == 409 and self._deltas):
+            self._requeue(untaken)
+        elif response.status_code == 409:
+            # Not from delta mode, so a keyframe cannot replace the report the server named
+            self._requeue(untaken[1:])
+            with self._cond:
+                self.stats["dropped"] += len(untaken[:1])
+        elif untaken:
+            # Sending them again would end the next stream the same way
+            with self._cond:
+                self.stats["dropped"] += len(untaken)
+        if response.status_code == 409:
+            print(f"[{datetime.now()}] Server asked for a keyframe: {response.text[:200]}")
+        else:
+            print(f"[{datetime.now()}] Report stream ended with {response.status_code}: {response.text[:200]}")
+            self._failures += 1
+
+    def _post_one(self):
+        entry = self._next(min(self._fallback_until, time.time() + 1))
+        if entry is None:
+            return
+        payload = entry[1]
+        try:
+            if self.wire_format == "msgpack":
+                response = self.session.post(self.report_url, data=self._encode(payload),
+                                             headers={"Content-Type": MSGPACK_MIMETYPE},
+                                             timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            else:
+                response = self.session.post(self.report_url, json=self._report(payload),
+                                             timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except Exception:
+            self._requeue([entry])
+            raise
+        if response.status_code == 415 and self.wire_format != "json":
+            self._use_json(f"{self.report_url} cannot decode {self.wire_format}")
+            self._requeue([entry])
+        elif response.status_code == 200:
+            self.stats["sent"] += 1
+            self._failures = 0
+        elif response.status_code == 409:
+            # Sent again right away, as a keyframe
+            self._requeue([entry])
+        else:
+            print(f"[{datetime.now()}] Failed to post metrics: {response.status_code}")
+            self._resync()
+            if response.status_code == 503:
+                self._requeue([entry])
+                self._failures += 1
+
+    def _backoff(self):
+        delay = min(BACKOFF_INITIAL * 2 ** self._failures, BACKOFF_MAX)
+        with self._cond:
+            self._cond.wait_for(lambda: self._stopping, timeout=random.uniform(delay / 2, delay))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping and not self._queue:
+                    return
+            try:
+                if self._has_backlog():
+                    self._upload_backlog()
+                elif time.time() < self._fallback_until:
+                    self._post_one()
+                else:
+                    self._stream()
+                if not self._failures:
+                    continue
+            except Exception as e:
+                print(f"[{datetime.now()}] Report connection failed: {e}")
+                self._failures += 1
+                self.stats["reconnects"] += 1
+                # Start over on a fresh connection rather than a half-closed pooled one
+                self.session.close()
+            if self._stopping:
+                return
+            self._backoff()
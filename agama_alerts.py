@@ -0,0 +1,379 @@
+import json
+import logging
+import operator
+import queue
+import threading
+import urllib.request
+
+from agama_timeseries import parse_duration
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ("threshold", "rate", "absence")
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+# Firing/pending series are dropped (and resolved) once their metric has not been seen for this long
+DEFAULT_STALE_AFTER = 900
+# How often sweep() looks for stale series
+STALE_CHECK_INTERVAL = 60
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def resolve_metric(data, path, numeric=True):
+    """
+    Yield (instance, value) for every numeric value (any value unless `numeric`) at `path` in a report's data.
+    "*" segments match any key; the matched keys, joined with ",", name the instance
+    (e.g. "/var" for disk_usage.*.disk_usage), which is "" for paths without one.
+    """
+    nodes = [("", data)]
+    for segment in path:
+        matched = []
+        for instance, node in nodes:
+            if not isinstance(node, dict):
+                continue
+            if segment == "*":
+                matched.extend((f"{instance},{key}" if instance else str(key), child) for key, child in node.items())
+            elif segment in node:
+                matched.append((instance, node[segment]))
+        nodes = matched
+    for instance, value in nodes:
+        if _number(value) or not numeric:
+            yield instance, value
+
+
+class Rule:
+    """
+    One compiled alert rule. Specs are dicts:
+
+        {"name": "cpu-high", "metric": "cpu_usage", "op": ">", "value": 90, "for": "5m"}
+        {"name": "disk-filling", "kind": "rate", "metric": "disk_usage.*.disk_usage",
+         "op": ">", "value": 5, "per": "1h", "severity": "critical"}
+        {"name": "net-silent", "kind": "absence", "metric": "network_rates", "for": "2m"}
+
+    metric is a dotted path into report data, "*" matching any key. kind is
+    "threshold" (the default; metric op value), "rate" (change per `per`,
+    default "1s", between consecutive reports op value) or "absence" (a
+    metric a host reported is missing for `for`). Threshold and rate rules
+    fire once their condition has held for `for` (default 0). Optional
+    "hosts", "group" and "tag" limit a rule to those hosts; "severity"
+    (default "warning") and "message" (formatted with hostname, instance,
+    metric and value) are passed on in events.
+    """
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError("Rule must be an object")
+        self.name = spec.get("name")
+        if not isinstance(self.name, str) or not self.name:
+            raise ValueError("Rule needs a 'name'")
+        self.kind = spec.get("kind", "threshold")
+        if self.kind not in RULE_KINDS:
+            raise ValueError(f"Rule {self.name}: unknown kind {self.kind!r}")
+        self.metric = spec.get("metric")
+        if not isinstance(self.metric, str) or not self.metric:
+            raise ValueError(f"Rule {self.name}: needs a 'metric'")
+        self.path = tuple(self.metric.split("."))
+        self.duration = parse_duration(spec.get("for", 0))
+        self.per = parse_duration(spec.get("per", 1))
+        if self.per <= 0:
+            raise ValueError(f"Rule {self.name}: 'per' must be positive")
+        self.op = spec.get("op", ">")
+        self.value = spec.get("value")
+        if self.kind != "absence":
+            if self.op not in OPERATORS:
+                raise ValueError(f"Rule {self.name}: unknown op {self.op!r}")
+            if not _number(self.value):
+                raise ValueError(f"Rule {self.name}: 'value' must be a number")
+        elif self.duration <= 0:
+            raise ValueError(f"Rule {self.name}: absence rules need a 'for' duration")
+        self.compare = OPERATORS.get(self.op)
+        self.severity = spec.get("severity", "warning")
+        self.message = spec.get("message")
+        if self.message is not None:
+            if not isinstance(self.message, str):
+                raise ValueError(f"Rule {self.name}: 'message' must be a string")
+            try:
+                self.message.format(hostname="", instance="", metric=self.metric, value=0.0)
+            except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e:
+                raise ValueError(f"Rule {self.name}: bad 'message' template: {e!r}")
+        self.hosts = frozenset(spec.get("hosts") or ())
+        self.group = spec.get("group")
+        self.tag = spec.get("tag")
+        self.spec = spec
+
+    def applies(self, hostname, group, tags):
+        if self.hosts and hostname not in self.hosts:
+            return False
+        if self.group and group != self.group:
+            return False
+        return not self.tag or self.tag in tags
+
+    def describe(self, hostname, instance, value):
+        if self.message:
+            try:
+                return self.message.format(hostname=hostname, instance=instance, metric=self.metric, value=value)
+            except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e:
+                # Passed the check at load, but not with this value (e.g. a format spec for another type)
+                logger.warning(f"Rule {self.name}: cannot format message for {hostname}: {str(e)}")
+        target = f"{self.metric}[{instance}]" if instance else self.metric
+        if self.kind == "absence":
+            return f"{target} not reported by {hostname} for {value:.0f}s"
+        per = f" per {self.per:g}s" if self.kind == "rate" else ""
+        return f"{target} on {hostname} is {value}{per} ({self.op} {self.value})"
+
+
+class AlertEngine:
+    """
+    Streaming alert evaluation. Rules are compiled once into an index by the
+    top-level report field their metric starts with, so evaluate() only
+    looks at the rules that reference fields the report carries.
+
+    State is kept per (rule, hostname, instance) series: inactive, "pending"
+    (condition true, waiting out the rule's `for`) or "firing". evaluate()
+    runs as reports arrive; sweep() runs periodically to fire pending series
+    whose `for` elapsed between reports, absence rules, and to resolve
+    series whose metric stopped arriving for `stale_after` seconds.
+
+    Both return events: {"id", "state": "firing"|"resolved", "rule",
+    "severity", "hostname", "instance", "value", "since", "at", "message"}.
+    """
+
+    def __init__(self, rules=(), stale_after=DEFAULT_STALE_AFTER):
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self.stats = {"reports": 0, "evaluations": 0, "fired": 0, "resolved": 0}
+        self.load(rules)
+
+    def load(self, specs):
+        """Compile rule specs, replacing the current rules and their state; raises ValueError for a bad rule."""
+        rules = {}
+        for spec in specs:
+            rule = Rule(spec)
+            if rule.name in rules:
+                raise ValueError(f"Duplicate rule name {rule.name!r}")
+            rules[rule.name] = rule
+        index = {}
+        for rule in rules.values():
+            index.setdefault(rule.path[0], []).append(rule)
+        with self._lock:
+            self._rules = rules
+            self._index = index
+            self._series = {}    # (rule name, hostname, instance) -> series state
+            self._pending = set()
+            self._absence = set()
+            self._next_stale_check = 0.0
+
+    def _event(self, state, rule, key, series, now):
+        _, hostname, instance = key
+        self.stats["fired" if state == "firing" else "resolved"] += 1
+        return {
+            "id": "|".join(key),
+            "state": state,
+            "rule": rule.name,
+            "severity": rule.severity,
+            "hostname": hostname,
+            "instance": instance,
+            "value": series["value"],
+            "since": series["since"],
+            "at": now,
+            "message": rule.describe(hostname, instance, series["value"])
+        }
+
+    def _transition(self, rule, key, series, active, now, events):
+        if active:
+            if series["state"] is None:
+                series["state"] = "pending"
+                series["since"] = now
+                self._pending.add(key)
+            if series["state"] == "pending" and now - series["since"] >= rule.duration:
+                series["state"] = "firing"
+                self._pending.discard(key)
+                events.append(self._event("firing", rule, key, series, now))
+        else:
+            if series["state"] == "firing":
+                events.append(self._event("resolved", rule, key, series, now))
+            series["state"] = None
+            series["since"] = None
+            self._pending.discard(key)
+
+    def _step(self, rule, key, series, value, now, events):
+        if rule.kind == "absence":
+            if series["state"] == "firing":
+                events.append(self._event("resolved", rule, key, series, now))
+                series["state"] = None
+            return
+        if rule.kind == "rate":
+            previous, series["previous"] = series.get("previous"), (value, now)
+            if previous is None or now <= previous[1]:
+                return
+            value = round((value - previous[0]) / (now - previous[1]) * rule.per, 3)
+        series["value"] = value
+        self._transition(rule, key, series, rule.compare(value, rule.value), now, events)
+
+    def evaluate(self, hostname, data, now, group=None, tags=()):
+        """Evaluate the rules that reference `data`'s fields for one report received at `now`."""
+        events = []
+        if not isinstance(data, dict):
+            return events
+        with self._lock:
+            self.stats["reports"] += 1
+            for field in data:
+                for rule in self._index.get(field, ()):
+                    if not rule.applies(hostname, group, tags):
+                        continue
+                    for instance, value in resolve_metric(data, rule.path, numeric=rule.kind != "absence"):
+                        key = (rule.name, hostname, instance)
+                        series = self._series.get(key)
+                        if series is None:
+                            series = self._series[key] = {"state": None, "since": None, "value": None}
+                            if rule.kind == "absence":
+                                self._absence.add(key)
+                        series["seen"] = now
+                        self.stats["evaluations"] += 1
+                        self._step(rule, key, series, value, now, events)
+        return events
+
+    def sweep(self, now):
+        """Fire what became due without a report, and resolve stale series."""
+        events = []
+        with self._lock:
+            for key in list(self._pending):
+                rule, series = self._rules[key[0]], self._series[key]
+                self._transition(rule, key, series, True, now, events)
+            for key in self._absence:
+                rule, series = self._rules[key[0]], self._series[key]
+                if series["state"] is None and now - series["seen"] >= rule.duration:
+                    series["state"] = "firing"
+                    series["since"] = series["seen"]
+                    series["value"] = round(now - series["seen"], 1)
+                    events.append(self._event("firing", rule, key, series, now))
+            if now >= self._next_stale_check:
+                self._next_stale_check = now + STALE_CHECK_INTERVAL
+                for key, series in list(self._series.items()):
+                    if key in self._absence or now - series["seen"] < self.stale_after:
+                        continue
+                    if series["state"] == "firing":
+                        events.append(self._event("resolved", self._rules[key[0]], key, series, now))
+                    self._pending.discard(key)
+                    del self._series[key]
+        return events
+
+    def active(self):
+        """Firing alerts, in the event format."""
+        with self._lock:
+            return [
+                {"id": "|".join(key), "state": "firing", "rule": key[0], "severity": self._rules[key[0]].severity,
+                 "hostname": key[1], "instance": key[2], "value": series["value"], "since": series["since"],
+                 "message": self._rules[key[0]].describe(key[1], key[2], series["value"])}
+                for key, series in self._series.items() if series["state"] == "firing"
+            ]
+
+    def rules(self):
+        with self._lock:
+            return [rule.spec for rule in self._rules.values()]
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, rules=len(self._rules), indexed_fields=len(self._index),
+                        series=len(self._series), pending=len(self._pending),
+                        firing=sum(1 for series in self._series.values() if series["state"] == "firing"))
+
+
+# === Notifiers ===
+class FileNotifier:
+    """Appends every event as one JSON line to `path`; a local stand-in for a real notification channel."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def notify(self, event):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event) + "\n")
+
+
+class WebhookNotifier:
+    """POSTs every event as JSON to `url`."""
+
+    def __init__(self, url, timeout=5.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {}, **{"Content-Type": "application/json"})
+
+    def notify(self, event):
+        request = urllib.request.Request(self.url, data=json.dumps(event).encode("utf-8"),
+                                         headers=self.headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def create_notifier(spec):
+    """Build a notifier from {"type": "file", "path": ...} or {"type": "webhook", "url": ..., "timeout": ...}."""
+    kind = spec.get("type")
+    if kind == "file":
+        return FileNotifier(spec["path"])
+    if kind == "webhook":
+        return WebhookNotifier(spec["url"], timeout=spec.get("timeout", 5.0), headers=spec.get("headers"))
+    raise ValueError(f"Unknown notifier type: {kind!r}")
+
+
+class NotificationDispatcher:
+    """
+    Hands alert events to the notifiers from a background thread, so a slow
+    webhook never holds up ingest. Notifiers are any objects with a
+    notify(event) method; events that do not fit in the queue are dropped
+    and counted.
+    """
+
+    def __init__(self, notifiers, max_queue=10000):
+        self.notifiers = list(notifiers)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.stats = {"queued": 0, "delivered": 0, "failed": 0, "dropped": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="AlertNotifierThread", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, events):
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+                self.stats["queued"] += 1
+            except queue.Full:
+                self.stats["dropped"] += 1
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            for notifier in self.notifiers:
+                try:
+                    notifier.notify(event)
+                    self.stats["delivered"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.error(f"{type(notifier).__name__} failed for alert {event['id']}: {str(e)}")
+
+    def stop(self, timeout=5.0):
+        """Deliver what is queued (within `timeout`), then stop."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        return dict(self.stats, queue_depth=self._queue.qsize(), notifiers=len(self.notifiers))
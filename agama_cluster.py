@@ -0,0 +1,172 @@
+import json
+import multiprocessing
+import multiprocessing.connection
+import socket
+import threading
+
+from agama_segment_log import BackgroundWriter
+
+# Pub/sub channel the workers of one deployment share
+CLUSTER_CHANNEL = "agama:cluster"
+
+
+class LoopbackBus:
+    """
+    In-process bus: publish() hands a message to every subscriber before it
+    returns. It is the default for a single worker, where nobody else is
+    listening, and lets several agama_core.WorkerState instances in one
+    process (e.g. a test) share state without Redis; each ignores the
+    messages it published itself.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.stats = {"published": 0, "delivered": 0, "errors": 0}
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def start(self):
+        return self
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats["published"] += 1
+        for callback in subscribers:
+            self._deliver(callback, message)
+
+    def _deliver(self, callback, message):
+        try:
+            callback(message)
+            with self._lock:
+                self.stats["delivered"] += 1
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, backend="loopback", subscribers=len(self._subscribers))
+
+
+class RedisBus(LoopbackBus):
+    """
+    Redis pub/sub bus for workers in separate processes or on separate hosts.
+
+    publish() only queues the message: a sender thread publishes whatever is
+    queued as one JSON array per PUBLISH, and a listener thread hands each
+    received message to the subscribers. Messages are state updates that a
+    later report supersedes, so a backed-up queue drops its oldest entries
+    rather than stalling ingest.
+    """
+
+    def __init__(self, url, channel=CLUSTER_CHANNEL, max_queue=100000, batch_size=500, batch_wait=0.01):
+        import redis
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._redis = redis.Redis.from_url(url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._sender = BackgroundWriter(self._send, max_queue=max_queue, batch_size=batch_size,
+                                        batch_wait=batch_wait, policy="drop-oldest", name="ClusterBusSender")
+        self._stopping = threading.Event()
+        self._listener = None
+
+    def start(self):
+        self._pubsub.subscribe(self.channel)
+        self._listener = threading.Thread(target=self._listen, name="ClusterBusListener", daemon=True)
+        self._listener.start()
+        self._sender.start()
+        return self
+
+    def publish(self, message):
+        self._sender.submit([message])
+        with self._lock:
+            self.stats["published"] += 1
+
+    def _send(self, batch):
+        self._redis.publish(self.channel, json.dumps([message for _, message in batch]))
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                item = self._pubsub.get_message(timeout=1.0)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                self._stopping.wait(1.0)
+                continue
+            if not item or item["type"] != "message":
+                continue
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for message in json.loads(item["data"]):
+                for callback in subscribers:
+                    self._deliver(callback, message)
+
+    def close(self):
+        self._sender.stop()
+        self._stopping.set()
+        if self._listener:
+            self._listener.join(5)
+        self._pubsub.close()
+        self._redis.close()
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update(backend="redis", channel=self.channel, sender=self._sender.get_stats())
+        return stats
+
+
+def create_bus(url):
+    """Return the bus for `url`: "loopback://" (or empty) or "redis://host:port/db"."""
+    if not url or url.startswith("loopback:"):
+        return LoopbackBus()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus(url)
+    raise ValueError(f"Unknown cluster bus: {url}")
+
+
+# === Worker processes ===
+def reuseport_socket(host, port, backlog=2048):
+    """
+    Listening socket bound with SO_REUSEPORT, so every worker process binds its
+    own socket to the same port and the kernel spreads connections over them.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise OSError("SO_REUSEPORT is not supported on this platform")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_workers(count, target):
+    """
+    Run target(worker_index) in `count` processes and wait for them. When one
+    exits, or on Ctrl+C, the rest are terminated so a supervisor can restart
+    the whole set.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=target, args=(index,), name=f"AgamaWorker-{index}") for index in range(count)]
+    for worker in workers:
+        worker.start()
+    try:
+        multiprocessing.connection.wait([worker.sentinel for worker in workers])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+    return [worker.exitcode for worker in workers]
@@ -0,0 +1,163 @@
+import math
+import time
+from datetime import datetime
+
+# Once every collector has run, at most this many cost="high" collectors run per tick, so
+# slow ones that fall due together are spread over consecutive ticks
+MAX_HIGH_COST_PER_TICK = 1
+
+
+def summarize_window(samples):
+    """min/max/mean/p95/count of a window of samples; p95 is the nearest-rank percentile."""
+    ordered = sorted(samples)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p95": ordered[math.ceil(len(ordered) * 0.95) - 1],
+        "count": len(ordered)
+    }
+
+
+class Collector:
+    """One metric source: fn() returns a dict of report data keys, run every `interval` seconds."""
+
+    def __init__(self, name, fn, interval, cost="low"):
+        if cost not in ("low", "high"):
+            raise ValueError(f"Unknown collector cost: {cost}")
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.cost = cost
+        self.next_due = 0.0
+        self.values = {}
+        # {data key: [samples]} since the last report for summarized collectors, else None
+        self.window = None
+        self.stats = {"runs": 0, "errors": 0, "last_ms": 0.0, "total_ms": 0.0}
+
+    def run(self, now):
+        started = time.perf_counter()
+        try:
+            self.values = self.fn()
+            if self.window is not None:
+                for key, value in self.values.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        self.window.setdefault(key, []).append(value)
+        except Exception as e:
+            # The previous values stay in the report until the next successful run
+            print(f"[{datetime.now()}] Collector {self.name} failed: {e}")
+            self.stats["errors"] += 1
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats["runs"] += 1
+        self.stats["last_ms"] = round(elapsed, 3)
+        self.stats["total_ms"] += elapsed
+        self.next_due = now + self.interval
+
+
+class CollectorRegistry:
+    """
+    Runs each registered collector on its own interval from one shared tick,
+    and merges the latest values of all of them into a report's data.
+
+    Collectors declare their cost: "high" ones (disk enumeration, process
+    scans, DNS lookups) are limited to MAX_HIGH_COST_PER_TICK per tick after
+    the first collection, so their runs do not pile up on the same tick.
+
+    A summarized collector (see summarize()) is sampled faster than reports
+    go out; report() then carries the mean of its samples since the previous
+    report as the value, and their min/max/mean/p95/count under "summaries".
+    """
+
+    def __init__(self):
+        self._collectors = {}
+
+    def register(self, name, fn, interval, cost="low"):
+        self._collectors[name] = Collector(name, fn, interval, cost)
+
+    def collector(self, name, interval, cost="low"):
+        """Decorator form of register()."""
+        def decorator(fn):
+            self.register(name, fn, interval, cost)
+            return fn
+        return decorator
+
+    def get(self, name):
+        return self._collectors[name]
+
+    def set_interval(self, name, interval):
+        self._collectors[name].interval = interval
+
+    def summarize(self, name, interval):
+        """Sample collector `name` every `interval` seconds and report summaries of its numeric values."""
+        collector = self._collectors[name]
+        collector.interval = interval
+        collector.window = {}
+
+    @property
+    def tick_interval(self):
+        """The shortest collector interval: how often run_due() needs to be called."""
+        return min(collector.interval for collector in self._collectors.values())
+
+    def run_due(self, now):
+        """Run the collectors that are due at `now`; returns their names."""
+        # Ticks fire a little late or early; count a collector due within half a tick as due
+        slack = self.tick_interval / 2
+        first = all(collector.stats["runs"] == 0 for collector in self._collectors.values())
+        ran, high_cost = [], 0
+        for collector in self._collectors.values():
+            if collector.next_due > now + slack:
+                continue
+            if collector.cost == "high" and not first:
+                if high_cost >= MAX_HIGH_COST_PER_TICK:
+                    continue  # still due, runs on a following tick
+                high_cost += 1
+            collector.run(now)
+            ran.append(collector.name)
+        return ran
+
+    def merged(self):
+        """The latest values of every collector, in registration order."""
+        data = {}
+        for collector in self._collectors.values():
+            data.update(collector.values)
+        return data
+
+    def report(self):
+        """merged(), with summarized values replaced by their window means plus "summaries"; starts new windows."""
+        data = self.merged()
+        summaries = {}
+        for collector in self._collectors.values():
+            if not collector.window:
+                continue
+            for key, samples in collector.window.items():
+                summaries[key] = summarize_window(samples)
+                data[key] = summaries[key]["mean"]
+            collector.window = {}
+        if summaries:
+            data["summaries"] = summaries
+        return data
+
+    def collect(self, now):
+        self.run_due(now)
+        return self.report()
+
+    def get_stats(self):
+        return {
+            name: dict(collector.stats, interval=collector.interval, cost=collector.cost,
+                       avg_ms=round(collector.stats["total_ms"] / max(collector.stats["runs"], 1), 3))
+            for name, collector in self._collectors.items()
+        }
+
+
+def run_on_ticks(interval, callback, offset=0.0):
+    """
+    Call callback() at offset + k * interval seconds of wall-clock time, so slow
+    calls do not push later ones back. Ticks missed while a call overran are skipped.
+    """
+    next_tick = ((time.time() - offset) // interval + 1) * interval + offset
+    while True:
+        time.sleep(max(next_tick - time.time(), 0))
+        callback()
+        next_tick += interval
+        if next_tick <= time.time():
+            next_tick = ((time.time() - offset) // interval + 1) * interval + offset
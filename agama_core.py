@@ -0,0 +1,940 @@
+import logging
+import math
+from threading import Lock, Thread, Event
+import time
+import os
+import json
+import socket
+from datetime import datetime
+from agama_alerts import AlertEngine, NotificationDispatcher, create_notifier
+from agama_cluster import create_bus
+from agama_delta import DeltaDecoder, DeltaMismatch
+from agama_fanout import FLEET_ROOM, FanoutScheduler, host_rooms, requested_rooms
+from agama_liveness import LivenessTracker
+from agama_rates import RateTracker
+from agama_segment_log import BackgroundWriter, QueueFull, SegmentLog
+from agama_state import AgentStateStore
+from agama_storage import create_storage
+from agama_timeseries import RollupEngine, TimeSeriesWriter, parse_duration, query_downsampled
+from agama_wire import MSGPACK_MIMETYPES, UnsupportedFormat, decode_report, stream_unpacker, unpackb
+
+# Server runtime shared by the Flask (Agama_server-v1-my.py) and ASGI (Agama_server_asgi.py)
+# front ends: configuration, agent state, ingest, background threads and query helpers.
+# Request helpers return (body, status, headers) for the front end to serialize.
+
+# === Configuration ===
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'User',
+    'password': 'P@$$w0rd',
+    'database': 'agamadb'
+}
+
+# "mysql" for production, "sqlite" to run locally without a MySQL service
+STORAGE_BACKEND = os.environ.get("AGAMA_STORAGE", "mysql")
+SQLITE_PATH = os.environ.get("AGAMA_SQLITE_PATH", "data/agama.db")
+POOL_CONFIG = {
+    'max_size': 8,           # Connections open at most
+    'max_idle': 300,         # Seconds before an idle connection is closed
+    'acquire_timeout': 5,    # Seconds to wait for a free connection
+    'health_check_after': 30 # Ping connections idle longer than this before reuse
+}
+
+storage = None
+
+# Raw report log: append-only NDJSON segments, rotated by size/age and gzipped once closed.
+# fsync is 'always', 'interval' (at most every fsync_interval seconds) or 'never'.
+REPORT_LOG_BASE_DIR = 'data/reports'
+# Where this process logs: the base directory, or a subdirectory per worker (see configure_worker)
+REPORT_LOG_DIR = REPORT_LOG_BASE_DIR
+REPORT_LOG_CONFIG = {
+    'max_segment_bytes': 64 * 1024 * 1024,
+    'max_segment_age': 3600,
+    'compression': 'gzip',
+    'fsync': 'interval',
+    'fsync_interval': 1.0
+}
+report_log = None
+
+# Reports reach the log through a bounded queue drained by ReportWriterThread.
+# policy: 'block' (wait up to block_timeout, then 503), 'drop-oldest' or 'shed' (503 at once)
+REPORT_QUEUE_CONFIG = {
+    'max_queue': 50000,
+    'batch_size': 1000,
+    'batch_wait': 0.05,
+    'policy': 'block',
+    'block_timeout': 2.0
+}
+SHED_RETRY_AFTER = 5
+report_writer = None
+
+# Time-series logging: unchanged values are re-written at most every TIMESERIES_REFRESH seconds,
+# so averages count each sample's value for up to that long
+METRICS_LOG_INTERVAL = 5
+TIMESERIES_REFRESH = 300
+timeseries_writer = None
+
+# Rollups and retention (seconds each tier is kept; raw also covers metricstable and data/)
+ROLLUP_INTERVAL = 60
+RETENTION = {
+    'raw': 2 * 86400,
+    '1m': 14 * 86400,
+    '1h': 180 * 86400,
+    '1d': 3 * 365 * 86400,
+}
+RETENTION_DELETE_BATCH = 5000
+rollup_engine = None
+
+# History queries: default window/resolution and the most buckets one query may return
+DEFAULT_QUERY_RANGE = 3600
+DEFAULT_QUERY_POINTS = 300
+MAX_QUERY_POINTS = 2000
+stop_event = Event()
+
+logger = logging.getLogger(__name__)
+
+# Latest report and status per agent, hash-partitioned over STATE_SHARDS locks
+STATE_SHARDS = 64
+
+# Delta reports: agents with a "seq" may send only what changed since their previous report;
+# the last full sample per host is kept to expand them (see agama_delta)
+
+# Network rates: per-second rates of the agents' cumulative network counters, computed once per
+# report at ingest (see agama_rates); reports closer together than this keep the previous baseline
+RATE_MIN_INTERVAL = 1.0
+
+# Offline detection: an agent is offline once it misses OFFLINE_TIMEOUT_FACTOR times its own
+# reporting interval (clamped to the min/max), or OFFLINE_DEFAULT_TIMEOUT before its interval is known
+OFFLINE_DEFAULT_TIMEOUT = 15
+OFFLINE_TIMEOUT_FACTOR = 3
+OFFLINE_MIN_TIMEOUT = 5
+OFFLINE_MAX_TIMEOUT = 600
+OFFLINE_CHECK_MAX_SLEEP = 1.0
+
+# Dashboard fan-out: host updates are coalesced and sent as one delta frame per subscribed room per tick.
+# Clients more than FANOUT_MAX_LAG frames behind for FANOUT_ACK_TIMEOUT seconds only get the latest state.
+# Dashboards subscribe to "fleet" (the default) or to "host:<name>", "group:<name>" and "tag:<name>" rooms;
+# agents put themselves in a group or tags with the optional "group" and "tags" report fields.
+FANOUT_INTERVAL = 0.5
+FANOUT_MAX_LAG = 4
+FANOUT_ACK_TIMEOUT = 5.0
+FANOUT_MAX_SUBSCRIPTIONS = 256
+# Frames kept for clients resuming after a reconnect (600 ticks = 5 minutes at 0.5s)
+FANOUT_HISTORY = 600
+
+# Alerting: rules from ALERT_RULES_PATH (a JSON list of rule specs, see agama_alerts.Rule) are evaluated
+# as reports arrive. Every worker sends firing/resolved events to its own dashboards as ALERT_EVENT;
+# the primary also hands them to ALERT_NOTIFIERS (plus a webhook when AGAMA_ALERT_WEBHOOK is set).
+ALERT_RULES_PATH = os.environ.get("AGAMA_ALERT_RULES", "alert_rules.json")
+ALERT_NOTIFIERS = [{"type": "file", "path": "logs/alerts.ndjson"}]
+ALERT_WEBHOOK_URL = os.environ.get("AGAMA_ALERT_WEBHOOK")
+# How often `for` durations, absence rules and stale series are checked between reports
+ALERT_SWEEP_INTERVAL = 1.0
+ALERT_STALE_AFTER = 900
+alert_dispatcher = None
+
+# Write-behind status journal: reports only mark hosts dirty, a background
+# thread writes them to the agents table every STATUS_FLUSH_INTERVAL seconds
+STATUS_FLUSH_INTERVAL = 2
+journal_lock = Lock()
+status_journal = {}
+journal_stats = {
+    "flushes": 0,
+    "flush_errors": 0,
+    "rows_written": 0,
+    "last_flush_rows": 0,
+    "last_flush_latency_ms": 0.0,
+    "max_flush_latency_ms": 0.0,
+}
+
+# Horizontal scaling: every worker applies the reports the others received, published on the
+# cluster bus, so each holds the whole fleet and serves its own dashboards from it.
+# "loopback://" keeps a single worker in-process; "redis://host:6379/0" connects worker processes or hosts.
+CLUSTER_BUS_URL = os.environ.get("AGAMA_BUS_URL", "loopback://")
+WORKER_ID = os.environ.get("AGAMA_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+# The primary worker also runs the fleet-wide jobs: offline status journaling, time-series logging and rollups
+CLUSTER_PRIMARY = os.environ.get("AGAMA_PRIMARY", "1") == "1"
+cluster_bus = None
+
+# Batch ingest limits
+MAX_BATCH_RECORDS = 5000
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl")
+
+# Streaming ingest (/report/stream): longest accepted NDJSON line, and how many per-line errors a stream keeps
+MAX_STREAM_LINE_BYTES = 1024 * 1024
+MAX_STREAM_ERRORS = 100
+
+# === Worker State ===
+class WorkerState:
+    """
+    One worker's view of the fleet: agent state, liveness, dashboard fan-out,
+    delta bases, counter baselines and alert state. ingest() shares the live
+    reports with the other workers over `bus` and on_cluster_message() applies
+    theirs, so every worker holds the whole fleet. The process runs one
+    (`worker` below); several can share a LoopbackBus in one process, e.g. in tests.
+    """
+
+    def __init__(self, worker_id, primary=False, bus=None):
+        self.worker_id = worker_id
+        self.primary = primary
+        self.bus = bus
+        self.agent_state = AgentStateStore(shards=STATE_SHARDS)
+        self.report_deltas = DeltaDecoder()
+        self.network_rates = RateTracker(min_interval=RATE_MIN_INTERVAL)
+        self.liveness = LivenessTracker(default_timeout=OFFLINE_DEFAULT_TIMEOUT, factor=OFFLINE_TIMEOUT_FACTOR,
+                                        min_timeout=OFFLINE_MIN_TIMEOUT, max_timeout=OFFLINE_MAX_TIMEOUT)
+        self.fanout = FanoutScheduler(max_lag=FANOUT_MAX_LAG, ack_timeout=FANOUT_ACK_TIMEOUT,
+                                      max_rooms=FANOUT_MAX_SUBSCRIPTIONS, history=FANOUT_HISTORY)
+        self.alert_engine = AlertEngine(stale_after=ALERT_STALE_AFTER)
+
+    def load(self, agents):
+        """Start from the agents in storage; dashboards see their status before they report again."""
+        self.agent_state.load(agents)
+        for hostname, last_seen, status in self.agent_state.items():
+            self.fanout.publish_status(hostname, status)
+            if status == "online":
+                self.liveness.track(hostname, last_seen)
+
+    def apply_reports(self, updates, now):
+        """
+        Apply {hostname: record} received at `now` to agent state, liveness tracking,
+        the dashboards and the alert rules; returns the alert events.
+        """
+        self.agent_state.report_many({hostname: record["data"] for hostname, record in updates.items()}, now)
+        self.liveness.touch_many(updates, now)
+        events = []
+        for hostname, record in updates.items():
+            group, tags = record.get("group"), record.get("tags") or ()
+            self.fanout.publish(hostname, record["data"], rooms=host_rooms(hostname, group, tags))
+            events.extend(self.alert_engine.evaluate(hostname, record["data"], now, group, tags))
+        for event in events:
+            self.fanout.publish_alert(event)
+        return events
+
+    def ingest(self, records, now):
+        """
+        Apply the live records of a validated unit (see ingest_reports) and publish
+        them on the bus; returns ({hostname: record} applied, alert events).
+        The unit's delta samples become the bases for the agents' next deltas.
+        Live records get "network_rates" computed from their counters, replacing any
+        the agent sent; new dicts, since the writer thread serializes the originals.
+        """
+        self.report_deltas.commit(records)
+        updates = {}
+        for record in records:
+            if "ts" in record:
+                continue
+            # Later records for the same host win, as if they had been posted in order
+            updates[record["hostname"]] = record
+        if not updates:
+            return updates, []
+
+        for hostname, record in updates.items():
+            rates = self.network_rates.update(hostname, record["data"], now)
+            data = {key: value for key, value in record["data"].items() if key != "network_rates"}
+            if rates:
+                data["network_rates"] = rates
+            updates[hostname] = dict(record, data=data)
+        events = self.apply_reports(updates, now)
+        self.bus.publish({"type": "reports", "origin": self.worker_id, "at": now, "records": list(updates.values())})
+        return updates, events
+
+    def on_cluster_message(self, message):
+        """Bus subscriber: apply reports another worker received; returns the alert events."""
+        if message.get("origin") == self.worker_id or message.get("type") != "reports":
+            return []
+        for record in message["records"]:
+            # Records are expanded; keep their samples so this worker can expand the next delta too.
+            # The base must be the agent's data, without the rates the other worker added.
+            if isinstance(record.get("seq"), int):
+                sample = {key: value for key, value in record["data"].items() if key != "network_rates"}
+                self.report_deltas.remember(record["hostname"], record["seq"], sample)
+            # Keep the counter baseline too, in case the agent's next report lands here
+            self.network_rates.update(record["hostname"], record["data"], message["at"])
+        return self.apply_reports({record["hostname"]: record for record in message["records"]}, message["at"])
+
+    def expire(self, now):
+        """Mark the agents that missed their deadline offline; returns their hostnames."""
+        expired = self.liveness.expire(now)
+        # Agents that reported again after their deadline was taken stay online
+        went_offline = self.agent_state.mark_offline(expired) if expired else []
+        for hostname in went_offline:
+            self.fanout.publish_status(hostname, 'offline')
+        return went_offline
+
+    def sweep_alerts(self, now):
+        events = self.alert_engine.sweep(now)
+        for event in events:
+            self.fanout.publish_alert(event)
+        return events
+
+worker = WorkerState(WORKER_ID, CLUSTER_PRIMARY)
+# This process's worker state, under the names the front ends and the helpers below use
+agent_state = worker.agent_state
+report_deltas = worker.report_deltas
+network_rates = worker.network_rates
+liveness = worker.liveness
+fanout = worker.fanout
+alert_engine = worker.alert_engine
+
+# === DB Helpers ===
+def upsert_agent_statuses(rows):
+    """
+    Upsert many (hostname, status, timestamp) rows with one multi-row statement.
+    Returns False if the write failed.
+    """
+    if not rows:
+        return True
+    try:
+        storage.upsert_agent_statuses(rows)
+        return True
+    except Exception as e:
+        logger.error(f"DB upsert error for {len(rows)} agent(s): {str(e)}", exc_info=True)
+        return False
+
+def upsert_agent_status(hostname, status, timestamp):
+    return upsert_agent_statuses([(hostname, status, timestamp)])
+
+# === Status Journal ===
+def journal_agent_status(hostname, status, timestamp):
+    """Mark a host dirty; only its latest status survives until the next flush."""
+    with journal_lock:
+        status_journal[hostname] = (status, timestamp)
+
+def flush_status_journal():
+    """Write every dirty host with one multi-row upsert, re-queueing them on failure."""
+    with journal_lock:
+        if not status_journal:
+            return 0
+        pending = dict(status_journal)
+        status_journal.clear()
+
+    started = time.perf_counter()
+    ok = upsert_agent_statuses([(hostname, status, ts) for hostname, (status, ts) in pending.items()])
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    with journal_lock:
+        if ok:
+            journal_stats["flushes"] += 1
+            journal_stats["rows_written"] += len(pending)
+            journal_stats["last_flush_rows"] = len(pending)
+            journal_stats["last_flush_latency_ms"] = round(latency_ms, 3)
+            journal_stats["max_flush_latency_ms"] = max(journal_stats["max_flush_latency_ms"], round(latency_ms, 3))
+        else:
+            journal_stats["flush_errors"] += 1
+            # Keep newer entries that arrived while we were writing
+            for hostname, entry in pending.items():
+                status_journal.setdefault(hostname, entry)
+    return len(pending) if ok else 0
+
+def get_journal_stats():
+    with journal_lock:
+        return dict(journal_stats, queue_depth=len(status_journal), flush_interval=STATUS_FLUSH_INTERVAL)
+
+def load_all_agents_from_db():
+    agents = {}
+    try:
+        agents = storage.load_agents()
+    except Exception as e:
+        logger.error(f"Error loading agents from DB: {str(e)}", exc_info=True)
+    return agents
+
+# === Utility ===
+def write_report_batch(entries):
+    """Writer-thread sink: append queued (ts, record) pairs to the segment log, then backfill history."""
+    try:
+        report_log.append_entries(entries)
+        logger.debug(f"Logged {len(entries)} report(s) to {REPORT_LOG_DIR}")
+    except Exception as e:
+        logger.error(f"Error saving {len(entries)} report(s): {str(e)}")
+        raise
+    history = [(received, record) for received, record in entries if "ts" in record]
+    if history:
+        backfill_history(history)
+
+def backfill_history(entries):
+    """Write buffered reports, (received, record) pairs, to the time series at the time they were taken."""
+    try:
+        reports = [(record["hostname"], min(record["ts"], received), record["data"]) for received, record in entries]
+        samples, disks = timeseries_writer.backfill(reports)
+        since = min(ts for _, ts, _ in reports)
+        logger.info(f"Backfilled {len(reports)} buffered report(s): {samples} metric sample(s), "
+                    f"{disks} disk sample(s) since {datetime.fromtimestamp(since)}")
+        # Rollups past `since` are recomputed by the primary, which runs them
+        if CLUSTER_PRIMARY:
+            rollup_engine.rewind(since)
+        else:
+            cluster_bus.publish({"type": "backfill", "origin": WORKER_ID, "since": since})
+    except Exception as e:
+        logger.error(f"Error backfilling {len(entries)} buffered report(s): {str(e)}", exc_info=True)
+
+def save_agent_reports(records):
+    """Queue raw reports for the writer thread; raises QueueFull when the queue is saturated."""
+    report_writer.submit(records)
+
+def save_agent_data(hostname, data):
+    save_agent_reports([data])
+
+# === Threads ===
+def check_agent_status():
+    """
+    Sleep until the earliest agent deadline, then mark the agents that missed
+    it offline. Only expired agents are looked at; the journal and dashboard
+    updates happen in one batch after the state store is updated.
+    """
+    logger.info("Starting agent status monitoring thread")
+    while not stop_event.is_set():
+        try:
+            current_time = time.time()
+            went_offline = worker.expire(current_time)
+
+            if went_offline:
+                # Every worker sees the same reports, so each flips its own view; one writes it down
+                if CLUSTER_PRIMARY:
+                    offline_at = datetime.fromtimestamp(current_time)
+                    with journal_lock:
+                        for hostname in went_offline:
+                            status_journal[hostname] = ('offline', offline_at)
+                logger.warning(f"{len(went_offline)} agent(s) marked as offline: {', '.join(went_offline[:20])}"
+                               + (" ..." if len(went_offline) > 20 else ""))
+
+            next_deadline = liveness.next_deadline()
+            delay = OFFLINE_CHECK_MAX_SLEEP if next_deadline is None else next_deadline - time.time()
+            stop_event.wait(min(max(delay, 0.01), OFFLINE_CHECK_MAX_SLEEP))
+        except Exception as e:
+            logger.error(f"Error in agent status check: {str(e)}")
+            stop_event.wait(OFFLINE_CHECK_MAX_SLEEP)
+
+def status_journal_flusher():
+    logger.info(f"Starting status journal flusher (interval {STATUS_FLUSH_INTERVAL}s)")
+    while not stop_event.wait(STATUS_FLUSH_INTERVAL):
+        try:
+            flushed = flush_status_journal()
+            if flushed:
+                logger.debug(f"Flushed {flushed} agent status row(s)")
+        except Exception as e:
+            logger.error(f"Error flushing status journal: {str(e)}", exc_info=True)
+    flush_status_journal()
+
+def prune_data_files(cutoff, limit=RETENTION_DELETE_BATCH):
+    """Delete at most `limit` legacy per-report files in data/ last modified before `cutoff`."""
+    removed = 0
+    with os.scandir('data') as entries:
+        for entry in entries:
+            if removed >= limit:
+                break
+            if entry.name.endswith('.json') and entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+def alert_sweeper():
+    logger.info(f"Starting alert sweep thread (interval {ALERT_SWEEP_INTERVAL}s)")
+    while not stop_event.wait(ALERT_SWEEP_INTERVAL):
+        try:
+            notify_alerts(worker.sweep_alerts(time.time()))
+        except Exception as e:
+            logger.error(f"Error in alert sweep: {str(e)}", exc_info=True)
+
+def rollup_worker():
+    logger.info(f"Starting rollup/retention thread (interval {ROLLUP_INTERVAL}s)")
+    while not stop_event.wait(ROLLUP_INTERVAL):
+        try:
+            now = time.time()
+            written, deleted = rollup_engine.run_once(now) if CLUSTER_PRIMARY else (0, 0)
+            # Each worker prunes its own report log
+            deleted += report_log.delete_before(now - RETENTION['raw'])
+            deleted += prune_data_files(now - RETENTION['raw'])
+            if written or deleted:
+                logger.info(f"Rollups: wrote {written} bucket(s), deleted {deleted} expired row(s)/file(s)")
+        except Exception as e:
+            logger.error(f"Error in rollup/retention pass: {str(e)}", exc_info=True)
+
+def log_metrics_to_db():
+    """Write changed per-host metrics to the normalized time-series tables."""
+    while not stop_event.wait(METRICS_LOG_INTERVAL):
+        try:
+            snapshot = agent_state.metrics_snapshot()
+
+            if not snapshot:
+                continue
+
+            samples, disks = timeseries_writer.write(snapshot)
+            if samples or disks:
+                logger.info(f"Logged {samples} metric sample(s) and {disks} disk sample(s) to database.")
+
+        except Exception as e:
+            logger.error(f"Error logging metrics to DB: {str(e)}", exc_info=True)
+
+# === Ingest ===
+def validate_report(record):
+    """Return an error message for a malformed report record, or None if it is usable."""
+    if not isinstance(record, dict):
+        return "Record must be a JSON object"
+    hostname = record.get("hostname")
+    if not isinstance(hostname, str) or not hostname:
+        return "Missing or invalid 'hostname'"
+    if "data" not in record:
+        return "Missing 'data'"
+    if not isinstance(record["data"], dict):
+        return "'data' must be an object"
+    if not isinstance(record.get("group") or "", str):
+        return "Invalid 'group'"
+    tags = record.get("tags") or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        return "Invalid 'tags'"
+    if "ts" in record and (not isinstance(record["ts"], (int, float)) or isinstance(record["ts"], bool)):
+        return "Invalid 'ts'"
+    return None
+
+def expand_report(record, pending=None):
+    """
+    Return the full report for a delta report, expanded against the host's previous sample.
+    Raises DeltaMismatch when that sample is unknown (the agent must send a keyframe),
+    ValueError for a malformed delta.
+    Samples are only kept once ingest_reports() stored them; `pending` carries the ones
+    of earlier records in the same unit (see DeltaDecoder.expand).
+    """
+    if isinstance(record, dict) and ("seq" in record or "delta" in record):
+        return report_deltas.expand(record, pending)
+    return record
+
+def ingest_reports(records):
+    """
+    Apply validated report records as one unit: one lock acquisition per state shard,
+    one status journal update and one fan-out publish per host, then share them with
+    the other workers in one bus message.
+    Raw reports are queued for disk first, so a QueueFull rejects the
+    whole unit before any state changes.
+    Records with a "ts" (unix seconds when the agent took the sample) are history an
+    agent buffered while the server was unreachable: the writer thread adds them to
+    the time series at that time, and they leave live state alone.
+    """
+    save_agent_reports(records)
+
+    now = time.time()
+    updates, events = worker.ingest(records, now)
+    if updates:
+        seen_at = datetime.fromtimestamp(now)
+        with journal_lock:
+            for hostname in updates:
+                status_journal[hostname] = ('online', seen_at)
+    notify_alerts(events)
+
+def on_cluster_message(message):
+    """Bus subscriber: apply reports another worker received (that worker logs and journals them)."""
+    if message.get("type") == "backfill":
+        if CLUSTER_PRIMARY and message.get("origin") != WORKER_ID:
+            rollup_engine.rewind(message["since"])
+        return
+    notify_alerts(worker.on_cluster_message(message))
+
+# === Alerts ===
+def load_alert_rules(path=None):
+    """Compile the rules in `path` (default ALERT_RULES_PATH); a missing file means no rules."""
+    path = path or ALERT_RULES_PATH
+    if not os.path.exists(path):
+        logger.info(f"No alert rules at {path}; alerting is idle")
+        return 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            rules = json.load(f)
+        alert_engine.load(rules)
+        logger.info(f"Loaded {len(rules)} alert rule(s) from {path}")
+        return len(rules)
+    except (OSError, TypeError, ValueError) as e:
+        logger.error(f"Error loading alert rules from {path}: {str(e)}")
+        return 0
+
+def notify_alerts(events):
+    """Log alert events and hand them to the notifiers; only the primary does, the others just show them."""
+    if not events:
+        return
+    if CLUSTER_PRIMARY:
+        for event in events:
+            log = logger.warning if event["state"] == "firing" else logger.info
+            log(f"Alert {event['state']}: {event['message']}")
+        if alert_dispatcher is not None:
+            alert_dispatcher.submit(events)
+
+def list_alerts():
+    alerts = alert_engine.active()
+    return {"alerts": alerts, "count": len(alerts), "rules": alert_engine.rules()}, 200, {}
+
+def parse_report_body(mimetype, body):
+    """Decode a /report body: JSON, or MessagePack (a plain map or a compact report). None if malformed."""
+    try:
+        if mimetype in MSGPACK_MIMETYPES:
+            return decode_report(unpackb(body), time.time())
+        return json.loads(body)
+    except ValueError:
+        return None
+
+def parse_batch_body(mimetype, body):
+    """
+    Decode a /report/batch body (bytes) into a list of (index, record, error) tuples,
+    or None if it is neither a JSON array, {"records": [...]}, an NDJSON stream,
+    nor a MessagePack array of reports.
+    """
+    if mimetype in MSGPACK_MIMETYPES:
+        try:
+            payload = unpackb(body)
+        except ValueError:
+            return None
+        if isinstance(payload, dict) and isinstance(payload.get("records"), list):
+            payload = payload["records"]
+        if not isinstance(payload, list):
+            return None
+        now = time.time()
+        entries = []
+        for index, record in enumerate(payload):
+            try:
+                entries.append((index, decode_report(record, now), None))
+            except ValueError as e:
+                entries.append((index, None, str(e)))
+        return entries
+
+    text = body.decode("utf-8", errors="replace") if isinstance(body, bytes) else body
+    if mimetype in NDJSON_MIMETYPES:
+        entries = []
+        lines = [line for line in text.splitlines() if line.strip()]
+        for index, line in enumerate(lines):
+            try:
+                entries.append((index, json.loads(line), None))
+            except ValueError as e:
+                entries.append((index, None, f"Invalid JSON: {str(e)}"))
+        return entries
+
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(payload, dict) and isinstance(payload.get("records"), list):
+        payload = payload["records"]
+    if not isinstance(payload, list):
+        return None
+    return [(index, record, None) for index, record in enumerate(payload)]
+
+def shed_response(what):
+    logger.warning(f"Shedding {what}: report queue full")
+    return {"error": "Server busy, retry later"}, 503, {"Retry-After": str(SHED_RETRY_AFTER)}
+
+def handle_report(data):
+    """POST /report: ingest one {"hostname", "data"} record, or a delta report."""
+    try:
+        data = expand_report(data)
+        error = validate_report(data) if data else "Invalid payload"
+    except DeltaMismatch as e:
+        return {"error": str(e), "resync": True}, 409, {}
+    except ValueError as e:
+        error = str(e)
+    if error:
+        return {"error": error}, 400, {}
+    try:
+        ingest_reports([data])
+    except QueueFull:
+        return shed_response("report")
+    return {"message": "Data received"}, 200, {}
+
+def handle_report_body(mimetype, body):
+    """POST /report with its raw body, in any supported encoding."""
+    try:
+        data = parse_report_body(mimetype, body)
+    except UnsupportedFormat as e:
+        return {"error": str(e)}, 415, {}
+    logger.info(f"Received data from agent: {str(data)[:200]}...")
+    return handle_report(data)
+
+def handle_report_batch_body(mimetype, body):
+    """POST /report/batch with its raw body, in any supported encoding."""
+    try:
+        entries = parse_batch_body(mimetype, body)
+    except UnsupportedFormat as e:
+        return {"error": str(e)}, 415, {}
+    return handle_report_batch(entries)
+
+def handle_report_batch(entries):
+    """POST /report/batch: ingest the valid records of a parsed batch, report the rest."""
+    if entries is None:
+        return {"error": "Expected a JSON array or NDJSON body"}, 400, {}
+    if len(entries) > MAX_BATCH_RECORDS:
+        return {"error": f"Batch exceeds {MAX_BATCH_RECORDS} records"}, 413, {}
+
+    accepted, errors = [], []
+    pending = {}
+    for index, record, error in entries:
+        resync = False
+        if not error:
+            try:
+                record = expand_report(record, pending)
+                error = validate_report(record)
+            except ValueError as e:
+                error, resync = str(e), isinstance(e, DeltaMismatch)
+        if error:
+            errors.append({"index": index, "error": error, "resync": True} if resync else
+                          {"index": index, "error": error})
+        else:
+            accepted.append(record)
+
+    if accepted:
+        try:
+            ingest_reports(accepted)
+        except QueueFull:
+            return shed_response("batch report")
+    logger.info(f"Batch report: {len(accepted)} accepted, {len(errors)} rejected")
+
+    status_code = 200 if accepted or not errors else 400
+    return {
+        "message": "Batch processed",
+        "accepted": len(accepted),
+        "rejected": len(errors),
+        "errors": errors
+    }, status_code, {}
+
+class ReportStreamIngest:
+    """
+    POST /report/stream: agents keep one chunked request open and write one NDJSON
+    report per line, or with a MessagePack Content-Type, one MessagePack report after
+    another. feed() takes body data as it arrives and ingests the complete reports in
+    it as one unit; it returns a (body, status, headers) response when the stream has
+    to be cut short, else None. finish() answers once the agent ends the stream.
+    A delta report the server cannot expand ends the stream with 409, so the agent
+    reconnects and starts over with a keyframe.
+    Raises UnsupportedFormat for MessagePack when this server cannot decode it.
+    """
+
+    def __init__(self, peer, mimetype=None):
+        self.peer = peer
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+        self._partial = b""
+        self._next_index = 0
+        self._unpacker = stream_unpacker(MAX_STREAM_LINE_BYTES) if mimetype in MSGPACK_MIMETYPES else None
+
+    def feed(self, chunk):
+        if self._unpacker is not None:
+            return self._feed_msgpack(chunk)
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_STREAM_LINE_BYTES:
+            return self._response({"error": f"Line exceeds {MAX_STREAM_LINE_BYTES} bytes"}, 413)
+        return self._ingest(lines)
+
+    def _feed_msgpack(self, chunk):
+        try:
+            self._unpacker.feed(chunk)
+        except Exception:  # msgpack's BufferFull
+            return self._response({"error": f"Report exceeds {MAX_STREAM_LINE_BYTES} bytes"}, 413)
+        reports = []
+        try:
+            for value in self._unpacker:
+                reports.append(value)
+        except Exception as e:
+            # The stream cannot be resynchronized after a malformed value
+            self._ingest(reports)
+            return self._response({"error": f"Invalid MessagePack: {str(e) or type(e).__name__}"}, 400)
+        return self._ingest(reports)
+
+    def finish(self):
+        error = self._ingest([self._partial]) if self._unpacker is None else None
+        self._partial = b""
+        return error or self._response({"message": "Stream closed"}, 200)
+
+    def _ingest(self, items):
+        """Ingest NDJSON lines, or decoded MessagePack values in MessagePack mode."""
+        accepted = []
+        pending = {}
+        resync = None
+        now = time.time()
+        for item in items:
+            if self._unpacker is None and not item.strip():
+                continue
+            index, self._next_index = self._next_index, self._next_index + 1
+            try:
+                record = json.loads(item) if self._unpacker is None else decode_report(item, now)
+            except ValueError as e:
+                record, error = None, f"Invalid {'JSON' if self._unpacker is None else 'report'}: {str(e)}"
+            else:
+                try:
+                    record = expand_report(record, pending)
+                    error = validate_report(record)
+                except DeltaMismatch as e:
+                    resync = error = str(e)
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                self.rejected += 1
+                if len(self.errors) < MAX_STREAM_ERRORS:
+                    self.errors.append({"index": index, "error": error})
+                if resync:
+                    # Deltas after this one build on the missing sample as well
+                    break
+            else:
+                accepted.append(record)
+        if accepted:
+            try:
+                ingest_reports(accepted)
+            except QueueFull:
+                logger.warning(f"Closing report stream from {self.peer}: report queue full")
+                return self._response({"error": "Server busy, retry later"}, 503,
+                                      {"Retry-After": str(SHED_RETRY_AFTER)})
+            self.accepted += len(accepted)
+        if resync:
+            return self._response({"error": resync, "resync": True}, 409)
+        return None
+
+    def _response(self, body, status, headers=None):
+        logger.info(f"Report stream from {self.peer} ended ({status}): "
+                    f"{self.accepted} accepted, {self.rejected} rejected")
+        body.update(accepted=self.accepted, rejected=self.rejected, errors=self.errors)
+        return body, status, headers or {}
+
+# === Queries ===
+def list_agents():
+    result = []
+    for hostname, last_seen, status in agent_state.items():
+        result.append({
+            "hostname": hostname,
+            "status": status,
+            "last_seen": datetime.fromtimestamp(last_seen).strftime("%Y-%m-%d %H:%M:%S"),
+            "offline_timeout": round(liveness.timeout_for(hostname), 1)
+        })
+    return {"agents": result, "count": len(result)}, 200, {}
+
+def dashboard_snapshot(args):
+    """
+    Current dashboard state as a frame: {"epoch", "seq", "full", "hosts"}.
+    ?rooms= limits it to comma separated rooms (default "fleet"); with
+    ?since=<seq>&epoch=<epoch> only the changes after that frame are
+    returned while the server still holds them.
+    """
+    rooms = [room for room in args.get("rooms", "").split(",") if room] or [FLEET_ROOM]
+    since = args.get("since")
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return {"error": "'since' must be an integer sequence number"}, 400, {}
+    return fanout.snapshot(rooms, since=since, epoch=args.get("epoch")), 200, {}
+
+def parse_time_param(value, now):
+    """Accept unix seconds, an ISO 8601 datetime, or a duration before now such as "-6h"."""
+    if value.startswith("-"):
+        return now - parse_duration(value[1:])
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def query_metrics(hostname, args):
+    """GET /metrics/<hostname>: downsampled history, from the rollup tiers where they cover the range."""
+    now = time.time()
+    try:
+        end = parse_time_param(args.get("to", str(now)), now)
+        start = parse_time_param(args.get("from", f"-{DEFAULT_QUERY_RANGE}"), now)
+        step = args.get("step")
+        step = parse_duration(step) if step else (end - start) / DEFAULT_QUERY_POINTS
+    except ValueError as e:
+        return {"error": f"Invalid query parameter: {str(e)}"}, 400, {}
+    if not all(math.isfinite(value) for value in (start, end, step)):
+        return {"error": "Invalid query parameter: 'from', 'to' and 'step' must be finite"}, 400, {}
+    if end <= start or step <= 0:
+        return {"error": "'from' must be before 'to' and 'step' must be positive"}, 400, {}
+
+    # Never return more than MAX_QUERY_POINTS buckets per series, and align
+    # buckets to multiples of step so repeated queries share boundaries
+    step = max(step, (end - start) / MAX_QUERY_POINTS)
+    start = (start // step) * step
+    metrics = args.get("metric")
+    metrics = [m for m in metrics.split(",") if m] if metrics else None
+
+    plan = rollup_engine.plan(start, end, step, now)
+    series = query_downsampled(storage, hostname, start, end, step, metrics=metrics,
+                               fill_window=TIMESERIES_REFRESH, plan=plan)
+    return {
+        "hostname": hostname,
+        "from": start,
+        "to": end,
+        "step": step,
+        "sources": [{"tier": tier or "raw", "from": seg_start, "to": seg_end} for tier, seg_start, seg_end in plan],
+        "series": series
+    }, 200, {}
+
+def server_stats():
+    return {
+        "status_journal": get_journal_stats(),
+        "db_pool": dict(storage.pool.stats, max_size=storage.pool.max_size),
+        "timeseries": timeseries_writer.get_stats(),
+        "rollups": rollup_engine.get_stats(),
+        "report_log": report_log.get_stats(),
+        "report_writer": report_writer.get_stats(),
+        "fanout": fanout.get_stats(),
+        "liveness": liveness.get_stats(),
+        "agent_state": agent_state.get_stats(),
+        "deltas": report_deltas.get_stats(),
+        "network_rates": network_rates.get_stats(),
+        "alerts": dict(alert_engine.get_stats(),
+                       notifications=alert_dispatcher.get_stats() if alert_dispatcher else None),
+        "cluster": dict(cluster_bus.get_stats(), worker=WORKER_ID, primary=CLUSTER_PRIMARY)
+    }, 200, {}
+
+# === Dashboards ===
+def dashboard_connected(sid, auth):
+    # Dashboards may pass their initial rooms as connect auth, so they never receive the whole fleet,
+    # and the epoch/seq of the last frame they saw, so a reconnect only sends what they missed
+    auth = auth if isinstance(auth, dict) else {}
+    return fanout.add_client(sid, time.time(), rooms=requested_rooms(auth),
+                             since=auth.get("since"), epoch=auth.get("epoch"))
+
+# === Lifecycle ===
+def configure_worker(worker_id, primary, bus_url=None):
+    """
+    Set this process up as one of several workers: call before start_services().
+    Each worker keeps its raw report log in its own directory.
+    """
+    global WORKER_ID, CLUSTER_PRIMARY, CLUSTER_BUS_URL, REPORT_LOG_DIR
+    WORKER_ID = worker.worker_id = worker_id
+    CLUSTER_PRIMARY = worker.primary = primary
+    CLUSTER_BUS_URL = bus_url or CLUSTER_BUS_URL
+    REPORT_LOG_DIR = os.path.join(REPORT_LOG_BASE_DIR, worker_id)
+
+def start_services():
+    """Open storage and the report log, load known agents and start the background threads."""
+    global storage, timeseries_writer, rollup_engine, report_log, report_writer, cluster_bus, alert_dispatcher
+    cluster_bus = worker.bus = create_bus(CLUSTER_BUS_URL)
+    cluster_bus.subscribe(on_cluster_message)
+    cluster_bus.start()
+    report_log = SegmentLog(REPORT_LOG_DIR, **REPORT_LOG_CONFIG)
+    # The log only syncs as reports arrive; sync what is left once the writer goes idle
+    report_writer = BackgroundWriter(write_report_batch, idle=report_log.sync_due,
+                                     idle_interval=REPORT_LOG_CONFIG['fsync_interval'], **REPORT_QUEUE_CONFIG).start()
+    storage = create_storage(STORAGE_BACKEND, db_config=DB_CONFIG, sqlite_path=SQLITE_PATH, pool_config=POOL_CONFIG)
+    timeseries_writer = TimeSeriesWriter(storage, refresh_interval=TIMESERIES_REFRESH)
+    rollup_engine = RollupEngine(storage, RETENTION, lag=2 * METRICS_LOG_INTERVAL + 60,
+                                 delete_batch=RETENTION_DELETE_BATCH, stop_event=stop_event, hold=TIMESERIES_REFRESH)
+    logger.info(f"Using {STORAGE_BACKEND} storage backend; worker {WORKER_ID}"
+                + (" (primary)" if CLUSTER_PRIMARY else "") + f" on {CLUSTER_BUS_URL.split('@')[-1]}")
+    worker.load(load_all_agents_from_db())
+
+    load_alert_rules()
+    if CLUSTER_PRIMARY:
+        notifiers = ALERT_NOTIFIERS + ([{"type": "webhook", "url": ALERT_WEBHOOK_URL}] if ALERT_WEBHOOK_URL else [])
+        alert_dispatcher = NotificationDispatcher([create_notifier(spec) for spec in notifiers]).start()
+
+    Thread(target=check_agent_status, name="AgentStatusThread", daemon=True).start()
+    if CLUSTER_PRIMARY:
+        Thread(target=log_metrics_to_db, name="MySQLLoggerThread", daemon=True).start()
+    Thread(target=status_journal_flusher, name="StatusJournalThread", daemon=True).start()
+    Thread(target=rollup_worker, name="RollupThread", daemon=True).start()
+    Thread(target=alert_sweeper, name="AlertSweepThread", daemon=True).start()
+
+def stop_services():
+    """Stop the background threads and flush everything still queued."""
+    stop_event.set()
+    flush_status_journal()
+    report_writer.stop()
+    report_log.close()
+    if alert_dispatcher is not None:
+        alert_dispatcher.stop()
+    cluster_bus.close()
+    storage.close()
@@ -0,0 +1,162 @@
+import threading
+
+_MISSING = object()
+
+
+def diff(old, new):
+    """
+    Return the changes that turn dict `old` into dict `new`.
+
+    Nested dicts are diffed recursively; a key removed from `new` appears
+    with the value None, so None cannot be used as a real value.
+    """
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = diff(previous, value)
+            if nested:
+                delta[key] = nested
+        elif previous != value or previous is _MISSING:
+            delta[key] = value
+    for key in old:
+        if key not in new:
+            delta[key] = None
+    return delta
+
+
+def apply(base, delta):
+    """Return a copy of `base` with `delta` (as produced by diff()) applied."""
+    result = dict(base)
+    for key, value in delta.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = apply(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def merge(older, newer):
+    """Combine two consecutive deltas into one, the newer values winning."""
+    result = dict(older)
+    for key, value in newer.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def _sample(report):
+    """(hostname, seq, data) of a full report with a seq, else None."""
+    seq, hostname, data = report.get("seq"), report.get("hostname"), report.get("data")
+    if isinstance(seq, int) and isinstance(hostname, str) and isinstance(data, dict):
+        return hostname, seq, data
+    return None
+
+
+class DeltaMismatch(ValueError):
+    """A delta report refers to a base sample the receiver does not hold."""
+
+
+class DeltaEncoder:
+    """
+    Agent side of delta reports. encode() turns successive full reports into a
+    keyframe, {"hostname", "seq", "data", ...}, every `keyframe_interval`
+    reports and after reset(), and in between into deltas against the
+    previous report, {"hostname", "seq", "base", "delta", ...}.
+    Call reset() whenever a report may not have reached the server.
+    """
+
+    def __init__(self, keyframe_interval=60):
+        self.keyframe_interval = keyframe_interval
+        self._seq = 0
+        self._base = None  # (seq, data) of the last report encoded
+        self._since_keyframe = 0
+
+    def reset(self):
+        self._base = None
+
+    def encode(self, payload):
+        self._seq += 1
+        data = payload["data"]
+        if self._base is None or self._since_keyframe >= self.keyframe_interval:
+            report = dict(payload, seq=self._seq)
+            self._since_keyframe = 0
+        else:
+            report = {key: value for key, value in payload.items() if key != "data"}
+            report.update(seq=self._seq, base=self._base[0], delta=diff(self._base[1], data))
+        self._since_keyframe += 1
+        self._base = (self._seq, data)
+        return report
+
+
+class DeltaDecoder:
+    """
+    Server side of delta reports: keeps the last full data and seq per host
+    and expands delta reports back into full ones. Reports without a seq pass
+    through untouched.
+
+    expand() does not change what is kept; commit() the expanded reports once
+    they are stored, so a rejected or shed report never becomes the base the
+    next delta is expanded against.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bases = {}
+        self.stats = {"keyframes": 0, "deltas": 0, "mismatches": 0}
+
+    def remember(self, hostname, seq, data):
+        """Record a full sample, e.g. one another worker received."""
+        with self._lock:
+            self._bases[hostname] = (seq, data)
+
+    def commit(self, reports):
+        """Keep the samples of expanded reports that were stored, the last one per host winning."""
+        with self._lock:
+            for report in reports:
+                sample = _sample(report)
+                if sample:
+                    self._bases[sample[0]] = sample[1:]
+
+    def expand(self, report, pending=None):
+        """
+        Return `report` with full "data"; raises DeltaMismatch or ValueError for unusable deltas.
+        `pending` ({hostname: (seq, data)}) holds the samples of reports expanded earlier in
+        the same unit and not committed yet; expand() adds this report's sample to it.
+        """
+        seq = report.get("seq")
+        if "delta" not in report:
+            sample = _sample(report)
+            if sample:
+                if pending is not None:
+                    pending[sample[0]] = sample[1:]
+                with self._lock:
+                    self.stats["keyframes"] += 1
+            return report
+
+        hostname, base, delta = report.get("hostname"), report.get("base"), report["delta"]
+        if not isinstance(hostname, str) or not isinstance(seq, int) or not isinstance(base, int) \
+                or not isinstance(delta, dict):
+            raise ValueError("Delta reports need 'hostname', integer 'seq' and 'base', and a 'delta' object")
+        with self._lock:
+            known = pending.get(hostname) if pending else None
+            if known is None:
+                known = self._bases.get(hostname)
+            if known is None or known[0] != base:
+                self.stats["mismatches"] += 1
+                raise DeltaMismatch(f"No sample {base} for {hostname}, send a keyframe")
+            data = apply(known[1], delta)
+            self.stats["deltas"] += 1
+        if pending is not None:
+            pending[hostname] = (seq, data)
+        full = {key: value for key, value in report.items() if key not in ("base", "delta")}
+        full["data"] = data
+        return full
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, hosts=len(self._bases))
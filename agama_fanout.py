@@ -0,0 +1,375 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+import agama_delta
+
+FRAME_EVENT = "metricsFrame"
+ALERT_EVENT = "alertEvent"
+ACK_EVENT = "frameAck"
+SUBSCRIBE_EVENT = "subscribe"
+UNSUBSCRIBE_EVENT = "unsubscribe"
+
+# Subscription rooms: FLEET_ROOM carries every host, "host:<name>", "group:<name>"
+# and "tag:<name>" only the hosts with that name, group or tag
+FLEET_ROOM = "fleet"
+ROOM_PREFIXES = ("host", "group", "tag")
+MAX_ROOM_NAME = 200
+
+logger = logging.getLogger(__name__)
+
+
+def host_rooms(hostname, group=None, tags=()):
+    """Return the set of rooms a host's updates are delivered to."""
+    rooms = {FLEET_ROOM, f"host:{hostname}"}
+    if group:
+        rooms.add(f"group:{group}")
+    rooms.update(f"tag:{tag}" for tag in tags if tag)
+    return frozenset(rooms)
+
+
+def valid_room(room):
+    if not isinstance(room, str) or len(room) > MAX_ROOM_NAME:
+        return False
+    if room == FLEET_ROOM:
+        return True
+    prefix, _, name = room.partition(":")
+    return prefix in ROOM_PREFIXES and bool(name)
+
+
+def requested_rooms(data):
+    """Extract the room list from a subscription payload: {"rooms": [...]} or a bare list."""
+    if isinstance(data, dict):
+        data = data.get("rooms")
+    if isinstance(data, str):
+        data = [data]
+    return [room for room in data if isinstance(room, str)] if isinstance(data, list) else []
+
+
+class ClientView:
+    """Fan-out state of one connected dashboard."""
+
+    __slots__ = ("sid", "rooms", "live", "acked_seq", "acked_at", "sent_seq", "sent_at", "in_flight", "pending")
+
+    def __init__(self, sid, rooms, seq, now):
+        self.sid = sid
+        self.rooms = set(rooms)  # subscribed rooms
+        self.live = True        # member of its subscribed rooms
+        self.acked_seq = seq    # newest frame the client confirmed
+        self.acked_at = now
+        self.sent_seq = seq     # newest frame sent to it
+        self.sent_at = now
+        self.in_flight = collections.deque()  # seqs sent but not yet acknowledged
+        self.pending = {}       # coalesced changes held back while it lags
+
+
+class FanoutScheduler:
+    """
+    Coalesces per-host updates and sends dashboards at most one frame per room per tick.
+
+    Ingest calls publish()/publish_status(); only the latest value per host
+    survives until the next tick. Each tick diffs every dirty host against
+    what was last sent and emits one FRAME_EVENT with only the changed
+    fields, {"seq": n, "hosts": {host: {"status", "data"}}}, to each room
+    that has a live subscriber and covers a changed host. Rooms are
+    FLEET_ROOM or "host:"/"group:"/"tag:" names (see host_rooms()), so a
+    dashboard watching a few hosts never receives the rest of the fleet and
+    hosts nobody watches cost nothing to fan out. A host covered by several
+    of a client's rooms arrives once per room; deltas are idempotent.
+
+    Every frame's changes are also kept in a ring buffer of the last
+    `history` sequence numbers, so a reconnecting client that presents the
+    `epoch` and last `seq` it saw gets only the merged deltas it missed;
+    otherwise, or when it fell out of the buffer, it gets full state.
+
+    Clients acknowledge frames with ACK_EVENT. A client with more than
+    `max_lag` unacknowledged frames and no ack for `ack_timeout` seconds is
+    taken out of its rooms; changes to its hosts are merged into a single
+    pending delta (stale intermediate values are overwritten, never queued)
+    and sent to it alone once it acks, or every `ack_timeout` seconds.
+
+    Alert events (see agama_alerts) queued with publish_alert() go out on
+    the next tick as one ALERT_EVENT, {"alerts": [event, ...]}, per live
+    room covering their host. They are not kept for lagging or resuming
+    clients; those fetch the firing alerts over HTTP.
+
+    Nothing here performs I/O: methods return ("emit", event, data, to),
+    ("join", sid, room) and ("leave", sid, room) actions for the server's
+    Socket.IO layer to carry out.
+    """
+
+    def __init__(self, max_lag=4, ack_timeout=5.0, max_rooms=256, history=600):
+        self.max_lag = max_lag
+        self.ack_timeout = ack_timeout
+        self.max_rooms = max_rooms
+        # Sequence numbers restart with the process; the epoch tells clients they did
+        self.epoch = f"{int(time.time() * 1000):x}-{os.getpid()}"
+        self.seq = 0
+        self._history = collections.deque(maxlen=history)  # (seq, changes) of recent frames
+        self._lock = threading.Lock()
+        self._dirty = {}        # hostname -> {"data": metrics, "status": status}
+        self._sent_data = {}    # hostname -> metrics as last sent
+        self._sent_status = {}  # hostname -> status as last sent
+        self._labels = {}       # hostname -> rooms it is delivered to
+        self._clients = {}
+        self._live_members = collections.Counter()  # room -> live clients in it
+        self._alerts = []       # alert events waiting for the next tick
+        self.stats = {"frames": 0, "catch_up_frames": 0, "updates_coalesced": 0, "lagging_clients": 0,
+                      "resumes": 0, "full_snapshots": 0, "alert_frames": 0, "update_errors": 0}
+
+    # --- ingest side ---
+    def publish(self, hostname, metrics, status="online", rooms=None):
+        rooms = rooms or host_rooms(hostname)
+        with self._lock:
+            if self._labels.get(hostname) != rooms:
+                if hostname in self._labels:
+                    # New subscribers of the host need all of its data, not a delta
+                    self._sent_data.pop(hostname, None)
+                self._labels[hostname] = rooms
+            entry = self._dirty.setdefault(hostname, {})
+            if "data" in entry:
+                self.stats["updates_coalesced"] += 1
+            entry["data"] = metrics
+            entry["status"] = status
+
+    def publish_status(self, hostname, status):
+        with self._lock:
+            self._dirty.setdefault(hostname, {})["status"] = status
+
+    def publish_alert(self, event):
+        with self._lock:
+            self._alerts.append(event)
+
+    def _rooms_of(self, hostname):
+        return self._labels.get(hostname) or host_rooms(hostname)
+
+    # --- client side ---
+    def snapshot(self, rooms=(FLEET_ROOM,), since=None, epoch=None):
+        """
+        Frame bringing a client watching `rooms` up to the current seq: only
+        the changes after `since` when the ring buffer still covers them and
+        `epoch` matches, otherwise every host's last sent status and data.
+        """
+        with self._lock:
+            return self._snapshot_locked(rooms, since, epoch)
+
+    def _snapshot_locked(self, rooms, since, epoch):
+        missed = self._missed_locked(rooms, since) if epoch == self.epoch else None
+        if missed is not None:
+            self.stats["resumes"] += 1
+            return {"epoch": self.epoch, "seq": self.seq, "since": since, "hosts": missed}
+        self.stats["full_snapshots"] += 1
+        return {"epoch": self.epoch, "seq": self.seq, "full": True, "hosts": self._full_state_locked(rooms)}
+
+    def _missed_locked(self, rooms, since):
+        """Merged changes to hosts in `rooms` after seq `since`, or None if the history no longer covers it."""
+        if not isinstance(since, int) or since > self.seq:
+            return None
+        if since < self.seq and (not self._history or self._history[0][0] > since + 1):
+            return None
+        missed = {}
+        for seq, changes in self._history:
+            if seq <= since:
+                continue
+            for hostname, entry in changes.items():
+                if not self._rooms_of(hostname).isdisjoint(rooms):
+                    missed[hostname] = agama_delta.merge(missed[hostname], entry) if hostname in missed else entry
+        return missed
+
+    def _full_state_locked(self, rooms):
+        hosts = {}
+        for hostname in self._sent_data.keys() | self._sent_status.keys():
+            if self._rooms_of(hostname).isdisjoint(rooms):
+                continue
+            entry = {}
+            if hostname in self._sent_status:
+                entry["status"] = self._sent_status[hostname]
+            if hostname in self._sent_data:
+                entry["data"] = self._sent_data[hostname]
+            hosts[hostname] = entry
+        return hosts
+
+    def _enter(self, client, rooms, actions):
+        for room in rooms:
+            self._live_members[room] += 1
+            actions.append(("join", client.sid, room))
+
+    def _exit(self, client, rooms, actions):
+        for room in rooms:
+            self._live_members[room] -= 1
+            if self._live_members[room] <= 0:
+                del self._live_members[room]
+            actions.append(("leave", client.sid, room))
+
+    def add_client(self, sid, now, rooms=None, since=None, epoch=None):
+        """
+        Register a dashboard subscribed to `rooms` (default FLEET_ROOM); returns
+        actions that join it to them and send it a snapshot (see snapshot()).
+        """
+        rooms = [room for room in rooms or () if valid_room(room)][:self.max_rooms] or [FLEET_ROOM]
+        actions = []
+        with self._lock:
+            client = ClientView(sid, rooms, self.seq, now)
+            self._clients[sid] = client
+            self._enter(client, client.rooms, actions)
+            frame = self._snapshot_locked(client.rooms, since, epoch)
+        actions.append(("emit", FRAME_EVENT, frame, sid))
+        return actions
+
+    def remove_client(self, sid):
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            if client is not None and client.live:
+                self._exit(client, client.rooms, [])
+
+    def subscribe(self, sid, rooms):
+        """
+        Add rooms to a client's subscriptions. Returns (rooms added, actions);
+        the actions join the rooms and send the client their hosts' full state.
+        """
+        actions = []
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return [], actions
+            added = []
+            for room in rooms:
+                if valid_room(room) and room not in client.rooms and len(client.rooms) < self.max_rooms:
+                    client.rooms.add(room)
+                    added.append(room)
+            if not added:
+                return added, actions
+            if client.live:
+                self._enter(client, added, actions)
+            hosts = self._full_state_locked(added)
+        if hosts:
+            actions.append(("emit", FRAME_EVENT, {"seq": self.seq, "full": True, "hosts": hosts}, sid))
+        return added, actions
+
+    def unsubscribe(self, sid, rooms):
+        """
+        Remove rooms from a client's subscriptions. Returns (hosts no longer
+        covered by any of its rooms, actions).
+        """
+        actions = []
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return [], actions
+            removed = [room for room in set(rooms) if room in client.rooms]
+            if not removed:
+                return [], actions
+            client.rooms.difference_update(removed)
+            if client.live:
+                self._exit(client, removed, actions)
+            dropped = [
+                hostname for hostname, labels in self._labels.items()
+                if not labels.isdisjoint(removed) and labels.isdisjoint(client.rooms)
+            ]
+            for hostname in dropped:
+                client.pending.pop(hostname, None)
+        return dropped, actions
+
+    def ack(self, sid, seq):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is not None and isinstance(seq, int) and seq > client.acked_seq:
+                client.acked_seq = min(seq, client.sent_seq)
+                client.acked_at = time.time()
+                while client.in_flight and client.in_flight[0] <= client.acked_seq:
+                    client.in_flight.popleft()
+
+    # --- scheduler ---
+    def _collect_changes(self):
+        dirty, self._dirty = self._dirty, {}
+        changes = {}
+        for hostname, update in dirty.items():
+            entry = {}
+            if "data" in update:
+                # One host's unusable data must not cost the others their frame
+                try:
+                    delta = agama_delta.diff(self._sent_data.get(hostname, {}), update["data"])
+                except Exception as e:
+                    self.stats["update_errors"] += 1
+                    logger.error(f"Dropped update for {hostname}: {str(e)}")
+                    delta = None
+                else:
+                    self._sent_data[hostname] = update["data"]
+                if delta:
+                    entry["data"] = delta
+            status = update.get("status")
+            if status is not None and status != self._sent_status.get(hostname):
+                entry["status"] = status
+                self._sent_status[hostname] = status
+            if entry:
+                changes[hostname] = entry
+        return changes
+
+    def tick(self, now):
+        actions = []
+        with self._lock:
+            changes = self._collect_changes()
+            frames = {}
+            if changes:
+                self.seq += 1
+                # Only rooms somebody is live in get a frame
+                for hostname, entry in changes.items():
+                    for room in self._rooms_of(hostname):
+                        if room in self._live_members:
+                            frames.setdefault(room, {})[hostname] = entry
+                for room, hosts in frames.items():
+                    actions.append(("emit", FRAME_EVENT, {"seq": self.seq, "hosts": hosts}, room))
+                self.stats["frames"] += len(frames)
+                self._history.append((self.seq, changes))
+
+            if self._alerts:
+                alerts, self._alerts = self._alerts, []
+                by_room = {}
+                for event in alerts:
+                    for room in self._rooms_of(event["hostname"]):
+                        if room in self._live_members:
+                            by_room.setdefault(room, []).append(event)
+                for room, events in by_room.items():
+                    actions.append(("emit", ALERT_EVENT, {"alerts": events}, room))
+                self.stats["alert_frames"] += len(by_room)
+
+            for client in self._clients.values():
+                if client.live:
+                    if frames and not client.rooms.isdisjoint(frames):
+                        client.sent_seq = self.seq
+                        client.sent_at = now
+                        client.in_flight.append(self.seq)
+                    # Demote clients that stopped acknowledging
+                    if len(client.in_flight) > self.max_lag and now - client.acked_at >= self.ack_timeout:
+                        client.live = False
+                        self._exit(client, client.rooms, actions)
+                    continue
+
+                for hostname, entry in changes.items():
+                    if not self._rooms_of(hostname).isdisjoint(client.rooms):
+                        pending = client.pending
+                        pending[hostname] = agama_delta.merge(pending[hostname], entry) if hostname in pending else entry
+                caught_up = client.acked_seq >= client.sent_seq
+                if client.pending and (caught_up or now - client.sent_at >= self.ack_timeout):
+                    actions.append(("emit", FRAME_EVENT, {"seq": self.seq, "hosts": client.pending}, client.sid))
+                    self.stats["catch_up_frames"] += 1
+                    client.pending = {}
+                    client.sent_seq = self.seq
+                    client.sent_at = now
+                    client.in_flight.append(self.seq)
+                if caught_up:
+                    # Everything up to self.seq is on its way; later frames come through its rooms
+                    client.live = True
+                    client.acked_at = now
+                    self._enter(client, client.rooms, actions)
+            self.stats["lagging_clients"] = sum(1 for client in self._clients.values() if not client.live)
+        return actions
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, epoch=self.epoch, seq=self.seq, clients=len(self._clients),
+                        dirty_hosts=len(self._dirty), rooms=len(self._live_members),
+                        history=len(self._history),
+                        history_from=self._history[0][0] if self._history else None)
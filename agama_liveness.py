@@ -0,0 +1,103 @@
+import heapq
+import threading
+
+
+class AgentClock:
+    """Reporting rhythm and offline deadline of one agent."""
+
+    __slots__ = ("last_seen", "interval", "deadline", "scheduled")
+
+    def __init__(self, last_seen):
+        self.last_seen = last_seen
+        self.interval = None    # smoothed time between reports, None until the second report
+        self.deadline = 0.0
+        self.scheduled = False  # has an entry in the deadline heap
+
+
+class LivenessTracker:
+    """
+    Tracks when each agent is due to report and finds the ones that missed it.
+
+    Every agent gets a deadline of last report + its own timeout, where the
+    timeout is `factor` times its smoothed reporting interval, clamped to
+    [min_timeout, max_timeout] (`default_timeout` until a second report
+    gives an interval). Deadlines live in a min-heap with one entry per
+    agent: a report only moves the agent's deadline in its AgentClock, and
+    when the stale heap entry comes due it is pushed back with the current
+    deadline. Reports therefore cost O(1), and expire() only touches the
+    entries that came due instead of scanning the whole fleet.
+    """
+
+    def __init__(self, default_timeout=15.0, factor=3.0, min_timeout=5.0, max_timeout=600.0, smoothing=0.2):
+        self.default_timeout = default_timeout
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._clocks = {}
+        self._heap = []  # (deadline, hostname), possibly older than the clock's deadline
+        self.stats = {"expired": 0, "rearmed": 0}
+
+    def _timeout(self, clock):
+        if clock.interval is None:
+            return self.default_timeout
+        return min(max(self.factor * clock.interval, self.min_timeout), self.max_timeout)
+
+    def _arm(self, hostname, clock):
+        clock.deadline = clock.last_seen + self._timeout(clock)
+        if not clock.scheduled:
+            clock.scheduled = True
+            heapq.heappush(self._heap, (clock.deadline, hostname))
+
+    def track(self, hostname, last_seen):
+        """Start watching an agent known to be online as of `last_seen`, e.g. loaded at startup."""
+        with self._lock:
+            clock = self._clocks.setdefault(hostname, AgentClock(last_seen))
+            clock.last_seen = max(clock.last_seen, last_seen)
+            self._arm(hostname, clock)
+
+    def touch_many(self, hostnames, now):
+        """Record reports from `hostnames` received at `now`."""
+        with self._lock:
+            for hostname in hostnames:
+                clock = self._clocks.get(hostname)
+                if clock is None:
+                    clock = self._clocks[hostname] = AgentClock(now)
+                elif clock.scheduled and now > clock.last_seen:
+                    # Only gaps between reports of an online agent say anything about its interval
+                    gap = now - clock.last_seen
+                    clock.interval = gap if clock.interval is None else \
+                        clock.interval + self.smoothing * (gap - clock.interval)
+                clock.last_seen = now
+                self._arm(hostname, clock)
+
+    def expire(self, now):
+        """Return [(hostname, last_seen)] for agents whose deadline passed, and stop watching them."""
+        expired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, hostname = heapq.heappop(heap)
+                clock = self._clocks[hostname]
+                if clock.deadline > now:
+                    heapq.heappush(heap, (clock.deadline, hostname))
+                    self.stats["rearmed"] += 1
+                else:
+                    clock.scheduled = False
+                    expired.append((hostname, clock.last_seen))
+            self.stats["expired"] += len(expired)
+        return expired
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def timeout_for(self, hostname):
+        with self._lock:
+            clock = self._clocks.get(hostname)
+            return self._timeout(clock) if clock else self.default_timeout
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, tracked=len(self._clocks), scheduled=len(self._heap))
@@ -0,0 +1,163 @@
+import os
+
+# Linux fast path for the agent's hot collectors: the /proc files stay open and are reread
+# with os.preadv() into preallocated buffers, and only the fields the report needs are
+# parsed. Values match psutil's cpu_percent(), virtual_memory().percent, net_io_counters()
+# (also pernic=True), disk_partitions(all=False) and disk_usage().percent.
+PROC_FILES = {
+    "stat": "/proc/stat",
+    "meminfo": "/proc/meminfo",
+    "net_dev": "/proc/net/dev",
+    "mounts": "/proc/self/mounts",
+}
+# Initial buffer size per file; a buffer that turns out too small is doubled
+BUFFER_SIZE = 16384
+
+
+def _unescape(field):
+    """Undo the octal escapes /proc/mounts uses for spaces, tabs and backslashes in paths."""
+    if b"\\" not in field:
+        return field.decode("utf-8", errors="replace")
+    return field.decode("unicode_escape").encode("latin-1").decode("utf-8", errors="replace")
+
+
+def _percent(used, total):
+    return round(used / total * 100, 1) if total > 0 else 0.0
+
+
+class ProcReader:
+    """
+    Keeps the /proc files open and rereads them in place. Not thread-safe;
+    give every collecting thread its own reader.
+    """
+
+    def __init__(self):
+        self._fds = {}
+        self._buffers = {}
+        try:
+            for name, path in PROC_FILES.items():
+                self._fds[name] = os.open(path, os.O_RDONLY)
+                self._buffers[name] = bytearray(BUFFER_SIZE)
+            self._fstypes = self._physical_fstypes()
+        except OSError:
+            self.close()
+            raise
+        self._last_cpu = None
+
+    @classmethod
+    def open(cls):
+        """A reader, or None where /proc (or os.preadv) is not available."""
+        if not hasattr(os, "preadv"):
+            return None
+        try:
+            return cls()
+        except OSError:
+            return None
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    def _read(self, name):
+        """Reread a /proc file into its buffer; returns (buffer, size of the content)."""
+        fd = self._fds[name]
+        while True:
+            buffer = self._buffers[name]
+            size = os.preadv(fd, [buffer], 0)
+            if size < len(buffer):
+                return buffer, size
+            self._buffers[name] = bytearray(len(buffer) * 2)
+
+    def _lines(self, name):
+        buffer, size = self._read(name)
+        return bytes(memoryview(buffer)[:size]).split(b"\n")
+
+    @staticmethod
+    def _field(buffer, size, key):
+        """The integer after `key` (e.g. b"MemTotal:"), searched for in place in a file's buffer."""
+        start = buffer.find(key, 0, size)
+        if start < 0:
+            raise OSError(f"{key.decode()} not found")
+        start += len(key)
+        end = buffer.find(b"\n", start, size)
+        return int(buffer[start:end].split()[0])
+
+    @staticmethod
+    def _physical_fstypes():
+        # Same rule as psutil: filesystems not marked nodev, plus zfs
+        fstypes = set()
+        with open("/proc/filesystems", "rb") as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                if fields[0] != b"nodev":
+                    fstypes.add(fields[0])
+                elif len(fields) > 1 and fields[1] == b"zfs":
+                    fstypes.add(b"zfs")
+        return fstypes
+
+    def cpu_percent(self):
+        """Busy CPU percent since the previous call (0.0 on the first), like psutil.cpu_percent(interval=None)."""
+        buffer, size = self._read("stat")
+        line = buffer[:buffer.find(b"\n", 0, size)]
+        # cpu user nice system idle iowait irq softirq steal guest guest_nice; guest time is already in user
+        times = [int(value) for value in line.split()[1:9]]
+        total = sum(times)
+        idle = times[3] + times[4]
+        previous, self._last_cpu = self._last_cpu, (total, idle)
+        if previous is None or total <= previous[0]:
+            return 0.0
+        all_delta = total - previous[0]
+        return _percent(all_delta - (idle - previous[1]), all_delta)
+
+    def memory_percent(self):
+        """Used memory percent, (MemTotal - MemAvailable) / MemTotal, like psutil.virtual_memory().percent."""
+        buffer, size = self._read("meminfo")
+        total = self._field(buffer, size, b"MemTotal:")
+        available = self._field(buffer, size, b"MemAvailable:")
+        return _percent(total - available, total)
+
+    def net_interfaces(self):
+        """{interface: {counter: value}} in the agent's net_interfaces names, like psutil.net_io_counters(pernic=True)."""
+        interfaces = {}
+        for line in self._lines("net_dev")[2:]:
+            colon = line.rfind(b":")
+            if colon < 0:
+                continue
+            fields = line[colon + 1:].split()
+            # Receive: bytes packets errs drop ..., then transmit from field 8: bytes packets errs drop ...
+            interfaces[line[:colon].strip().decode()] = {
+                "bytes_sent": int(fields[8]),
+                "bytes_received": int(fields[0]),
+                "packets_sent": int(fields[9]),
+                "packets_received": int(fields[1]),
+                "errors_in": int(fields[2]),
+                "errors_out": int(fields[10]),
+                "drops_in": int(fields[3]),
+                "drops_out": int(fields[11])
+            }
+        return interfaces
+
+    def net_io(self):
+        """(bytes_sent, bytes_received) summed over all interfaces, like psutil.net_io_counters()."""
+        interfaces = self.net_interfaces().values()
+        return sum(c["bytes_sent"] for c in interfaces), sum(c["bytes_received"] for c in interfaces)
+
+    def partitions(self):
+        """[(mountpoint, device)] of physical filesystems, like psutil.disk_partitions(all=False)."""
+        result = []
+        for line in self._lines("mounts"):
+            fields = line.split()
+            if len(fields) < 3 or fields[0] == b"none" or fields[2] not in self._fstypes:
+                continue
+            result.append((_unescape(fields[1]), _unescape(fields[0])))
+        return result
+
+    @staticmethod
+    def disk_percent(mountpoint):
+        """Used percent of the space available to users, like psutil.disk_usage().percent."""
+        st = os.statvfs(mountpoint)
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        return _percent(used, used + st.f_bavail * st.f_frsize)
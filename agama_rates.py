@@ -0,0 +1,108 @@
+import threading
+
+# Counter widths a decreasing counter may have wrapped at: 32-bit on older and 32-bit kernels
+COUNTER_WIDTHS = (2 ** 32, 2 ** 64)
+# A changed boot_time (seconds) means the host rebooted and its counters started over
+BOOT_TIME_TOLERANCE = 2.0
+
+# Per-interface counter names agents send under data["net_interfaces"][interface]
+INTERFACE_COUNTERS = ("bytes_sent", "bytes_received", "packets_sent", "packets_received",
+                      "errors_in", "errors_out", "drops_in", "drops_out")
+
+
+def counter_delta(previous, value):
+    """
+    Increase of a cumulative counter from `previous` to `value`, or None if it
+    was reset. A decrease counts as a wrap only if less than half the
+    counter's range would have passed; anything else is a reset.
+    """
+    if value >= previous:
+        return value - previous
+    for width in COUNTER_WIDTHS:
+        if previous < width and width - previous + value < width // 2:
+            return width - previous + value
+    return None
+
+
+def _counters(data):
+    """Flatten the cumulative network counters of a report into {(interface or None, name): value}."""
+    counters = {}
+    totals = data.get("network_io")
+    if isinstance(totals, dict):
+        for name in ("bytes_sent", "bytes_received"):
+            value = totals.get(name)
+            if isinstance(value, int) and not isinstance(value, bool):
+                counters[(None, name)] = value
+    interfaces = data.get("net_interfaces")
+    if isinstance(interfaces, dict):
+        for interface, values in interfaces.items():
+            if not isinstance(values, dict):
+                continue
+            for name in INTERFACE_COUNTERS:
+                value = values.get(name)
+                if isinstance(value, int) and not isinstance(value, bool):
+                    counters[(interface, name)] = value
+    return counters
+
+
+class RateTracker:
+    """
+    Streaming ingest stage: keeps the previous network counters per host and
+    turns each report's cumulative counters into per-second rates, so they
+    are computed once instead of by every query and dashboard.
+
+    update() returns {"bytes_sent": ..., "bytes_received": ..., "interfaces":
+    {name: {counter: per_second}}}, or None for a host's first report, after
+    a reboot, or when no counter could be used. Reports less than
+    `min_interval` seconds after the previous one get no rates and keep the
+    previous baseline.
+    """
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._hosts = {}  # hostname -> (ts, boot_time, counters)
+        self.stats = {"rates": 0, "resets": 0, "wraps": 0, "reboots": 0}
+
+    def update(self, hostname, data, now):
+        if not isinstance(data, dict):
+            return None
+        counters = _counters(data)
+        if not counters:
+            return None
+        boot_time = data.get("boot_time")
+        with self._lock:
+            previous = self._hosts.get(hostname)
+            if previous is not None and 0 <= now - previous[0] < self.min_interval:
+                return None
+            self._hosts[hostname] = (now, boot_time, counters)
+            if previous is None or now <= previous[0]:
+                return None
+            ts, previous_boot, previous_counters = previous
+            if isinstance(boot_time, (int, float)) and isinstance(previous_boot, (int, float)) \
+                    and abs(boot_time - previous_boot) > BOOT_TIME_TOLERANCE:
+                self.stats["reboots"] += 1
+                return None
+
+            elapsed = now - ts
+            rates = {}
+            for key, value in counters.items():
+                old = previous_counters.get(key)
+                if old is None:
+                    continue
+                delta = counter_delta(old, value)
+                if delta is None:
+                    self.stats["resets"] += 1
+                    continue
+                if value < old:
+                    self.stats["wraps"] += 1
+                interface, name = key
+                target = rates if interface is None else rates.setdefault("interfaces", {}).setdefault(interface, {})
+                target[name] = round(delta / elapsed, 2)
+            if rates:
+                self.stats["rates"] += 1
+            return rates or None
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, hosts=len(self._hosts))
@@ -0,0 +1,407 @@
+import argparse
+import collections
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson"
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+FSYNC_POLICIES = ("always", "interval", "never")
+BACKPRESSURE_POLICIES = ("block", "drop-oldest", "shed")
+# Receive times from concurrent request threads reach the log slightly out of order, so a
+# segment's name bounds its records only to within this many seconds; replay() and
+# delete_before() keep the segments that border their window by that much
+SEGMENT_TIME_SLACK = 60
+
+
+def _segment_start(name):
+    """Return the start time (unix seconds) encoded in a segment file name, or None."""
+    if not name.startswith(SEGMENT_PREFIX):
+        return None
+    try:
+        return int(name[len(SEGMENT_PREFIX):].split("-", 1)[0]) / 1000
+    except ValueError:
+        return None
+
+
+class SegmentLog:
+    """
+    Append-only log of agent reports, stored as NDJSON segment files.
+
+    Each line is {"ts": receive_time, "record": report}. The active segment
+    is rotated once it exceeds `max_segment_bytes` or is older than
+    `max_segment_age` seconds; closed segments are optionally compressed
+    (gzip, or zstd when the zstandard package is installed) in the
+    background. Segment names carry the oldest receive time of their first
+    append, so replay() only opens segments that overlap the requested
+    range (give or take SEGMENT_TIME_SLACK).
+
+    fsync policy: "always" syncs after every append call, "interval" at most
+    every `fsync_interval` seconds, "never" leaves it to the OS. Appends only
+    sync as they arrive; call sync_due() during quiet periods so the last
+    records before one are not left unsynced (or sitting in the write buffer).
+    """
+
+    def __init__(self, directory, max_segment_bytes=64 * 1024 * 1024, max_segment_age=3600,
+                 compression="gzip", fsync="interval", fsync_interval=1.0, buffer_size=256 * 1024):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd":
+            import zstandard  # noqa: F401  fail early if zstd was asked for but is unavailable
+
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.compression = compression
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.buffer_size = buffer_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._last_sync = 0.0
+        self._dirty = False
+        self._sequence = 0
+        # Closed segments queued for or being compressed; delete_before() leaves them alone
+        self._compressing = set()
+        self.stats = {"records": 0, "bytes": 0, "segments_rotated": 0, "fsyncs": 0}
+
+        # Segments left uncompressed by a previous run are closed now
+        for path, _ in self.segments():
+            if path.endswith(SEGMENT_SUFFIX):
+                self._compress_later(path)
+
+    # --- writing ---
+    def append(self, record, ts=None):
+        self.append_many([record], ts=ts)
+
+    def append_many(self, records, ts=None):
+        """Append records received at `ts` (default now) with one buffered write."""
+        ts = time.time() if ts is None else ts
+        self.append_entries([(ts, record) for record in records])
+
+    def append_entries(self, entries):
+        """Append (ts, record) pairs with one buffered write, rotating and syncing as configured."""
+        if not entries:
+            return
+        blob = "".join(
+            json.dumps({"ts": ts, "record": record}, separators=(",", ":")) + "\n" for ts, record in entries
+        ).encode("utf-8")
+        now = entries[-1][0]
+        with self._lock:
+            if self._file is None or self._should_rotate(now):
+                # Named by the oldest entry: entries may be out of order within a batch
+                self._rotate(min(ts for ts, _ in entries))
+            self._file.write(blob)
+            self._dirty = True
+            self._size += len(blob)
+            self.stats["records"] += len(entries)
+            self.stats["bytes"] += len(blob)
+            self._maybe_sync(now)
+
+    def _should_rotate(self, now):
+        return self._size >= self.max_segment_bytes or now - self._opened_at >= self.max_segment_age
+
+    def _rotate(self, now):
+        previous = self._path
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self.stats["segments_rotated"] += 1
+        self._sequence += 1
+        self._path = os.path.join(
+            self.directory, f"{SEGMENT_PREFIX}{int(now * 1000):013d}-{os.getpid()}-{self._sequence}{SEGMENT_SUFFIX}"
+        )
+        self._file = open(self._path, "ab", buffering=self.buffer_size)
+        self._opened_at = now
+        self._size = 0
+        if previous:
+            self._compress_later(previous)
+
+    def _maybe_sync(self, now):
+        if self.fsync == "always" or (self.fsync == "interval" and now - self._last_sync >= self.fsync_interval):
+            self._sync()
+            self._last_sync = now
+
+    def _sync(self):
+        self._file.flush()
+        self._dirty = False
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+            self.stats["fsyncs"] += 1
+
+    def sync_due(self, now=None):
+        """Sync appends still pending once `fsync_interval` has passed since the last sync."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._file is not None and self._dirty and now - self._last_sync >= self.fsync_interval:
+                self._sync()
+                self._last_sync = now
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    # --- compression ---
+    def _compress_later(self, path):
+        # Called with the lock held, or from __init__
+        if self.compression:
+            self._compressing.add(path)
+            threading.Thread(target=self._compress, args=(path,), name="SegmentCompressor", daemon=True).start()
+
+    def _compress(self, path):
+        target = path + COMPRESSED_SUFFIXES[self.compression]
+        partial = target + ".tmp"
+        try:
+            with open(path, "rb") as src:
+                if self.compression == "zstd":
+                    import zstandard
+                    with open(partial, "wb") as raw:
+                        zstandard.ZstdCompressor().copy_stream(src, raw)
+                else:
+                    with gzip.open(partial, "wb") as dst:
+                        while True:
+                            chunk = src.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+            os.replace(partial, target)
+            os.remove(path)
+        except Exception:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        finally:
+            with self._lock:
+                self._compressing.discard(path)
+
+    # --- reading ---
+    def segments(self):
+        """Return [(path, start_time)] for every segment, oldest first."""
+        result = []
+        for name in os.listdir(self.directory):
+            start = _segment_start(name)
+            if start is None or name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            # A segment may briefly exist both plain and compressed; prefer the plain file
+            if not name.endswith(SEGMENT_SUFFIX) and os.path.exists(path.rsplit(".", 1)[0]):
+                continue
+            result.append((path, start))
+        result.sort(key=lambda item: (item[1], item[0]))
+        return result
+
+    @staticmethod
+    def _open_text(path):
+        if path.endswith(".gz"):
+            return gzip.open(path, "rt", encoding="utf-8")
+        if path.endswith(".zst"):
+            import zstandard
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                                    encoding="utf-8")
+        return open(path, "r", encoding="utf-8")
+
+    def replay(self, start=None, end=None):
+        """Yield (ts, record) for every logged record with start <= ts < end, in log order."""
+        if self._path:
+            self.flush()
+        segments = self.segments()
+        for index, (path, seg_start) in enumerate(segments):
+            next_start = segments[index + 1][1] if index + 1 < len(segments) else None
+            if end is not None and seg_start >= end + SEGMENT_TIME_SLACK:
+                break
+            if start is not None and next_start is not None and next_start <= start - SEGMENT_TIME_SLACK:
+                continue
+            try:
+                handle = self._open_text(path)
+            except FileNotFoundError:
+                # Compressed and removed between listing and opening; read the compressed copy
+                handle = self._open_text(path + COMPRESSED_SUFFIXES.get(self.compression, ""))
+            with handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn write at the end of a segment after a crash
+                    ts = entry.get("ts", 0)
+                    if (start is None or ts >= start) and (end is None or ts < end):
+                        yield ts, entry.get("record")
+
+    def delete_before(self, cutoff, limit=None):
+        """
+        Delete closed segments whose records are all older than `cutoff`; returns the count.
+        Segments still waiting for the compressor are skipped and go on a later call.
+        """
+        removed = 0
+        with self._lock:
+            segments = self.segments()
+            for index, (path, _) in enumerate(segments[:-1]):
+                if limit is not None and removed >= limit:
+                    break
+                if segments[index + 1][1] > cutoff - SEGMENT_TIME_SLACK or path == self._path:
+                    break
+                if path in self._compressing:
+                    continue
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, active_segment=self._path, active_bytes=self._size)
+
+
+class QueueFull(Exception):
+    """Raised by BackgroundWriter.submit() when records cannot be queued."""
+
+
+class BackgroundWriter:
+    """
+    Bounded queue drained by a dedicated writer thread, so request handlers
+    never wait on disk I/O.
+
+    Records are stamped with their enqueue time and handed to `sink` as a
+    list of (ts, record) pairs, up to `batch_size` at a time; the writer
+    waits up to `batch_wait` seconds for a batch to fill. When the queue
+    holds `max_queue` records, `policy` decides what happens:
+
+    - "block": wait up to `block_timeout` seconds for room, then raise QueueFull
+    - "drop-oldest": discard the oldest queued records to make room
+    - "shed": raise QueueFull immediately so the caller can answer 503
+
+    If given, `idle` is called on the writer thread whenever the queue has
+    stayed empty for `idle_interval` seconds (e.g. SegmentLog.sync_due).
+    """
+
+    def __init__(self, sink, max_queue=50000, batch_size=1000, batch_wait=0.05,
+                 policy="block", block_timeout=2.0, name="ReportWriterThread", idle=None, idle_interval=1.0):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.name = name
+        self.idle = idle
+        self.idle_interval = idle_interval
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "shed": 0, "failed": 0, "batches": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, records, ts=None):
+        ts = time.time() if ts is None else ts
+        count = len(records)
+        with self._cond:
+            if len(self._queue) + count > self.max_queue:
+                if self.policy == "shed":
+                    self.stats["shed"] += count
+                    raise QueueFull(f"Report queue full ({len(self._queue)} queued)")
+                if self.policy == "drop-oldest":
+                    overflow = min(len(self._queue) + count - self.max_queue, len(self._queue))
+                    for _ in range(overflow):
+                        self._queue.popleft()
+                    self.stats["dropped"] += overflow
+                elif not self._cond.wait_for(lambda: len(self._queue) + count <= self.max_queue or self._stopping,
+                                             timeout=self.block_timeout):
+                    self.stats["shed"] += count
+                    raise QueueFull(f"Report queue still full after {self.block_timeout}s")
+            self._queue.extend((ts, record) for record in records)
+            self.stats["enqueued"] += count
+            self._cond.notify_all()
+
+    def would_block(self, count=1):
+        """True if submit() of `count` records would have to wait for room under the "block" policy."""
+        with self._cond:
+            return self.policy == "block" and len(self._queue) + count > self.max_queue
+
+    def _take_batch(self):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or self._stopping,
+                                       timeout=self.idle_interval if self.idle else None):
+                return []
+            if self.batch_wait and len(self._queue) < self.batch_size and not self._stopping:
+                self._cond.wait_for(lambda: len(self._queue) >= self.batch_size or self._stopping,
+                                    timeout=self.batch_wait)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                if self.idle:
+                    try:
+                        self.idle()
+                    except Exception:
+                        pass
+                continue
+            try:
+                self.sink(batch)
+                with self._cond:
+                    self.stats["written"] += len(batch)
+                    self.stats["batches"] += 1
+            except Exception:
+                with self._cond:
+                    self.stats["failed"] += len(batch)
+
+    def stop(self, timeout=10):
+        """Stop accepting work and wait for the queue to drain."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self.stats, queued=len(self._queue), max_queue=self.max_queue, policy=self.policy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay agent reports from a segment log as NDJSON")
+    parser.add_argument("directory")
+    parser.add_argument("--from", dest="start", type=float, help="unix time to start from")
+    parser.add_argument("--to", dest="end", type=float, help="unix time to stop before")
+    parser.add_argument("--hostname", help="only replay reports from this host")
+    args = parser.parse_args()
+
+    log = SegmentLog(args.directory, compression=None)
+    for ts, record in log.replay(args.start, args.end):
+        if args.hostname and (record or {}).get("hostname") != args.hostname:
+            continue
+        sys.stdout.write(json.dumps({"ts": ts, "record": record}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import threading
+
+
+class AgentRecord:
+    """Latest known state of one agent."""
+
+    __slots__ = ("metrics", "last_seen", "status")
+
+    def __init__(self, metrics, last_seen, status):
+        self.metrics = metrics      # last reported data, None if only loaded from the database
+        self.last_seen = last_seen  # unix time of the last report
+        self.status = status        # "online" / "offline"
+
+
+class AgentStateStore:
+    """
+    In-memory agent state split over `shards` hash-partitioned dicts, each
+    guarded by its own lock, so reports for different hosts rarely wait on
+    each other and readers never block the whole fleet.
+
+    Records are only mutated under their shard's lock; metrics dicts are
+    replaced, never modified, so readers may keep the references they copy
+    out. Whole-fleet reads (items(), metrics_snapshot()) lock one shard at
+    a time and are therefore consistent per host, not across hosts.
+    """
+
+    def __init__(self, shards=16):
+        count = 1 << max(shards - 1, 0).bit_length()  # round up to a power of two
+        self._mask = count - 1
+        self._locks = [threading.Lock() for _ in range(count)]
+        self._shards = [{} for _ in range(count)]
+
+    def _index(self, hostname):
+        return hash(hostname) & self._mask
+
+    def _group(self, hostnames):
+        groups = {}
+        for hostname in hostnames:
+            groups.setdefault(self._index(hostname), []).append(hostname)
+        return groups.items()
+
+    # --- writes ---
+    def report(self, hostname, metrics, now):
+        index = self._index(hostname)
+        with self._locks[index]:
+            record = self._shards[index].get(hostname)
+            if record is None:
+                self._shards[index][hostname] = AgentRecord(metrics, now, "online")
+            else:
+                record.metrics = metrics
+                record.last_seen = now
+                record.status = "online"
+
+    def report_many(self, updates, now):
+        """Apply {hostname: metrics} received at `now`, taking each shard's lock once."""
+        for index, hostnames in self._group(updates):
+            shard = self._shards[index]
+            with self._locks[index]:
+                for hostname in hostnames:
+                    record = shard.get(hostname)
+                    if record is None:
+                        shard[hostname] = AgentRecord(updates[hostname], now, "online")
+                    else:
+                        record.metrics = updates[hostname]
+                        record.last_seen = now
+                        record.status = "online"
+
+    def load(self, agents):
+        """Add agents loaded from storage, {hostname: {"status", "last_seen"}}, without metrics."""
+        for index, hostnames in self._group(agents):
+            with self._locks[index]:
+                for hostname in hostnames:
+                    info = agents[hostname]
+                    self._shards[index].setdefault(hostname, AgentRecord(None, info["last_seen"], info["status"]))
+
+    def mark_offline(self, expired):
+        """
+        Flip agents in `expired`, [(hostname, last_seen)], to offline unless they
+        reported after that last_seen; returns the hostnames that changed.
+        """
+        last_seen = dict(expired)
+        changed = []
+        for index, hostnames in self._group(last_seen):
+            with self._locks[index]:
+                for hostname in hostnames:
+                    record = self._shards[index].get(hostname)
+                    if record and record.status == "online" and record.last_seen <= last_seen[hostname]:
+                        record.status = "offline"
+                        changed.append(hostname)
+        return changed
+
+    def remove_stale(self, cutoff):
+        """Remove agents that have not reported since `cutoff`; returns their hostnames."""
+        removed = []
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                stale = [hostname for hostname, record in shard.items() if record.last_seen < cutoff]
+                for hostname in stale:
+                    del shard[hostname]
+            removed.extend(stale)
+        return removed
+
+    # --- reads ---
+    def get(self, hostname):
+        """Return (metrics, last_seen, status) for one agent, or None."""
+        index = self._index(hostname)
+        with self._locks[index]:
+            record = self._shards[index].get(hostname)
+            return (record.metrics, record.last_seen, record.status) if record else None
+
+    def items(self):
+        """Return [(hostname, last_seen, status)] for every agent."""
+        result = []
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                result.extend((hostname, record.last_seen, record.status) for hostname, record in shard.items())
+        return result
+
+    def hostnames(self):
+        result = []
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                result.extend(shard)
+        return result
+
+    def metrics_snapshot(self):
+        """Return {hostname: (last_seen, metrics)} for every agent that has reported metrics."""
+        result = {}
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                for hostname, record in shard.items():
+                    if record.metrics is not None:
+                        result[hostname] = (record.last_seen, record.metrics)
+        return result
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def get_stats(self):
+        sizes = [len(shard) for shard in self._shards]
+        return {"shards": len(sizes), "agents": sum(sizes), "largest_shard": max(sizes)}
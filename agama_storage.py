@@ -0,0 +1,536 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+AGENT_STATE_TABLE = "agents"
+METRICS_TABLE = "metricstable"
+SAMPLES_TABLE = "metric_samples"
+DISK_SAMPLES_TABLE = "disk_samples"
+ROLLUPS_TABLE = "metric_rollups"
+WATERMARKS_TABLE = "rollup_watermarks"
+
+SAMPLE_COLUMNS = ("hostname", "metric", "ts", "value")
+DISK_SAMPLE_COLUMNS = ("hostname", "mountpoint", "ts", "disk_label", "usage_percent")
+# sum_value is in value-seconds and covered_seconds the time the series had a value, so avg = sum / covered
+ROLLUP_COLUMNS = ("tier", "hostname", "metric", "bucket_ts", "min_value", "max_value", "sum_value", "sample_count",
+                  "last_value", "covered_seconds")
+
+# Primary key and time column of each table that retention deletes from
+TABLE_KEYS = {
+    METRICS_TABLE: (("id",), "created_at"),
+    SAMPLES_TABLE: (("hostname", "metric", "ts"), "ts"),
+    DISK_SAMPLES_TABLE: (("hostname", "mountpoint", "ts"), "ts"),
+    ROLLUPS_TABLE: (("tier", "hostname", "metric", "bucket_ts"), "bucket_ts"),
+}
+
+# Rows per multi-row statement, kept well under the SQLite variable limit
+MAX_ROWS_PER_STATEMENT = 500
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be acquired within the pool's timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe connection pool.
+
+    At most `max_size` connections exist at once. Idle connections are reused
+    most-recently-used first; connections idle for longer than `max_idle`
+    seconds are closed instead of reused, and connections idle for longer
+    than `health_check_after` seconds are pinged before being handed out.
+    """
+
+    def __init__(self, connect, ping, max_size=8, max_idle=300, acquire_timeout=5, health_check_after=30):
+        self._connect = connect
+        self._ping = ping
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"created": 0, "reused": 0, "discarded": 0, "timeouts": 0, "in_use": 0}
+
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available within {self.acquire_timeout}s")
+        try:
+            conn = self._take_idle() or self._new_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.stats["in_use"] += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            self.stats["in_use"] -= 1
+        try:
+            if broken or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            broken = not self._ping(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _take_idle(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.max_idle:
+                self._discard(conn)
+                continue
+            if idle_for > self.health_check_after and not self._ping(conn):
+                self._discard(conn)
+                continue
+            with self._lock:
+                self.stats["reused"] += 1
+            return conn
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._lock:
+            self.stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self.stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _chunks(rows, size=MAX_ROWS_PER_STATEMENT):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class Storage:
+    """
+    Base class for the server's persistence backends.
+
+    Subclasses provide the connection factory, health check and the few
+    statements that differ between SQL dialects; everything else is shared.
+    """
+
+    placeholder = "%s"
+
+    def __init__(self, pool_config=None):
+        self.pool = ConnectionPool(self._connect, self._ping, **(pool_config or {}))
+
+    # --- dialect hooks ---
+    def _connect(self):
+        raise NotImplementedError
+
+    def _ping(self, conn):
+        raise NotImplementedError
+
+    def _upsert_sql(self, table, columns, key_columns, row_count):
+        raise NotImplementedError
+
+    def _insert_ignore_sql(self, table, columns, row_count):
+        raise NotImplementedError
+
+    def _delete_batch_sql(self, table, where, limit):
+        raise NotImplementedError
+
+    def _to_db_time(self, value):
+        return value
+
+    def _from_db_time(self, value):
+        return value
+
+    # --- helpers ---
+    def _values(self, columns, row_count):
+        group = "(" + ", ".join([self.placeholder] * columns) + ")"
+        return ", ".join([group] * row_count)
+
+    def execute(self, sql, params=()):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def query(self, sql, params=()):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def insert_rows(self, table, columns, rows):
+        """Bulk insert rows with multi-row statements, skipping rows whose key already exists."""
+        if not rows:
+            return
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for chunk in _chunks(rows):
+                    params = [value for row in chunk for value in row]
+                    cursor.execute(self._insert_ignore_sql(table, columns, len(chunk)), params)
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def upsert_rows(self, table, columns, key_columns, rows):
+        """Bulk insert rows with multi-row statements, overwriting rows whose key already exists."""
+        if not rows:
+            return
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for chunk in _chunks(rows):
+                    params = [value for row in chunk for value in row]
+                    cursor.execute(self._upsert_sql(table, columns, key_columns, len(chunk)), params)
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def delete_batch(self, table, where, params, limit):
+        """Delete at most `limit` rows matching `where` in one short transaction; returns the count."""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self._delete_batch_sql(table, where, limit), params)
+                deleted = cursor.rowcount
+                conn.commit()
+                return deleted
+            finally:
+                cursor.close()
+
+    # --- agents table ---
+    def upsert_agent_statuses(self, rows):
+        """Upsert (hostname, status, datetime) rows using multi-row statements."""
+        self.upsert_rows(
+            AGENT_STATE_TABLE, ("hostname", "status", "last_seen"), ("hostname",),
+            [(hostname, status, self._to_db_time(timestamp)) for hostname, status, timestamp in rows]
+        )
+
+    def load_agents(self):
+        """Return {hostname: {"status": ..., "last_seen": unix_time}} for every known agent."""
+        rows = self.query(f"SELECT hostname, status, last_seen FROM {AGENT_STATE_TABLE}")
+        return {
+            hostname: {"status": status, "last_seen": self._from_db_time(last_seen).timestamp()}
+            for hostname, status, last_seen in rows
+        }
+
+    # --- metrics snapshot table ---
+    def insert_metrics_snapshot(self, payload_json, timestamp):
+        self.execute(
+            f"INSERT INTO {METRICS_TABLE} (metricsdata, created_at) VALUES ({self.placeholder}, {self.placeholder})",
+            (payload_json, self._to_db_time(timestamp))
+        )
+
+    # --- normalized time series ---
+    def insert_samples(self, rows):
+        """Insert (hostname, metric, ts, value) rows; ts is unix time in seconds."""
+        self.insert_rows(SAMPLES_TABLE, SAMPLE_COLUMNS, rows)
+
+    def insert_disk_samples(self, rows):
+        """Insert (hostname, mountpoint, ts, disk_label, usage_percent) rows."""
+        self.insert_rows(DISK_SAMPLES_TABLE, DISK_SAMPLE_COLUMNS, rows)
+
+    def list_series(self, hostname, tier=None):
+        """
+        Return the series names stored for a host, raw (tier None) or in a
+        rollup tier. Disks are named "disk_usage.<mountpoint>".
+        """
+        p = self.placeholder
+        if tier is not None:
+            rows = self.query(
+                f"SELECT DISTINCT metric FROM {ROLLUPS_TABLE} WHERE tier = {p} AND hostname = {p}", (tier, hostname)
+            )
+            return [row[0] for row in rows]
+        metrics = self.query(f"SELECT DISTINCT metric FROM {SAMPLES_TABLE} WHERE hostname = {p}", (hostname,))
+        disks = self.query(f"SELECT DISTINCT mountpoint FROM {DISK_SAMPLES_TABLE} WHERE hostname = {p}", (hostname,))
+        return [row[0] for row in metrics] + [f"disk_usage.{row[0]}" for row in disks]
+
+    def query_series(self, hostname, metric, start, end):
+        """Return (ts, value) rows of one metric in [start, end), ordered by ts."""
+        p = self.placeholder
+        return self.query(
+            f"SELECT ts, value FROM {SAMPLES_TABLE} "
+            f"WHERE hostname = {p} AND metric = {p} AND ts >= {p} AND ts < {p} ORDER BY ts",
+            (hostname, metric, start, end)
+        )
+
+    def query_disk_series(self, hostname, mountpoint, start, end):
+        """Return (ts, usage_percent) rows of one disk in [start, end), ordered by ts."""
+        p = self.placeholder
+        return self.query(
+            f"SELECT ts, usage_percent FROM {DISK_SAMPLES_TABLE} "
+            f"WHERE hostname = {p} AND mountpoint = {p} AND ts >= {p} AND ts < {p} ORDER BY ts",
+            (hostname, mountpoint, start, end)
+        )
+
+    # --- rollups and retention ---
+    def fetch_samples(self, start, end):
+        """
+        Return (hostname, metric, ts, value) rows with ts in [start, end) from
+        both sample tables; disks appear as "disk_usage.<mountpoint>" metrics.
+        """
+        p = self.placeholder
+        rows = self.query(
+            f"SELECT hostname, metric, ts, value FROM {SAMPLES_TABLE} WHERE ts >= {p} AND ts < {p}",
+            (start, end)
+        )
+        disks = self.query(
+            f"SELECT hostname, mountpoint, ts, usage_percent FROM {DISK_SAMPLES_TABLE} WHERE ts >= {p} AND ts < {p}",
+            (start, end)
+        )
+        rows.extend((hostname, f"disk_usage.{mountpoint}", ts, value) for hostname, mountpoint, ts, value in disks)
+        return rows
+
+    def fetch_rollups(self, tier, start, end):
+        """Return full rollup rows (see ROLLUP_COLUMNS, without tier) of one tier in [start, end)."""
+        p = self.placeholder
+        return self.query(
+            f"SELECT {', '.join(ROLLUP_COLUMNS[1:])} FROM {ROLLUPS_TABLE} "
+            f"WHERE tier = {p} AND bucket_ts >= {p} AND bucket_ts < {p}",
+            (tier, start, end)
+        )
+
+    def query_rollup_series(self, tier, hostname, metric, start, end):
+        """Return (bucket_ts, min, max, sum, count, last, covered) rows of one series in [start, end)."""
+        p = self.placeholder
+        return self.query(
+            f"SELECT bucket_ts, min_value, max_value, sum_value, sample_count, last_value, covered_seconds "
+            f"FROM {ROLLUPS_TABLE} "
+            f"WHERE tier = {p} AND hostname = {p} AND metric = {p} AND bucket_ts >= {p} AND bucket_ts < {p} "
+            f"ORDER BY bucket_ts",
+            (tier, hostname, metric, start, end)
+        )
+
+    def upsert_rollups(self, rows):
+        self.upsert_rows(ROLLUPS_TABLE, ROLLUP_COLUMNS, ROLLUP_COLUMNS[:4], rows)
+
+    def earliest_sample_ts(self):
+        rows = self.query(
+            f"SELECT MIN(ts) FROM {SAMPLES_TABLE} UNION ALL SELECT MIN(ts) FROM {DISK_SAMPLES_TABLE}"
+        )
+        values = [row[0] for row in rows if row[0] is not None]
+        return min(values) if values else None
+
+    def earliest_rollup_ts(self, tier):
+        rows = self.query(f"SELECT MIN(bucket_ts) FROM {ROLLUPS_TABLE} WHERE tier = {self.placeholder}", (tier,))
+        return rows[0][0] if rows else None
+
+    def load_watermarks(self):
+        return {tier: watermark for tier, watermark in self.query(f"SELECT tier, watermark FROM {WATERMARKS_TABLE}")}
+
+    def save_watermark(self, tier, watermark):
+        self.upsert_rows(WATERMARKS_TABLE, ("tier", "watermark"), ("tier",), [(tier, watermark)])
+
+    def delete_expired(self, table, cutoff, limit, tier=None):
+        """Delete one batch of rows older than `cutoff` from `table`; returns the count."""
+        _, time_column = TABLE_KEYS[table]
+        p = self.placeholder
+        if table == METRICS_TABLE:
+            cutoff = self._to_db_time(cutoff)
+        if tier is not None:
+            return self.delete_batch(table, f"tier = {p} AND {time_column} < {p}", (tier, cutoff), limit)
+        return self.delete_batch(table, f"{time_column} < {p}", (cutoff,), limit)
+
+    def close(self):
+        self.pool.close()
+
+
+class MySQLStorage(Storage):
+    """MySQL backend; expects the schema in sql_cmds.md to exist."""
+
+    def __init__(self, db_config, pool_config=None):
+        import mysql.connector
+        self._mysql = mysql.connector
+        self.db_config = dict(db_config)
+        super().__init__(pool_config)
+
+    def _connect(self):
+        return self._mysql.connect(**self.db_config)
+
+    def _ping(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _upsert_sql(self, table, columns, key_columns, row_count):
+        updates = ", ".join(f"{column} = VALUES({column})" for column in columns if column not in key_columns)
+        return f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES {self._values(len(columns), row_count)}
+            ON DUPLICATE KEY UPDATE {updates}
+        """
+
+    def _insert_ignore_sql(self, table, columns, row_count):
+        return f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES {self._values(len(columns), row_count)}"
+
+    def _delete_batch_sql(self, table, where, limit):
+        return f"DELETE FROM {table} WHERE {where} LIMIT {int(limit)}"
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite backend in WAL mode with the same tables as the MySQL schema,
+    so the server can run and be load-tested without a MySQL service.
+    """
+
+    placeholder = "?"
+
+    SCHEMA = [
+        f"""CREATE TABLE IF NOT EXISTS {METRICS_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            metricsdata TEXT NOT NULL,
+            created_at DATETIME NOT NULL
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS {AGENT_STATE_TABLE} (
+            hostname VARCHAR(100) PRIMARY KEY,
+            last_seen DATETIME NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('online', 'offline'))
+        )""",
+        # Clustered on (hostname, metric, ts) so per-host range queries are index range scans
+        f"""CREATE TABLE IF NOT EXISTS {SAMPLES_TABLE} (
+            hostname VARCHAR(100) NOT NULL,
+            metric VARCHAR(128) NOT NULL,
+            ts DOUBLE NOT NULL,
+            value DOUBLE NOT NULL,
+            PRIMARY KEY (hostname, metric, ts)
+        ) WITHOUT ROWID""",
+        f"CREATE INDEX IF NOT EXISTS idx_{SAMPLES_TABLE}_ts ON {SAMPLES_TABLE} (ts)",
+        f"""CREATE TABLE IF NOT EXISTS {DISK_SAMPLES_TABLE} (
+            hostname VARCHAR(100) NOT NULL,
+            mountpoint VARCHAR(255) NOT NULL,
+            ts DOUBLE NOT NULL,
+            disk_label VARCHAR(255),
+            usage_percent DOUBLE NOT NULL,
+            PRIMARY KEY (hostname, mountpoint, ts)
+        ) WITHOUT ROWID""",
+        f"CREATE INDEX IF NOT EXISTS idx_{DISK_SAMPLES_TABLE}_ts ON {DISK_SAMPLES_TABLE} (ts)",
+        f"""CREATE TABLE IF NOT EXISTS {ROLLUPS_TABLE} (
+            tier VARCHAR(8) NOT NULL,
+            hostname VARCHAR(100) NOT NULL,
+            metric VARCHAR(128) NOT NULL,
+            bucket_ts DOUBLE NOT NULL,
+            min_value DOUBLE NOT NULL,
+            max_value DOUBLE NOT NULL,
+            sum_value DOUBLE NOT NULL,
+            sample_count INTEGER NOT NULL,
+            last_value DOUBLE NOT NULL,
+            covered_seconds DOUBLE NOT NULL,
+            PRIMARY KEY (tier, hostname, metric, bucket_ts)
+        ) WITHOUT ROWID""",
+        f"CREATE INDEX IF NOT EXISTS idx_{ROLLUPS_TABLE}_tier_ts ON {ROLLUPS_TABLE} (tier, bucket_ts)",
+        f"""CREATE TABLE IF NOT EXISTS {WATERMARKS_TABLE} (
+            tier VARCHAR(8) PRIMARY KEY,
+            watermark DOUBLE NOT NULL
+        )""",
+        f"CREATE INDEX IF NOT EXISTS idx_{METRICS_TABLE}_created_at ON {METRICS_TABLE} (created_at)",
+    ]
+
+    def __init__(self, path, pool_config=None, busy_timeout=5):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        super().__init__(pool_config)
+        self.ensure_schema()
+
+    def _connect(self):
+        # Connections are handed between threads by the pool, never shared concurrently
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ping(self, conn):
+        try:
+            conn.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _upsert_sql(self, table, columns, key_columns, row_count):
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in key_columns)
+        return f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES {self._values(len(columns), row_count)}
+            ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {updates}
+        """
+
+    def _insert_ignore_sql(self, table, columns, row_count):
+        return f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES {self._values(len(columns), row_count)}"
+
+    def _delete_batch_sql(self, table, where, limit):
+        # SQLite has no DELETE ... LIMIT by default, so select a bounded batch of keys
+        keys = ", ".join(TABLE_KEYS[table][0])
+        return f"DELETE FROM {table} WHERE ({keys}) IN (SELECT {keys} FROM {table} WHERE {where} LIMIT {int(limit)})"
+
+    def _to_db_time(self, value):
+        return value.strftime(DATETIME_FORMAT) if isinstance(value, datetime) else value
+
+    def _from_db_time(self, value):
+        return datetime.strptime(value, DATETIME_FORMAT) if isinstance(value, str) else value
+
+    def ensure_schema(self):
+        with self.pool.connection() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+
+
+def create_storage(backend, db_config=None, sqlite_path=None, pool_config=None):
+    """Build the storage backend named by `backend` ("mysql" or "sqlite")."""
+    if backend == "mysql":
+        return MySQLStorage(db_config, pool_config=pool_config)
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path, pool_config=pool_config)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,549 @@
+import math
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from agama_storage import DISK_SAMPLES_TABLE, METRICS_TABLE, ROLLUPS_TABLE, SAMPLES_TABLE
+
+DISK_METRIC = "disk_usage"
+# Raw per-interface network counters are not stored; their per-second network_rates are
+SKIPPED_METRICS = (DISK_METRIC, "net_interfaces")
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(value):
+    """Parse a duration such as 30, "30s", "5m", "6h" or "7d" into seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().lower()
+    if text and text[-1] in DURATION_UNITS:
+        return float(text[:-1]) * DURATION_UNITS[text[-1]]
+    return float(text)
+
+
+def flatten_metrics(metrics, prefix=""):
+    """
+    Yield (metric_name, value) for every numeric leaf of a report's data.
+    Nested keys are joined with dots, e.g. network_io.bytes_sent.
+    disk_usage is skipped here; it is stored per disk by disk_samples().
+    net_interfaces counters are skipped; network_rates holds their rates.
+    """
+    if not isinstance(metrics, dict):
+        return
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if not prefix and key in SKIPPED_METRICS:
+            continue
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            yield name, float(value)
+        elif isinstance(value, dict):
+            yield from flatten_metrics(value, prefix=f"{name}.")
+
+
+def disk_samples(metrics):
+    """Yield (mountpoint, disk_label, usage_percent) for each disk in a report's disk_usage."""
+    disks = metrics.get(DISK_METRIC) if isinstance(metrics, dict) else None
+    if not isinstance(disks, dict):
+        return
+    for mountpoint, info in disks.items():
+        if not isinstance(info, dict):
+            continue
+        usage = info.get("disk_usage")
+        if isinstance(usage, (int, float)) and not isinstance(usage, bool):
+            yield str(mountpoint), info.get("disk_label"), float(usage)
+
+
+class TimeSeriesWriter:
+    """
+    Turns the latest report per host into normalized sample rows and writes
+    only what changed since the previous write.
+
+    A value is written when it differs from the last value written for the
+    same (host, metric), or when the last write is older than
+    `refresh_interval` seconds, so a flat series still has a sample in
+    every range a query is likely to ask for.
+    """
+
+    def __init__(self, storage, refresh_interval=300):
+        self.storage = storage
+        self.refresh_interval = refresh_interval
+        self._last_report = {}   # hostname -> report time already processed
+        self._last_written = {}  # (hostname, metric) -> (value, ts)
+        self._last_disk = {}     # (hostname, mountpoint) -> (usage, label, ts)
+        self._lock = threading.Lock()
+        self.stats = {"writes": 0, "samples_written": 0, "disk_samples_written": 0, "samples_skipped": 0,
+                      "backfilled": 0}
+
+    def _changed(self, previous, value, ts):
+        return previous is None or previous[0] != value or ts - previous[-1] >= self.refresh_interval
+
+    def collect(self, snapshot):
+        """
+        Build rows for `snapshot`, a {hostname: (report_time, metrics)} dict.
+        Returns (sample_rows, disk_rows, state) where `state` must be passed
+        to commit() once the rows are stored.
+        """
+        sample_rows, disk_rows = [], []
+        state = {"reports": {}, "samples": {}, "disks": {}}
+        skipped = 0
+        with self._lock:
+            for hostname, (ts, metrics) in snapshot.items():
+                if self._last_report.get(hostname, 0) >= ts:
+                    continue
+                state["reports"][hostname] = ts
+
+                for metric, value in flatten_metrics(metrics):
+                    key = (hostname, metric)
+                    if self._changed(self._last_written.get(key), value, ts):
+                        sample_rows.append((hostname, metric, ts, value))
+                        state["samples"][key] = (value, ts)
+                    else:
+                        skipped += 1
+
+                for mountpoint, label, usage in disk_samples(metrics):
+                    key = (hostname, mountpoint)
+                    previous = self._last_disk.get(key)
+                    if previous is None or previous[1] != label or self._changed(previous, usage, ts):
+                        disk_rows.append((hostname, mountpoint, ts, label, usage))
+                        state["disks"][key] = (usage, label, ts)
+                    else:
+                        skipped += 1
+        state["skipped"] = skipped
+        return sample_rows, disk_rows, state
+
+    def commit(self, state):
+        with self._lock:
+            self._last_report.update(state["reports"])
+            self._last_written.update(state["samples"])
+            self._last_disk.update(state["disks"])
+            self.stats["writes"] += 1
+            self.stats["samples_skipped"] += state["skipped"]
+
+    def write(self, snapshot):
+        """Write the changed rows of `snapshot`; returns (samples, disk_samples) written."""
+        sample_rows, disk_rows, state = self.collect(snapshot)
+        self.storage.insert_samples(sample_rows)
+        self.storage.insert_disk_samples(disk_rows)
+        self.commit(state)
+        with self._lock:
+            self.stats["samples_written"] += len(sample_rows)
+            self.stats["disk_samples_written"] += len(disk_rows)
+        return len(sample_rows), len(disk_rows)
+
+    def backfill(self, reports):
+        """
+        Write past samples, e.g. reports an agent buffered while the server was
+        unreachable: `reports` is a list of (hostname, ts, metrics). Values are
+        suppressed only against the previous sample of the same series in
+        `reports`; the live state used by write() is left alone.
+        Returns (samples, disk_samples) written.
+        """
+        sample_rows, disk_rows = [], []
+        last_written, last_disk = {}, {}
+        for hostname, ts, metrics in sorted(reports, key=lambda report: report[1]):
+            for metric, value in flatten_metrics(metrics):
+                key = (hostname, metric)
+                if self._changed(last_written.get(key), value, ts):
+                    sample_rows.append((hostname, metric, ts, value))
+                    last_written[key] = (value, ts)
+            for mountpoint, label, usage in disk_samples(metrics):
+                key = (hostname, mountpoint)
+                previous = last_disk.get(key)
+                if previous is None or previous[1] != label or self._changed(previous, usage, ts):
+                    disk_rows.append((hostname, mountpoint, ts, label, usage))
+                    last_disk[key] = (usage, label, ts)
+        self.storage.insert_samples(sample_rows)
+        self.storage.insert_disk_samples(disk_rows)
+        with self._lock:
+            self.stats["backfilled"] += len(reports)
+            self.stats["samples_written"] += len(sample_rows)
+            self.stats["disk_samples_written"] += len(disk_rows)
+        return len(sample_rows), len(disk_rows)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, tracked_series=len(self._last_written) + len(self._last_disk))
+
+
+def time_weighted(ts, values, edges, hold):
+    """
+    Aggregate one time-ordered series into the pieces [edges[k], edges[k + 1]),
+    weighting each value by how long it held. Samples are written only when the
+    value changes (and on refresh), so a value holds from its sample until the
+    next one, for at most `hold` seconds: a value that stayed put for minutes
+    weighs more than a burst of changes in a few seconds. Samples before
+    edges[0] seed the value held into the first piece.
+
+    Returns per-piece arrays (min, max, sum, count, last, covered): sum is in
+    value-seconds and covered is the seconds the series had a value, so
+    avg = sum / covered; count is the samples taken in the piece. Without a
+    `hold` each sample counts once, as one second.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    pieces = len(edges) - 1
+    first = np.searchsorted(ts, edges, side="left")
+    counts = np.diff(first)
+    taken = counts > 0
+
+    mins, maxs, lasts = np.full(pieces, np.nan), np.full(pieces, np.nan), np.full(pieces, np.nan)
+    sums = np.zeros(pieces)
+    if taken.any():
+        cut, offsets = first[-1], first[:-1][taken]
+        mins[taken] = np.minimum.reduceat(values[:cut], offsets)
+        maxs[taken] = np.maximum.reduceat(values[:cut], offsets)
+        sums[taken] = np.add.reduceat(values[:cut], offsets)
+        lasts[taken] = values[first[1:][taken] - 1]
+    if hold <= 0 or not len(ts):
+        return mins, maxs, sums, counts, lasts, counts.astype(np.float64)
+
+    held = np.minimum(np.append(ts[1:], np.inf), ts + hold) - ts
+    # Integrals of the series and of its coverage up to each edge, through the last sample before it
+    before = np.maximum(first - 1, 0)
+    into = np.where(first > 0, np.clip(edges - ts[before], 0, held[before]), 0.0)
+    at_sum = np.where(first > 0, np.concatenate(([0.0], np.cumsum(values * held)))[before] + values[before] * into, 0.0)
+    at_covered = np.where(first > 0, np.concatenate(([0.0], np.cumsum(held)))[before] + into, 0.0)
+
+    # The value held into a piece counts towards its min, max and last too
+    carried = (first[:-1] > 0) & (into[:-1] < held[before[:-1]])
+    held_in = values[before[:-1]][carried]
+    mins[carried] = np.fmin(mins[carried], held_in)
+    maxs[carried] = np.fmax(maxs[carried], held_in)
+    lasts[carried & ~taken] = values[before[:-1]][carried & ~taken]
+    return mins, maxs, np.diff(at_sum), counts, lasts, np.diff(at_covered)
+
+
+def aggregate_buckets(ts, mins, maxs, sums, counts, lasts, covered, start, end, step):
+    """
+    Merge time-ordered partial aggregates (see time_weighted()) into fixed
+    `step`-second buckets over [start, end) and return columnar
+    {"t", "min", "max", "avg", "last", "count"}; avg is time-weighted.
+
+    A bucket the series only held a value into has a count of 0; buckets
+    without data are omitted.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    lasts = np.asarray(lasts, dtype=np.float64)
+    bucket_count = max(int(math.ceil((end - start) / step)), 0)
+    bucket_starts = start + step * np.arange(bucket_count, dtype=np.float64)
+
+    lo = np.searchsorted(ts, bucket_starts, side="left")
+    hi = np.searchsorted(ts, bucket_starts + step, side="left")
+    filled = hi > lo
+
+    out_min = np.full(bucket_count, np.nan)
+    out_max = np.full(bucket_count, np.nan)
+    out_avg = np.full(bucket_count, np.nan)
+    out_last = np.full(bucket_count, np.nan)
+    out_count = np.zeros(bucket_count, dtype=np.int64)
+
+    if filled.any():
+        # reduceat runs each segment up to the next offset, so cut off inputs past the last bucket
+        cut = hi[-1]
+        offsets = lo[filled]
+        out_min[filled] = np.minimum.reduceat(np.asarray(mins, dtype=np.float64)[:cut], offsets)
+        out_max[filled] = np.maximum.reduceat(np.asarray(maxs, dtype=np.float64)[:cut], offsets)
+        total = np.add.reduceat(np.asarray(sums, dtype=np.float64)[:cut], offsets)
+        seconds = np.add.reduceat(np.asarray(covered, dtype=np.float64)[:cut], offsets)
+        out_count[filled] = np.add.reduceat(np.asarray(counts, dtype=np.int64)[:cut], offsets)
+        out_avg[filled] = total / seconds
+        out_last[filled] = lasts[hi[filled] - 1]
+
+    return {
+        "t": bucket_starts[filled].tolist(),
+        "min": out_min[filled].tolist(),
+        "max": out_max[filled].tolist(),
+        "avg": out_avg[filled].tolist(),
+        "last": out_last[filled].tolist(),
+        "count": out_count[filled].tolist(),
+    }
+
+
+def weighted_rows(ts, values, edges, hold):
+    """time_weighted() as an (n, 7) array of ts, min, max, sum, count, last, covered, for the pieces with data."""
+    columns = time_weighted(ts, values, edges, hold)
+    keep = (columns[3] > 0) | (columns[5] > 0)
+    return np.column_stack([np.asarray(edges, dtype=np.float64)[:-1]] + list(columns))[keep]
+
+
+def downsample(ts, values, start, end, step, fill_window=0):
+    """Downsample raw (ts, value) samples, each holding for up to `fill_window` seconds; see aggregate_buckets()."""
+    edges = start + step * np.arange(max(int(math.ceil((end - start) / step)), 0) + 1, dtype=np.float64)
+    rows = weighted_rows(ts, values, edges, fill_window)
+    return aggregate_buckets(*rows.T, start, end, step)
+
+
+def _series_rows(storage, hostname, name, tier, start, end, step, edge, hold):
+    """
+    Fetch one series over [start, end) as an (n, 7) array of ts, min, max, sum,
+    count, last, covered. Raw samples are weighted into pieces cut at `edge` +
+    multiples of `step`, the query's bucket boundaries.
+    """
+    if tier is None:
+        # Samples up to `hold` before `start` seed the value held into it
+        if name.startswith(DISK_METRIC + "."):
+            rows = storage.query_disk_series(hostname, name[len(DISK_METRIC) + 1:], start - hold, end)
+        else:
+            rows = storage.query_series(hostname, name, start - hold, end)
+        data = np.array(rows, dtype=np.float64).reshape(-1, 2)
+        inner = edge + step * np.arange(math.floor((start - edge) / step) + 1, math.ceil((end - edge) / step))
+        edges = np.concatenate(([start], inner[(inner > start) & (inner < end)], [end]))
+        return weighted_rows(data[:, 0], data[:, 1], edges, hold)
+    return np.array(storage.query_rollup_series(tier, hostname, name, start, end), dtype=np.float64).reshape(-1, 7)
+
+
+def query_downsampled(storage, hostname, start, end, step, metrics=None, fill_window=0, plan=None):
+    """
+    Fetch and downsample the requested series for one host. `metrics` may name
+    plain metrics, "disk_usage" (all disks) or "disk_usage.<mountpoint>";
+    None returns every stored series.
+
+    `plan` is a list of (tier, from, to) segments to read, oldest first, as
+    produced by RollupEngine.plan(); tier None means raw samples. By default
+    everything is read from the raw tables. Raw samples hold their value for
+    up to `fill_window` seconds.
+    """
+    if plan is None:
+        plan = [(None, start, end)]
+
+    available = []
+    for tier in dict.fromkeys(tier for tier, _, _ in plan):
+        available.extend(name for name in storage.list_series(hostname, tier) if name not in available)
+
+    if metrics is None:
+        wanted = available
+    else:
+        wanted = []
+        for name in metrics:
+            if name == DISK_METRIC:
+                wanted.extend(n for n in available if n.startswith(DISK_METRIC + "."))
+            else:
+                wanted.append(name)
+
+    series = {}
+    for name in wanted:
+        parts = [_series_rows(storage, hostname, name, tier, seg_start, seg_end, step, start, fill_window)
+                 for tier, seg_start, seg_end in plan if seg_end > seg_start]
+        data = np.concatenate(parts) if parts else np.empty((0, 7))
+        series[name] = aggregate_buckets(*data.T, start, end, step)
+    return series
+
+
+# === Rollups ===
+# (tier, bucket seconds, source tier); each tier is built from the one before it
+ROLLUP_TIERS = (
+    ("1m", 60, None),
+    ("1h", 3600, "1m"),
+    ("1d", 86400, "1h"),
+)
+RAW_TIER = "raw"
+
+
+class RollupEngine:
+    """
+    Aggregates raw samples into the 1-minute, 1-hour and 1-day tiers and
+    enforces per-tier retention.
+
+    Each tier keeps a watermark: every bucket before it is complete and
+    stored. A pass only reads the source range between the watermark and
+    the newest complete bucket (raw data is given `lag` seconds to arrive),
+    at most `max_buckets` buckets at a time. Expired rows are deleted
+    `delete_batch` rows per transaction, and never before the next tier
+    has rolled them up. Samples written behind a watermark (backfill) are
+    rolled up after rewind() moves the watermarks back.
+
+    Raw samples hold their value for up to `hold` seconds (the writer's
+    refresh interval), so 1-minute buckets are time-weighted and a value
+    that holds over several minutes fills each of them.
+    """
+
+    def __init__(self, storage, retention, lag=120, max_buckets=720, delete_batch=5000,
+                 max_delete_batches=100, batch_pause=0.05, stop_event=None, hold=300):
+        self.storage = storage
+        self.retention = dict(retention)
+        self.hold = hold
+        self.lag = lag
+        self.max_buckets = max_buckets
+        self.delete_batch = delete_batch
+        self.max_delete_batches = max_delete_batches
+        self.batch_pause = batch_pause
+        self.stop_event = stop_event or threading.Event()
+        self.watermarks = storage.load_watermarks()
+        self._rewind_to = None
+        self._lock = threading.Lock()
+        self.stats = {"runs": 0, "buckets_written": 0, "rows_deleted": 0, "last_run_ms": 0.0}
+
+    # --- aggregation ---
+    @staticmethod
+    def _combine(rows, size):
+        """Aggregate (hostname, metric, ts, min, max, sum, count, last, covered) rows into `size`-second buckets."""
+        groups = {}
+        for hostname, metric, ts, low, high, total, count, last, covered in rows:
+            bucket = (ts // size) * size
+            key = (hostname, metric, bucket)
+            agg = groups.get(key)
+            if agg is None:
+                groups[key] = [low, high, total, count, last, covered, ts]
+                continue
+            agg[0] = min(agg[0], low)
+            agg[1] = max(agg[1], high)
+            agg[2] += total
+            agg[3] += count
+            agg[5] += covered
+            if ts >= agg[6]:
+                agg[4], agg[6] = last, ts
+        return groups
+
+    def _source_rows(self, source, start, end, size):
+        if source is None:
+            return self._raw_rows(start, end, size)
+        return self.storage.fetch_rollups(source, start, end)
+
+    def _raw_rows(self, start, end, size):
+        """Time-weighted `size`-second rows of the raw samples in [start, end), aligned to `size`."""
+        series = {}
+        # Samples up to `hold` before `start` seed the value held into it
+        for hostname, metric, ts, value in self.storage.fetch_samples(start - self.hold, end):
+            series.setdefault((hostname, metric), []).append((ts, value))
+        edges = start + size * np.arange(round((end - start) / size) + 1, dtype=np.float64)
+        rows = []
+        for (hostname, metric), samples in series.items():
+            samples.sort()
+            data = np.array(samples, dtype=np.float64)
+            for ts, low, high, total, count, last, covered in weighted_rows(data[:, 0], data[:, 1], edges, self.hold):
+                rows.append((hostname, metric, ts, low, high, total, int(count), last, covered))
+        return rows
+
+    def _earliest(self, source):
+        if source is None:
+            return self.storage.earliest_sample_ts()
+        return self.storage.earliest_rollup_ts(source)
+
+    def rewind(self, ts):
+        """Have the next roll_up() recompute every bucket from the one containing `ts` on."""
+        with self._lock:
+            self._rewind_to = ts if self._rewind_to is None else min(self._rewind_to, ts)
+
+    def _apply_rewind(self):
+        with self._lock:
+            ts, self._rewind_to = self._rewind_to, None
+        if ts is None:
+            return
+        for tier, size, _ in ROLLUP_TIERS:
+            bucket = (ts // size) * size
+            if self.watermarks.get(tier, bucket) > bucket:
+                self.storage.save_watermark(tier, bucket)
+                with self._lock:
+                    self.watermarks[tier] = bucket
+
+    def roll_up(self, now):
+        """Advance every tier's watermark as far as its source allows; returns buckets written."""
+        self._apply_rewind()
+        written = 0
+        for tier, size, source in ROLLUP_TIERS:
+            limit = now - self.lag if source is None else self.watermarks.get(source)
+            if limit is None:
+                continue
+            limit = (limit // size) * size
+
+            watermark = self.watermarks.get(tier)
+            if watermark is None:
+                earliest = self._earliest(source)
+                if earliest is None:
+                    continue
+                watermark = (earliest // size) * size
+
+            while watermark < limit and not self.stop_event.is_set():
+                chunk_end = min(limit, watermark + size * self.max_buckets)
+                groups = self._combine(self._source_rows(source, watermark, chunk_end, size), size)
+                self.storage.upsert_rollups([
+                    (tier, hostname, metric, bucket, low, high, total, count, last, covered)
+                    for (hostname, metric, bucket), (low, high, total, count, last, covered, _) in groups.items()
+                ])
+                self.storage.save_watermark(tier, chunk_end)
+                with self._lock:
+                    self.watermarks[tier] = chunk_end
+                watermark = chunk_end
+                written += len(groups)
+        return written
+
+    # --- retention ---
+    def _delete_before(self, table, cutoff, tier=None):
+        deleted = 0
+        for _ in range(self.max_delete_batches):
+            count = self.storage.delete_expired(table, cutoff, self.delete_batch, tier=tier)
+            deleted += max(count, 0)
+            if count < self.delete_batch or self.stop_event.wait(self.batch_pause):
+                break
+        return deleted
+
+    def enforce_retention(self, now):
+        """Delete expired raw samples and rollups in bounded batches; returns rows deleted."""
+        tiers = [RAW_TIER] + [tier for tier, _, _ in ROLLUP_TIERS]
+        deleted = 0
+        for index, tier in enumerate(tiers):
+            if tier not in self.retention:
+                continue
+            cutoff = now - self.retention[tier]
+            if index + 1 < len(tiers):
+                # Keep data the next tier has not consumed yet
+                cutoff = min(cutoff, self.watermarks.get(tiers[index + 1], float("-inf")))
+            if cutoff == float("-inf"):
+                continue
+            if tier == RAW_TIER:
+                deleted += self._delete_before(SAMPLES_TABLE, cutoff)
+                deleted += self._delete_before(DISK_SAMPLES_TABLE, cutoff)
+                deleted += self._delete_before(METRICS_TABLE, datetime.fromtimestamp(now - self.retention[tier]))
+            else:
+                deleted += self._delete_before(ROLLUPS_TABLE, cutoff, tier=tier)
+        return deleted
+
+    def run_once(self, now):
+        started = time.perf_counter()
+        written = self.roll_up(now)
+        deleted = self.enforce_retention(now)
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["buckets_written"] += written
+            self.stats["rows_deleted"] += deleted
+            self.stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return written, deleted
+
+    # --- queries ---
+    def plan(self, start, end, step, now):
+        """
+        Choose which tiers serve a query and split [start, end) between them.
+
+        The coarsest tier whose buckets are no wider than `step` is used,
+        or a coarser one if the finer tiers no longer retain `start`.
+        Ranges newer than that tier's watermark are read from the finer
+        tiers (and finally the raw tables) so recent data is never missing.
+        """
+        tiers = [(RAW_TIER, 0)] + [(tier, size) for tier, size, _ in ROLLUP_TIERS]
+        chosen = 0
+        for index, (tier, size) in enumerate(tiers):
+            if size <= step:
+                chosen = index
+        while chosen + 1 < len(tiers) and now - self.retention.get(tiers[chosen][0], float("inf")) > start:
+            chosen += 1
+
+        with self._lock:
+            watermarks = dict(self.watermarks)
+        segments, boundary = [], start
+        for index in range(chosen, -1, -1):
+            tier = tiers[index][0]
+            upto = end if tier == RAW_TIER else min(watermarks.get(tier, boundary), end)
+            if upto > boundary:
+                segments.append((None if tier == RAW_TIER else tier, boundary, upto))
+                boundary = upto
+        return segments
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, watermarks=dict(self.watermarks))
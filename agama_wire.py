@@ -0,0 +1,185 @@
+import time
+
+# Compact report encoding, negotiated by Content-Type. A MessagePack body is either
+# a plain map shaped like the JSON report, or a compact array whose first element
+# is the schema version; fields are then identified by position instead of by
+# repeated key strings:
+#
+#   [1, hostname, group, tags, ip_address, cpu_usage, memory_usage, boot_time,
+#    [bytes_sent, bytes_received], [[mountpoint, disk_label, disk_usage], ...], extra]
+#
+# Unused fields are nil; `extra` holds any other data keys as a map. boot_time is
+# unix seconds, so the server can compute uptime; it adds the "uptime" display
+# string the JSON agents send when decoding.
+#
+# Delta reports (see agama_delta) append [seq, base]: base is nil for a keyframe,
+# which is otherwise encoded as above. In a delta (base set) the fields hold only
+# what changed: nil means unchanged, network_io entries likewise, and `extra`
+# carries the rest of the delta as is (removed keys as nil, disk_usage changes,
+# "uptime").
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MSGPACK_MIMETYPE = MSGPACK_MIMETYPES[0]
+COMPACT_SCHEMA = 1
+
+# data keys with a fixed position in the compact schema
+COMPACT_FIELDS = ("ip_address", "cpu_usage", "memory_usage", "boot_time", "network_io", "disk_usage", "uptime")
+# ... of which these are plain values, placed the same way in deltas
+COMPACT_SCALARS = ("ip_address", "cpu_usage", "memory_usage", "boot_time")
+
+
+class UnsupportedFormat(Exception):
+    """Raised when a body uses an encoding this process cannot decode or encode."""
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedFormat("MessagePack support requires the msgpack package") from None
+    return msgpack
+
+
+def format_uptime(seconds):
+    """Format seconds the way agents report uptime: "3D 4H 5M 6S"."""
+    days, remainder = divmod(max(int(seconds), 0), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{days}D {hours}H {minutes}M {seconds}S"
+
+
+def _encode_delta(payload):
+    delta = payload["delta"]
+    extra = dict(delta)
+    scalars = [extra.pop(key) if extra.get(key) is not None else None for key in COMPACT_SCALARS]
+    network = extra.get("network_io")
+    if isinstance(network, dict) and set(network) <= {"bytes_sent", "bytes_received"} \
+            and None not in network.values():
+        del extra["network_io"]
+        network = [network.get("bytes_sent"), network.get("bytes_received")]
+    else:
+        network = None
+    return [
+        COMPACT_SCHEMA,
+        payload["hostname"],
+        payload.get("group") or None,
+        payload.get("tags") or None,
+        *scalars,
+        network,
+        None,
+        extra or None,
+        payload["seq"],
+        payload["base"],
+    ]
+
+
+def encode_report(payload):
+    """
+    Turn a report dict ({"hostname", "data", "group"?, "tags"?}, or a keyframe or
+    delta from agama_delta.DeltaEncoder) into a compact schema array.
+    """
+    if "delta" in payload:
+        return _encode_delta(payload)
+    data = payload["data"]
+    network = data.get("network_io")
+    disks = data.get("disk_usage")
+    extra = {key: value for key, value in data.items() if key not in COMPACT_FIELDS}
+    return [
+        COMPACT_SCHEMA,
+        payload["hostname"],
+        payload.get("group") or None,
+        payload.get("tags") or None,
+        data.get("ip_address"),
+        data.get("cpu_usage"),
+        data.get("memory_usage"),
+        data.get("boot_time"),
+        [network.get("bytes_sent"), network.get("bytes_received")] if network else None,
+        [[mountpoint, info.get("disk_label"), info.get("disk_usage")] for mountpoint, info in disks.items()]
+        if disks else None,
+        extra or None,
+    ] + ([payload["seq"], None] if "seq" in payload else [])
+
+
+def _decode_delta(scalars, network, disks, extra):
+    delta = dict(extra) if isinstance(extra, dict) else {}
+    for key, value in zip(COMPACT_SCALARS, scalars):
+        if value is not None:
+            delta[key] = value
+    try:
+        if network:
+            delta["network_io"] = {key: value for key, value in zip(("bytes_sent", "bytes_received"), network)
+                                   if value is not None}
+        if disks:
+            delta["disk_usage"] = {mountpoint: {"disk_label": label, "disk_usage": usage}
+                                   for mountpoint, label, usage in disks}
+    except (TypeError, IndexError, ValueError):
+        raise ValueError("Malformed network_io or disk_usage in compact report") from None
+    return delta
+
+
+def decode_report(obj, now=None):
+    """Return the report dict for a decoded MessagePack value: a plain map as is, or a compact array."""
+    if isinstance(obj, dict):
+        return obj
+    if not isinstance(obj, (list, tuple)) or not obj:
+        raise ValueError("Expected a map or a compact report array")
+    if obj[0] != COMPACT_SCHEMA:
+        raise ValueError(f"Unknown compact report schema {obj[0]!r}")
+    if len(obj) not in (11, 13):
+        raise ValueError(f"Compact report schema {COMPACT_SCHEMA} has 11 fields (13 with seq/base), got {len(obj)}")
+    _, hostname, group, tags, ip_address, cpu, memory, boot_time, network, disks, extra = obj[:11]
+    seq, base = obj[11:] or (None, None)
+
+    if base is not None:
+        report = {"hostname": hostname, "seq": seq, "base": base,
+                  "delta": _decode_delta((ip_address, cpu, memory, boot_time), network, disks, extra)}
+        if group:
+            report["group"] = group
+        if tags:
+            report["tags"] = tags
+        return report
+
+    data = dict(extra) if isinstance(extra, dict) else {}
+    for key, value in (("ip_address", ip_address), ("cpu_usage", cpu), ("memory_usage", memory),
+                       ("boot_time", boot_time)):
+        if value is not None:
+            data[key] = value
+    if isinstance(boot_time, (int, float)):
+        data["uptime"] = format_uptime((time.time() if now is None else now) - boot_time)
+    try:
+        if network:
+            data["network_io"] = {key: value for key, value in zip(("bytes_sent", "bytes_received"), network)
+                                  if value is not None}
+        if disks:
+            data["disk_usage"] = {mountpoint: {"disk_label": label, "disk_usage": usage}
+                                  for mountpoint, label, usage in disks}
+    except (TypeError, IndexError, ValueError):
+        raise ValueError("Malformed network_io or disk_usage in compact report") from None
+
+    report = {"hostname": hostname, "data": data}
+    if seq is not None:
+        report["seq"] = seq
+    if group:
+        report["group"] = group
+    if tags:
+        report["tags"] = tags
+    return report
+
+
+def packb(obj):
+    return _msgpack().packb(obj, use_bin_type=True)
+
+
+def unpackb(body):
+    """Decode one MessagePack value; raises ValueError for malformed or truncated input."""
+    msgpack = _msgpack()
+    try:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    except ValueError:
+        raise
+    except (msgpack.UnpackException, TypeError) as e:
+        raise ValueError(str(e) or type(e).__name__) from None
+
+
+def stream_unpacker(max_buffer_size):
+    """Incremental decoder for a stream of concatenated MessagePack values: feed() bytes, iterate values."""
+    return _msgpack().Unpacker(raw=False, strict_map_key=False, max_buffer_size=max_buffer_size)
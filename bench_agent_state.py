@@ -0,0 +1,114 @@
+"""
+Micro-benchmark: /report-style state updates per second vs. writer thread count,
+for the old single-lock dicts and for AgentStateStore with 1 and N shards.
+
+Each writer thread applies reports for random hosts in batches of 256; reader
+threads take a whole-fleet snapshot every --read-interval seconds, the way
+/agents and the DB logger do. Besides throughput, the 99th percentile time of
+a writer batch shows how long writers stall behind a snapshot.
+
+Under the GIL pure-Python throughput barely scales with threads; the stall
+column is where one lock per shard pays off. On a free-threaded build the
+throughput columns diverge as well.
+
+    python bench_agent_state.py --hosts 20000 --threads 1 2 4 8 16 --readers 2
+"""
+import argparse
+import random
+import threading
+import time
+
+from agama_state import AgentStateStore
+
+
+class GlobalLockState:
+    """The previous layout: three dicts behind one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.post_requests = {}
+        self.cached_metrics = {}
+        self.agent_last_seen = {}
+
+    def report(self, hostname, metrics, now):
+        with self.lock:
+            self.post_requests[hostname] = metrics
+            self.cached_metrics[hostname] = metrics
+            self.agent_last_seen[hostname] = {"last_seen": now, "status": "online"}
+
+    def items(self):
+        with self.lock:
+            return [(hostname, info["last_seen"], info["status"]) for hostname, info in self.agent_last_seen.items()]
+
+
+BATCH = 256
+
+
+def run(state, hostnames, writers, readers, read_interval, seconds):
+    """Return (reports per second, p99 writer batch time in ms)."""
+    stop = threading.Event()
+    counts = [0] * writers
+    batch_times = [[] for _ in range(writers)]
+    metrics = {"cpu_usage": 12.5, "memory_usage": 40.0}
+
+    def writer(slot):
+        rng = random.Random(slot)
+        done = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            for _ in range(BATCH):
+                state.report(rng.choice(hostnames), metrics, time.time())
+            batch_times[slot].append(time.perf_counter() - started)
+            done += BATCH
+        counts[slot] = done
+
+    def reader():
+        while not stop.wait(read_interval):
+            state.items()
+
+    threads = [threading.Thread(target=writer, args=(slot,)) for slot in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    times = sorted(t for slot in batch_times for t in slot)
+    p99 = times[int(len(times) * 0.99)] if times else 0.0
+    return sum(counts) / elapsed, p99 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=20000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--readers", type=int, default=2, help="whole-fleet snapshot threads")
+    parser.add_argument("--read-interval", type=float, default=0.01, help="seconds between snapshots per reader")
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    hostnames = [f"host-{i:06d}" for i in range(args.hosts)]
+    layouts = [
+        ("global lock", GlobalLockState),
+        ("store, 1 shard", lambda: AgentStateStore(shards=1)),
+        (f"store, {args.shards} shards", lambda: AgentStateStore(shards=args.shards)),
+    ]
+
+    print(f"{args.hosts} hosts, {args.readers} reader(s) every {args.read_interval}s, {args.seconds}s per run")
+    print(f"{'threads':>8}" + "".join(f"{name + ' reports/s, p99 ms':>36}" for name, _ in layouts))
+    for writers in args.threads:
+        row = []
+        for _, factory in layouts:
+            state = factory()
+            for hostname in hostnames:
+                state.report(hostname, {}, time.time())
+            row.append(run(state, hostnames, writers, args.readers, args.read_interval, args.seconds))
+        print(f"{writers:>8}" + "".join(f"{rate:>26,.0f}{p99:>10.2f}" for rate, p99 in row))
+
+
+if __name__ == "__main__":
+    main()
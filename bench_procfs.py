@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: agent CPU time per sample for the hot collectors (cpu, memory,
+network, disks), through psutil as collect_metrics does by default and through
+the /proc fast path in agama_procfs. Linux only.
+
+CPU time is the process's user + system time (time.process_time), so it counts
+the kernel work of opening and generating /proc files too, not just parsing.
+
+    python bench_procfs.py --samples 5000
+"""
+import argparse
+import time
+
+import agama_agent_linux as agent
+from agama_procfs import ProcReader
+
+
+def psutil_collectors():
+    return [
+        ("cpu", agent.collect_cpu),
+        ("memory", agent.collect_memory),
+        ("net", agent.collect_net),
+        ("disk", agent.get_disk_infos),
+    ]
+
+
+def procfs_collectors(reader):
+    agent.use_procfs(reader)
+    return [(name, agent.collectors.get(name).fn) for name in ("cpu", "memory", "net", "disk")]
+
+
+def cpu_time(fn, samples):
+    """CPU microseconds per call of fn()."""
+    started = time.process_time()
+    for _ in range(samples):
+        fn()
+    return (time.process_time() - started) / samples * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5000)
+    args = parser.parse_args()
+
+    reader = ProcReader.open()
+    if reader is None:
+        raise SystemExit("The /proc fast path needs Linux")
+    paths = [("psutil", psutil_collectors()), ("procfs", procfs_collectors(reader))]
+
+    results = {}
+    for path, collectors in paths:
+        for _, fn in collectors:
+            fn()  # warm up, and give cpu_percent a previous sample
+        results[path] = {name: cpu_time(fn, args.samples) for name, fn in collectors}
+        results[path]["total"] = cpu_time(lambda: [fn() for _, fn in collectors], args.samples)
+
+    print(f"{args.samples} samples, CPU microseconds per sample")
+    print(f"{'collector':<12}{'psutil':>10}{'procfs':>10}{'speedup':>10}")
+    for name in results["psutil"]:
+        before, after = results["psutil"][name], results["procfs"][name]
+        print(f"{name:<12}{before:>10.1f}{after:>10.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark: bytes on the wire and server-side decode time per agent
+report, for the JSON reports agents send today and for MessagePack, both as a
+plain map and in the compact schema from agama_wire.
+
+Decode time covers what /report does before validation: json.loads() for
+JSON, unpackb() plus decode_report() for MessagePack (the compact schema is
+expanded back into the JSON report shape, uptime string included).
+
+    python bench_wire_format.py --disks 4 --reports 20000
+"""
+import argparse
+import json
+import random
+import time
+
+from agama_wire import decode_report, encode_report, format_uptime, packb, unpackb
+
+
+def make_report(index, disks, rng):
+    boot_time = time.time() - rng.randint(3600, 90 * 86400)
+    return {
+        "hostname": f"host-{index:06d}.example.internal",
+        "group": "web",
+        "tags": ["prod", "eu-west"],
+        "data": {
+            "ip_address": f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}",
+            "cpu_usage": round(rng.uniform(0, 100), 1),
+            "memory_usage": round(rng.uniform(0, 100), 1),
+            "uptime": format_uptime(time.time() - boot_time),
+            "boot_time": boot_time,
+            "network_io": {
+                "bytes_sent": rng.randint(0, 2 ** 40),
+                "bytes_received": rng.randint(0, 2 ** 40)
+            },
+            "disk_usage": {
+                f"/mnt/disk{d}" if d else "/": {"disk_label": f"/dev/sd{chr(97 + d)}1",
+                                                  "disk_usage": round(rng.uniform(0, 100), 1)}
+                for d in range(disks)
+            }
+        }
+    }
+
+
+def time_decode(decode, bodies, repeat):
+    """Best of `repeat` runs, in microseconds per report."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for body in bodies:
+            decode(body)
+        best = min(best, time.perf_counter() - started)
+    return best / len(bodies) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=20000)
+    parser.add_argument("--disks", type=int, default=4, help="mountpoints per report")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    reports = [make_report(index, args.disks, rng) for index in range(args.reports)]
+    now = time.time()
+    encodings = [
+        ("JSON", lambda report: json.dumps(report).encode("utf-8"), json.loads),
+        ("MessagePack map", packb, lambda body: decode_report(unpackb(body), now)),
+        ("MessagePack compact", lambda report: packb(encode_report(report)), lambda body: decode_report(unpackb(body), now)),
+    ]
+
+    print(f"{args.reports} reports, {args.disks} disk(s) each")
+    print(f"{'encoding':<22}{'bytes/report':>14}{'vs JSON':>10}{'decode us':>12}{'vs JSON':>10}")
+    baseline = None
+    for name, encode, decode in encodings:
+        bodies = [encode(report) for report in reports]
+        size = sum(len(body) for body in bodies) / len(bodies)
+        micros = time_decode(decode, bodies, args.repeat)
+        baseline = baseline or (size, micros)
+        print(f"{name:<22}{size:>14.1f}{size / baseline[0]:>10.2f}{micros:>12.2f}{micros / baseline[1]:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import psutil
-import requests
 import time
 from datetime import datetime
 import socket
 import platform
+from agama_agent_transport import StreamingReporter
 
 SERVER_URL = "http://127.0.0.1:5000/report"  #local server for test and monitoring serverip during deplyment
+STREAM_URL = "http://127.0.0.1:5000/report/stream"  # streaming connection, SERVER_URL is the fallback
 
 def get_uptime():
     boot_time = psutil.boot_time()
@@ -44,22 +45,24 @@ def collect_metrics():
             "cpu_usage": cpu_usage,
             "memory_usage": memory_usage,
             "disk_usage": disk_usage,
-            # "network_io": {
-            #     "bytes_sent": network_io.bytes_sent,
-            #     "bytes_received": network_io.bytes_recv
-            # },
+            "network_io": {
+                "bytes_sent": network_io.bytes_sent,
+                "bytes_received": network_io.bytes_recv
+            },
+            # Lets the server tell a reboot from a counter wrap when computing network_rates
+            "boot_time": psutil.boot_time(),
             "uptime": uptime
         }
     }
 
 
 def report_metrics():
+    reporter = StreamingReporter(STREAM_URL, report_url=SERVER_URL).start()
     while True:
         try:
-            data = collect_metrics()
-            requests.post(SERVER_URL, json=data)
+            reporter.send(collect_metrics())
         except Exception as e:
-            print(f"Error reporting metrics: {e}")
+            print(f"Error collecting metrics: {e}")
         time.sleep(1)  # Report every 2 seconds
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_agent_transport import StreamingReporter  # noqa: E402
+
+
+class Response:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("No JSON")
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class StreamSession:
+    """Stands in for requests.Session: reads `reads` reports off each stream, then answers with the next response."""
+
+    def __init__(self, reads, responses):
+        self.reads = reads
+        self.responses = list(responses)
+        self.streamed = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        if data == b"":
+            return Response(200)
+        for _ in range(self.reads):
+            self.streamed.append(next(data))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+def reporter(session, count, **options):
+    reporter = StreamingReporter("http://server/report/stream", session=session, **options)
+    for i in range(count):
+        reporter.send({"hostname": "h1", "data": {"cpu_usage": float(i)}})
+    reporter._stopping = True  # end each stream once the queue is empty
+    return reporter
+
+
+class EarlyStreamEndTests(unittest.TestCase):
+    def queued_values(self, reporter):
+        return [payload["data"]["cpu_usage"] for _, payload in reporter._queue]
+
+    def test_reports_after_a_409_are_sent_again_from_a_keyframe(self):
+        session = StreamSession(4, [Response(409, {"error": "No sample 2", "resync": True, "accepted": 2,
+                                                   "rejected": 1, "errors": []})])
+        stream = reporter(session, 5, delta=True)
+        stream._stream()
+
+        # The server took reports 0 and 1; 2 was the delta it could not expand, 3 was written after it
+        self.assertEqual(self.queued_values(stream), [2.0, 3.0, 4.0])
+        self.assertEqual(stream._deltas._base, None)
+
+    def test_409_without_delta_mode_drops_the_report_it_names(self):
+        session = StreamSession(3, [Response(409, {"error": "No sample 8", "resync": True, "accepted": 1,
+                                                   "rejected": 1, "errors": []})])
+        stream = reporter(session, 3)
+        stream._stream()
+
+        self.assertEqual(self.queued_values(stream), [2.0])
+        self.assertEqual(stream.stats["dropped"], 1)
+
+    def test_reports_after_a_503_are_sent_again(self):
+        session = StreamSession(3, [Response(503, {"error": "Server busy", "accepted": 1, "rejected": 0,
+                                                   "errors": []})])
+        stream = reporter(session, 3)
+        stream._stream()
+
+        self.assertEqual(self.queued_values(stream), [1.0, 2.0])
+
+    def test_other_early_ends_drop_what_the_server_did_not_take(self):
+        session = StreamSession(3, [Response(413, {"error": "Line too long", "accepted": 1, "rejected": 0,
+                                                   "errors": []})])
+        stream = reporter(session, 3)
+        stream._stream()
+
+        self.assertEqual(self.queued_values(stream), [])
+        self.assertEqual(stream.stats["dropped"], 2)
+
+    def test_answer_without_counts_only_requeues_the_report_being_written(self):
+        session = StreamSession(2, [Response(502)])
+        stream = reporter(session, 3)
+        stream._stream()
+
+        # Report 1 was handed over but never confirmed written; report 2 was not taken from the queue
+        self.assertEqual(self.queued_values(stream), [1.0, 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
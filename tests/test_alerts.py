@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_alerts import AlertEngine, NotificationDispatcher, Rule, resolve_metric  # noqa: E402
+
+
+def states(events):
+    return [(event["state"], event["rule"], event["instance"]) for event in events]
+
+
+class RuleTests(unittest.TestCase):
+    def test_bad_specs_are_rejected(self):
+        for spec in ({"metric": "cpu_usage", "value": 1},
+                     {"name": "x", "metric": "cpu_usage", "op": "~", "value": 1},
+                     {"name": "x", "metric": "cpu_usage", "value": "high"},
+                     {"name": "x", "kind": "absence", "metric": "cpu_usage"},
+                     {"name": "x", "metric": "cpu_usage", "value": 1, "message": "{missing}"}):
+            with self.subTest(spec=spec):
+                self.assertRaises(ValueError, Rule, spec)
+
+    def test_wildcards_name_the_instance(self):
+        data = {"disk_usage": {"/": {"disk_usage": 50.0}, "/var": {"disk_usage": 90.0, "disk_label": "var"}}}
+        self.assertEqual(sorted(resolve_metric(data, ("disk_usage", "*", "disk_usage"))), [("/", 50.0), ("/var", 90.0)])
+
+
+class AlertEngineTests(unittest.TestCase):
+    def test_threshold_fires_after_its_duration_and_resolves(self):
+        engine = AlertEngine([{"name": "cpu-high", "metric": "cpu_usage", "op": ">", "value": 90, "for": "1m"}])
+
+        self.assertEqual(engine.evaluate("web1", {"cpu_usage": 95}, 0), [])
+        # Fires from sweep() when no report arrives in time
+        self.assertEqual(engine.sweep(30), [])
+        self.assertEqual(states(engine.sweep(60)), [("firing", "cpu-high", "")])
+        self.assertEqual(len(engine.active()), 1)
+        self.assertEqual(states(engine.evaluate("web1", {"cpu_usage": 50}, 70)), [("resolved", "cpu-high", "")])
+        self.assertEqual(engine.active(), [])
+
+    def test_rules_only_see_their_hosts(self):
+        engine = AlertEngine([{"name": "db-cpu", "metric": "cpu_usage", "value": 90, "group": "db"}])
+
+        self.assertEqual(engine.evaluate("web1", {"cpu_usage": 95}, 0, group="web"), [])
+        self.assertEqual(states(engine.evaluate("db1", {"cpu_usage": 95}, 0, group="db")), [("firing", "db-cpu", "")])
+
+    def test_rate_is_the_change_per_period_between_reports(self):
+        engine = AlertEngine([{"name": "disk-filling", "kind": "rate", "metric": "disk_usage.*.disk_usage",
+                               "op": ">", "value": 5, "per": "1h"}])
+        engine.evaluate("web1", {"disk_usage": {"/var": {"disk_usage": 50.0}}}, 0)
+        events = engine.evaluate("web1", {"disk_usage": {"/var": {"disk_usage": 51.0}}}, 600)
+
+        self.assertEqual(states(events), [("firing", "disk-filling", "/var")])
+        self.assertEqual(events[0]["value"], 6.0)
+
+    def test_absence_fires_once_a_reported_metric_stops(self):
+        engine = AlertEngine([{"name": "net-silent", "kind": "absence", "metric": "network_rates", "for": "2m"}])
+        engine.evaluate("web1", {"network_rates": {"bytes_sent": 1}}, 0)
+
+        self.assertEqual(engine.sweep(60), [])
+        self.assertEqual(states(engine.sweep(120)), [("firing", "net-silent", "")])
+        self.assertEqual(states(engine.evaluate("web1", {"network_rates": {}}, 130)), [("resolved", "net-silent", "")])
+
+
+class RecordingNotifier:
+    def __init__(self, fail=False):
+        self.events = []
+        self.fail = fail
+
+    def notify(self, event):
+        if self.fail:
+            raise OSError("unreachable")
+        self.events.append(event)
+
+
+class NotificationDispatcherTests(unittest.TestCase):
+    def test_failing_notifier_does_not_stop_the_others(self):
+        good = RecordingNotifier()
+        dispatcher = NotificationDispatcher([RecordingNotifier(fail=True), good]).start()
+        dispatcher.submit([{"id": "a"}, {"id": "b"}])
+        dispatcher.stop()
+
+        self.assertEqual([event["id"] for event in good.events], ["a", "b"])
+        self.assertEqual((dispatcher.stats["delivered"], dispatcher.stats["failed"]), (2, 2))
+
+    def test_events_beyond_the_queue_are_dropped(self):
+        dispatcher = NotificationDispatcher([], max_queue=1)
+        dispatcher.submit([{"id": "a"}, {"id": "b"}])
+
+        self.assertEqual((dispatcher.stats["queued"], dispatcher.stats["dropped"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agama_core as core  # noqa: E402
+from agama_cluster import LoopbackBus  # noqa: E402
+from agama_core import WorkerState  # noqa: E402
+
+
+def status_of(worker, hostname):
+    return {name: status for name, _, status in worker.agent_state.items()}.get(hostname)
+
+
+class TwoWorkersOnLoopbackBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = LoopbackBus()
+        self.a = WorkerState("worker-a", primary=True, bus=self.bus)
+        self.b = WorkerState("worker-b", bus=self.bus)
+        for worker in (self.a, self.b):
+            self.bus.subscribe(worker.on_cluster_message)
+
+    def test_report_reaches_the_other_worker(self):
+        updates, _ = self.a.ingest([{"hostname": "web1", "group": "web", "data": {"cpu_usage": 12.5}}], 1000.0)
+
+        self.assertEqual(list(updates), ["web1"])
+        self.assertEqual(self.b.agent_state.get("web1")[0], {"cpu_usage": 12.5})
+        self.assertEqual(status_of(self.b, "web1"), "online")
+        self.assertEqual(self.b.fanout.get_stats()["dirty_hosts"], 1)
+        # Each worker applies a report once, not again when its own message comes back
+        self.assertEqual(self.a.agent_state.get_stats(), self.b.agent_state.get_stats())
+
+    def test_liveness_follows_reports_from_either_worker(self):
+        self.a.ingest([{"hostname": "web1", "data": {"cpu_usage": 1}}], 1000.0)
+        deadline = self.b.liveness.next_deadline()
+        self.assertIsNotNone(deadline)
+
+        # Both workers saw the report, so both time the agent out on their own
+        self.assertEqual(self.a.expire(deadline + 1), ["web1"])
+        self.assertEqual(self.b.expire(deadline + 1), ["web1"])
+        self.assertEqual(status_of(self.b, "web1"), "offline")
+
+        # The agent comes back through the other worker
+        self.b.ingest([{"hostname": "web1", "data": {"cpu_usage": 2}}], deadline + 5)
+        self.assertEqual(status_of(self.a, "web1"), "online")
+        self.assertEqual(self.a.agent_state.get("web1")[0], {"cpu_usage": 2})
+        self.assertEqual(self.a.expire(deadline + 6), [])
+
+    def test_delta_base_on_the_other_worker_is_the_agents_data(self):
+        first = {"hostname": "web1", "seq": 1, "data": {"network_io": {"bytes_sent": 100, "bytes_received": 100}}}
+        second = {"hostname": "web1", "seq": 2, "data": {"network_io": {"bytes_sent": 300, "bytes_received": 200}}}
+        for record, now in ((first, 1000.0), (second, 1010.0)):
+            self.a.ingest([self.a.report_deltas.expand(record)], now)
+        self.assertEqual(self.b.agent_state.get("web1")[0]["network_rates"],
+                         {"bytes_sent": 20.0, "bytes_received": 10.0})
+
+        # The agent's next delta lands on the other worker and carries no rates of its own
+        expanded = self.b.report_deltas.expand({"hostname": "web1", "seq": 3, "base": 2,
+                                                "delta": {"network_io": {"bytes_sent": 400}}})
+        self.assertEqual(expanded["data"], {"network_io": {"bytes_sent": 400, "bytes_received": 200}})
+
+        # Agent-sent rates never survive ingest, with or without computed ones
+        updates, _ = self.b.ingest([{"hostname": "web2", "data": {"cpu_usage": 1, "network_rates": {"bytes_sent": 1}}}], 1020.0)
+        self.assertNotIn("network_rates", updates["web2"]["data"])
+
+    def test_history_records_stay_on_the_receiving_worker(self):
+        updates, _ = self.a.ingest([{"hostname": "web1", "ts": 900.0, "data": {"cpu_usage": 1}}], 1000.0)
+
+        self.assertEqual(updates, {})
+        self.assertIsNone(status_of(self.b, "web1"))
+        self.assertEqual(self.bus.get_stats()["published"], 0)
+
+
+class ConfigureWorker(unittest.TestCase):
+    def setUp(self):
+        self.saved = (core.WORKER_ID, core.CLUSTER_PRIMARY, core.CLUSTER_BUS_URL, core.REPORT_LOG_DIR,
+                      core.worker.worker_id, core.worker.primary)
+
+    def tearDown(self):
+        (core.WORKER_ID, core.CLUSTER_PRIMARY, core.CLUSTER_BUS_URL, core.REPORT_LOG_DIR,
+         core.worker.worker_id, core.worker.primary) = self.saved
+
+    def test_report_log_dir_does_not_nest_when_configured_again(self):
+        core.configure_worker("w0", primary=True)
+        core.configure_worker("w1", primary=False)
+
+        self.assertEqual(core.REPORT_LOG_DIR, os.path.join(core.REPORT_LOG_BASE_DIR, "w1"))
+        self.assertEqual((core.WORKER_ID, core.worker.primary), ("w1", False))
+
+
+if __name__ == "__main__":
+    unittest.main()
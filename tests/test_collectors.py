@@ -0,0 +1,79 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_collectors import CollectorRegistry, summarize_window  # noqa: E402
+
+
+class CollectorRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.runs = []
+
+    def register(self, name, interval, cost="low", values=None):
+        def collect():
+            self.runs.append(name)
+            return values() if callable(values) else (values or {name: len(self.runs)})
+        self.registry.register(name, collect, interval, cost)
+
+    def test_each_collector_runs_on_its_own_interval(self):
+        self.register("cpu", 5)
+        self.register("disks", 60)
+
+        self.assertEqual(self.registry.tick_interval, 5)
+        self.assertEqual(self.registry.run_due(0), ["cpu", "disks"])
+        self.assertEqual(self.registry.run_due(5), ["cpu"])
+        # Due within half a tick counts as due
+        self.assertEqual(self.registry.run_due(57.6), ["cpu", "disks"])
+
+    def test_high_cost_collectors_are_spread_over_ticks(self):
+        for name in ("disks", "processes", "dns"):
+            self.register(name, 60, cost="high")
+        self.register("cpu", 5)
+
+        self.assertEqual(len(self.registry.run_due(0)), 4)
+        self.assertEqual(self.registry.run_due(60), ["disks", "cpu"])
+        self.assertEqual(self.registry.run_due(65), ["processes", "cpu"])
+        self.assertEqual(self.registry.run_due(70), ["dns", "cpu"])
+
+    def test_failed_run_keeps_the_previous_values(self):
+        results = iter([{"cpu_usage": 1.0}, RuntimeError("boom")])
+
+        def values():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        self.register("cpu", 5, values=values)
+
+        self.registry.run_due(0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.registry.run_due(5)
+        self.assertEqual(self.registry.merged(), {"cpu_usage": 1.0})
+        self.assertEqual(self.registry.get_stats()["cpu"]["errors"], 1)
+
+    def test_summarized_collector_reports_window_means(self):
+        samples = iter([10.0, 20.0, 30.0, 40.0])
+        self.register("cpu", 5, values=lambda: {"cpu_usage": next(samples), "label": "x"})
+        self.registry.summarize("cpu", 1)
+
+        for now in range(3):
+            self.registry.run_due(now)
+        data = self.registry.report()
+        self.assertEqual((data["cpu_usage"], data["label"]), (20.0, "x"))
+        self.assertEqual(data["summaries"], {"cpu_usage": summarize_window([10.0, 20.0, 30.0])})
+
+        self.registry.run_due(3)
+        self.assertEqual(self.registry.report()["summaries"]["cpu_usage"]["count"], 1)
+
+    def test_p95_is_the_nearest_rank(self):
+        summary = summarize_window(list(range(1, 21)))
+        self.assertEqual((summary["min"], summary["max"], summary["mean"], summary["p95"]), (1, 20, 10.5, 19))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import importlib.util
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_delta import DeltaDecoder, DeltaEncoder, DeltaMismatch, apply, diff, merge  # noqa: E402
+from agama_wire import decode_report, encode_report, packb, unpackb  # noqa: E402
+
+HAVE_MSGPACK = importlib.util.find_spec("msgpack") is not None
+
+# Agents send boot_time along with uptime; the compact schema rebuilds uptime from it
+BOOT_TIME = 1000
+REPORTS = [
+    {"cpu_usage": 10.0, "memory_usage": 50.0, "network_io": {"bytes_sent": 100, "bytes_received": 200},
+     "disk_usage": {"/": {"disk_label": "sda1", "disk_usage": 40.0}},
+     "boot_time": BOOT_TIME, "uptime": "0D 0H 1M 0S"},
+    {"cpu_usage": 12.0, "memory_usage": 50.0, "network_io": {"bytes_sent": 150, "bytes_received": 200},
+     "disk_usage": {"/": {"disk_label": "sda1", "disk_usage": 40.0}},
+     "boot_time": BOOT_TIME, "uptime": "0D 0H 1M 5S"},
+    {"cpu_usage": 12.0, "memory_usage": 51.0, "network_io": {"bytes_sent": 150, "bytes_received": 260},
+     "disk_usage": {"/": {"disk_label": "sda1", "disk_usage": 41.0}},
+     "boot_time": BOOT_TIME, "uptime": "0D 0H 1M 10S"},
+]
+
+
+class DiffTests(unittest.TestCase):
+    def test_apply_undoes_diff(self):
+        old, new = {"a": 1, "b": {"c": 2, "d": 3}, "e": 4}, {"a": 1, "b": {"c": 5, "d": 3}, "f": 6}
+        delta = diff(old, new)
+
+        self.assertEqual(delta, {"b": {"c": 5}, "e": None, "f": 6})
+        self.assertEqual(apply(old, delta), new)
+
+    def test_merged_deltas_apply_like_both_in_turn(self):
+        first, second, third = {"a": 1, "b": {"c": 2}}, {"a": 2, "b": {"c": 2}}, {"b": {"c": 3}}
+        merged = merge(diff(first, second), diff(second, third))
+
+        self.assertEqual(apply(first, merged), third)
+
+
+class DeltaRoundTripTests(unittest.TestCase):
+    def reports(self):
+        return [{"hostname": "web1", "group": "web", "data": data} for data in REPORTS]
+
+    def test_decoder_rebuilds_what_the_encoder_diffed(self):
+        encoder, decoder = DeltaEncoder(keyframe_interval=2), DeltaDecoder()
+        encoded = [encoder.encode(report) for report in self.reports()]
+
+        self.assertEqual(["base" in report for report in encoded], [False, True, False])
+        for report, original in zip(encoded, REPORTS):
+            full = decoder.expand(report)
+            decoder.commit([full])
+            self.assertEqual(full["data"], original)
+
+    def test_delta_against_an_uncommitted_base_is_a_mismatch(self):
+        encoder, decoder = DeltaEncoder(), DeltaDecoder()
+        keyframe, delta = (encoder.encode(report) for report in self.reports()[:2])
+        decoder.expand(keyframe)
+
+        self.assertRaises(DeltaMismatch, decoder.expand, delta)
+        self.assertEqual(decoder.get_stats()["mismatches"], 1)
+
+    @unittest.skipUnless(HAVE_MSGPACK, "msgpack not installed")
+    def test_compact_encoding_round_trips_keyframes_and_deltas(self):
+        encoder, decoder = DeltaEncoder(), DeltaDecoder()
+        for report, original, now in zip(self.reports(), REPORTS, (1060, 1065, 1070)):
+            wire = unpackb(packb(encode_report(encoder.encode(report))))
+            full = decoder.expand(decode_report(wire, now=now))
+            decoder.commit([full])
+            self.assertEqual((full["hostname"], full["group"], full["data"]), ("web1", "web", original))
+
+
+class CompactSchemaTests(unittest.TestCase):
+    def test_boot_time_becomes_uptime(self):
+        report = decode_report(encode_report({"hostname": "web1", "data": {"cpu_usage": 1.0, "boot_time": 1000}}),
+                               now=1000 + 90061)
+        self.assertEqual(report["data"], {"cpu_usage": 1.0, "boot_time": 1000, "uptime": "1D 1H 1M 1S"})
+
+    def test_malformed_arrays_are_rejected(self):
+        bad_disks = [1, "web1", None, None, None, 1.0, 1.0, None, None, [["/"]], None]
+        for obj in ([], [2] + [None] * 10, [1, "web1"], bad_disks):
+            with self.subTest(obj=obj):
+                self.assertRaises(ValueError, decode_report, obj)
+
+
+if __name__ == "__main__":
+    unittest.main()
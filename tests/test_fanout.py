@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_fanout import FRAME_EVENT, FanoutScheduler, host_rooms  # noqa: E402
+
+
+def frames(actions):
+    """{recipient: frame} of the FRAME_EVENT emits among `actions`."""
+    return {action[3]: action[2] for action in actions if action[0] == "emit" and action[1] == FRAME_EVENT}
+
+
+class FanoutTests(unittest.TestCase):
+    def setUp(self):
+        self.now = time.time()
+        self.fanout = FanoutScheduler(max_lag=1, ack_timeout=5.0, history=2)
+
+    def publish(self, hostname, metrics, group=None):
+        self.fanout.publish(hostname, metrics, rooms=host_rooms(hostname, group))
+
+    def tick(self, offset):
+        return self.fanout.tick(self.now + offset)
+
+    def test_updates_are_coalesced_and_only_sent_to_watched_rooms(self):
+        self.fanout.add_client("db-watcher", self.now, rooms=["group:db"])
+        self.publish("web1", {"cpu_usage": 1.0}, group="web")
+        self.publish("db1", {"cpu_usage": 1.0}, group="db")
+        self.publish("db1", {"cpu_usage": 2.0}, group="db")
+
+        sent = frames(self.tick(1))
+        self.assertEqual(list(sent), ["group:db"])
+        self.assertEqual(sent["group:db"]["hosts"], {"db1": {"data": {"cpu_usage": 2.0}, "status": "online"}})
+        self.assertEqual(self.fanout.get_stats()["updates_coalesced"], 1)
+
+        # Only what changed goes out next time
+        self.publish("db1", {"cpu_usage": 2.0, "memory_usage": 5.0}, group="db")
+        self.assertEqual(frames(self.tick(2))["group:db"]["hosts"], {"db1": {"data": {"memory_usage": 5.0}}})
+
+    def test_resume_sends_only_missed_changes_while_the_history_covers_them(self):
+        self.publish("web1", {"cpu_usage": 1.0, "memory_usage": 5.0})
+        self.tick(1)
+        self.publish("web2", {"cpu_usage": 1.0})
+        self.tick(2)
+        self.publish("web1", {"cpu_usage": 2.0, "memory_usage": 5.0})
+        self.tick(3)
+        rooms, epoch = ["host:web1"], self.fanout.epoch
+
+        self.assertEqual(self.fanout.snapshot(rooms, since=1, epoch=epoch),
+                         {"epoch": epoch, "seq": 3, "since": 1, "hosts": {"web1": {"data": {"cpu_usage": 2.0}}}})
+        full = {"web1": {"status": "online", "data": {"cpu_usage": 2.0, "memory_usage": 5.0}}}
+        # Seq 1 fell out of the two-frame history; another epoch is another process
+        self.assertEqual(self.fanout.snapshot(rooms, since=0, epoch=epoch)["hosts"], full)
+        self.assertEqual(self.fanout.snapshot(rooms, since=1, epoch="other")["hosts"], full)
+
+    def test_lagging_client_gets_one_merged_frame_once_it_acks(self):
+        self.fanout.add_client("slow", self.now)
+        self.publish("web1", {"cpu_usage": 0.0})
+        self.tick(10)
+        self.publish("web1", {"cpu_usage": 1.0})
+        self.assertIn(("leave", "slow", "fleet"), self.tick(11))
+
+        for offset, cpu in ((12, 2.0), (13, 3.0)):
+            self.publish("web1", {"cpu_usage": cpu})
+            self.assertEqual(frames(self.tick(offset)), {})
+        self.fanout.ack("slow", 2)
+
+        actions = self.tick(14)
+        self.assertEqual(frames(actions), {"slow": {"seq": 4, "hosts": {"web1": {"data": {"cpu_usage": 3.0}}}}})
+        self.assertIn(("join", "slow", "fleet"), actions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import importlib.util
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agama_core as core  # noqa: E402
+from agama_cluster import LoopbackBus  # noqa: E402
+from agama_segment_log import BackgroundWriter  # noqa: E402
+from agama_wire import MSGPACK_MIMETYPE, encode_report, packb  # noqa: E402
+
+HAVE_MSGPACK = importlib.util.find_spec("msgpack") is not None
+
+
+class IngestTestCase(unittest.TestCase):
+    """Runs the module-level ingest path against an unstarted writer and a loopback bus."""
+
+    max_queue = 1000
+
+    def setUp(self):
+        self.saved = core.report_writer, core.worker.bus
+        core.report_writer = BackgroundWriter(lambda entries: None, max_queue=self.max_queue, policy="shed")
+        core.worker.bus = LoopbackBus()
+
+    def tearDown(self):
+        core.report_writer, core.worker.bus = self.saved
+
+    def queued(self):
+        return [record for _, record in core.report_writer._queue]
+
+    def reports(self, hostname, count):
+        return [{"hostname": hostname, "data": {"cpu_usage": float(i), "memory_usage": 50.0}} for i in range(count)]
+
+
+class ReportStreamTests(IngestTestCase):
+    def feed_in_pieces(self, stream, body, size):
+        for start in range(0, len(body), size):
+            self.assertIsNone(stream.feed(body[start:start + size]))
+        return stream.finish()
+
+    def test_ndjson_lines_split_across_chunks(self):
+        body = b"".join(json.dumps(report).encode() + b"\n" for report in self.reports("stream-json", 3))
+        response, status, _ = self.feed_in_pieces(core.ReportStreamIngest("test"), body, 7)
+
+        self.assertEqual((status, response["accepted"]), (200, 3))
+        self.assertEqual([r["data"]["cpu_usage"] for r in self.queued()], [0.0, 1.0, 2.0])
+
+    @unittest.skipUnless(HAVE_MSGPACK, "msgpack not installed")
+    def test_msgpack_reports_are_ingested_as_they_arrive(self):
+        stream = core.ReportStreamIngest("test", MSGPACK_MIMETYPE)
+        for i, report in enumerate(self.reports("stream-msgpack", 3)):
+            # A byte at a time, as the dev server's chunked input hands it over; no newlines to wait for
+            for byte in packb(encode_report(report)):
+                self.assertIsNone(stream.feed(bytes([byte])))
+            self.assertEqual(len(self.queued()), i + 1)
+            self.assertEqual(core.worker.agent_state.get("stream-msgpack")[0]["cpu_usage"], float(i))
+        response, status, _ = stream.finish()
+        self.assertEqual((status, response["accepted"], response["rejected"]), (200, 3, 0))
+
+
+class DeltaBaseTests(IngestTestCase):
+    def keyframe(self, hostname, seq, cpu):
+        return {"hostname": hostname, "seq": seq, "data": {"cpu_usage": cpu}}
+
+    def delta(self, hostname, seq, base, cpu, **fields):
+        return dict({"hostname": hostname, "seq": seq, "base": base, "delta": {"cpu_usage": cpu}}, **fields)
+
+    def test_shed_delta_does_not_become_the_base(self):
+        self.assertEqual(core.handle_report(self.keyframe("delta-shed", 1, 1.0))[1], 200)
+        core.report_writer.max_queue = len(self.queued())
+
+        self.assertEqual(core.handle_report(self.delta("delta-shed", 2, 1, 2.0))[1], 503)
+        # The agent built on sample 2, which the server never stored: it must resync
+        body, status, _ = core.handle_report(self.delta("delta-shed", 3, 2, 3.0))
+        self.assertEqual((status, body["resync"]), (409, True))
+
+    def test_rejected_delta_does_not_become_the_base(self):
+        core.handle_report(self.keyframe("delta-reject", 1, 1.0))
+        body, status, _ = core.handle_report_batch([(0, self.delta("delta-reject", 2, 1, 2.0, group=5), None)])
+        self.assertEqual((status, body["rejected"]), (400, 1))
+
+        self.assertEqual(core.handle_report(self.delta("delta-reject", 3, 2, 3.0))[1], 409)
+        self.assertEqual(core.handle_report(self.delta("delta-reject", 2, 1, 4.0))[1], 200)
+        self.assertEqual(self.queued()[-1]["data"], {"cpu_usage": 4.0})
+
+    def test_deltas_chain_within_one_batch(self):
+        entries = [(0, self.keyframe("delta-chain", 1, 1.0), None),
+                   (1, self.delta("delta-chain", 2, 1, 2.0), None),
+                   (2, self.delta("delta-chain", 3, 2, 3.0), None)]
+        body, status, _ = core.handle_report_batch(entries)
+
+        self.assertEqual((status, body["accepted"]), (200, 3))
+        self.assertEqual(core.handle_report(self.delta("delta-chain", 4, 3, 4.0))[1], 200)
+        self.assertEqual([r["data"]["cpu_usage"] for r in self.queued()], [1.0, 2.0, 3.0, 4.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
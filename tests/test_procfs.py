@@ -0,0 +1,67 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agama_procfs  # noqa: E402
+from agama_procfs import ProcReader  # noqa: E402
+
+FILES = {
+    "stat": "cpu  100 0 50 800 50 0 0 0 0 0\ncpu0 100 0 50 800 50 0 0 0 0 0\n",
+    "meminfo": "MemTotal:       1000 kB\nMemFree:         100 kB\nMemAvailable:    250 kB\n",
+    "net_dev": ("Inter-|   Receive                            |  Transmit\n"
+                " face |bytes packets errs drop fifo frame compressed multicast|bytes packets errs drop\n"
+                "  eth0: 1000 10 1 2 0 0 0 0 3000 30 3 4 0 0 0 0\n"
+                "    lo: 500 5 0 0 0 0 0 0 500 5 0 0 0 0 0 0\n"),
+    "mounts": "/dev/sda1 / ext4 rw 0 0\nproc /proc proc rw 0 0\n/dev/sdb1 /mnt/my\\040disk ext4 rw 0 0\n",
+}
+
+
+@unittest.skipUnless(hasattr(os, "preadv"), "os.preadv not available")
+class ProcReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        paths = {name: os.path.join(self.dir, name) for name in FILES}
+        for name, content in FILES.items():
+            self.write(paths[name], content)
+        # Small buffers, so every file makes the reader grow them
+        patches = [mock.patch.dict(agama_procfs.PROC_FILES, paths), mock.patch.object(agama_procfs, "BUFFER_SIZE", 16),
+                   mock.patch.object(ProcReader, "_physical_fstypes", staticmethod(lambda: {b"ext4"}))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.reader = ProcReader()
+        self.addCleanup(self.reader.close)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_cpu_percent_is_busy_time_since_the_previous_call(self):
+        self.assertEqual(self.reader.cpu_percent(), 0.0)
+        # Rewritten in place, as the kernel does; the reader rereads the open file
+        self.write(agama_procfs.PROC_FILES["stat"], "cpu  200 0 100 1600 100 0 0 0 0 0\n")
+        self.assertEqual(self.reader.cpu_percent(), 15.0)
+
+    def test_memory_percent_uses_available_memory(self):
+        self.assertEqual(self.reader.memory_percent(), 75.0)
+
+    def test_network_counters_per_interface_and_summed(self):
+        eth0 = self.reader.net_interfaces()["eth0"]
+        self.assertEqual((eth0["bytes_sent"], eth0["bytes_received"], eth0["errors_out"], eth0["drops_in"]),
+                         (3000, 1000, 3, 2))
+        self.assertEqual(self.reader.net_io(), (3500, 1500))
+
+    def test_partitions_skip_virtual_filesystems_and_unescape_paths(self):
+        self.assertEqual(self.reader.partitions(), [("/", "/dev/sda1"), ("/mnt/my disk", "/dev/sdb1")])
+
+
+if __name__ == "__main__":
+    unittest.main()
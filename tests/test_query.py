@@ -0,0 +1,26 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agama_core as core  # noqa: E402
+
+
+class QueryParameterTests(unittest.TestCase):
+    def test_non_finite_parameters_are_rejected(self):
+        for args in ({"step": "nan"}, {"step": "inf"}, {"from": "nan"}, {"to": "inf"}, {"from": "-inf"},
+                     {"from": "-nan"}):
+            with self.subTest(args=args):
+                body, status, _ = core.query_metrics("h1", args)
+                self.assertEqual(status, 400)
+                self.assertIn("finite", body["error"])
+
+    def test_unparsable_and_empty_ranges_are_rejected(self):
+        for args in ({"step": "soon"}, {"from": "100", "to": "50"}, {"step": "-5m"}):
+            with self.subTest(args=args):
+                self.assertEqual(core.query_metrics("h1", args)[1], 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_segment_log import BackgroundWriter, SegmentLog  # noqa: E402
+
+
+class SegmentLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logs = []
+
+    def tearDown(self):
+        for log in self.logs:
+            log.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open_log(self, **options):
+        log = SegmentLog(self.directory, **options)
+        self.logs.append(log)
+        return log
+
+    def on_disk(self, log):
+        with open(log.get_stats()["active_segment"], "rb") as handle:
+            return handle.read().count(b"\n")
+
+
+class IntervalSyncTests(SegmentLogTestCase):
+    def test_last_appends_before_a_quiet_period_are_synced(self):
+        log = self.open_log(compression=None, fsync="interval", fsync_interval=1.0)
+        log.append({"n": 1}, ts=100.0)
+        log.append({"n": 2}, ts=100.5)
+        self.assertEqual((self.on_disk(log), log.stats["fsyncs"]), (1, 1))
+
+        log.sync_due(now=100.8)
+        self.assertEqual(self.on_disk(log), 1)
+        log.sync_due(now=101.0)
+        self.assertEqual((self.on_disk(log), log.stats["fsyncs"]), (2, 2))
+        # Nothing new to sync
+        log.sync_due(now=105.0)
+        self.assertEqual(log.stats["fsyncs"], 2)
+
+    def test_never_policy_still_flushes_the_write_buffer(self):
+        log = self.open_log(compression=None, fsync="never")
+        log.append({"n": 1}, ts=100.0)
+        self.assertEqual(self.on_disk(log), 0)
+        log.sync_due(now=102.0)
+        self.assertEqual((self.on_disk(log), log.stats["fsyncs"]), (1, 0))
+
+    def test_writer_thread_syncs_when_idle(self):
+        log = self.open_log(compression=None, fsync="interval", fsync_interval=0.05)
+        synced = threading.Event()
+
+        def sync_due():
+            log.sync_due()
+            if self.on_disk(log) == 2:
+                synced.set()
+
+        log.append({"n": 1})
+        writer = BackgroundWriter(log.append_entries, batch_wait=0, idle=sync_due, idle_interval=0.05).start()
+        try:
+            # Lands within the interval of the first append, so append_entries leaves it unsynced
+            writer.submit([{"n": 2}])
+            self.assertTrue(synced.wait(5))
+        finally:
+            writer.stop()
+
+
+class GatedCompressionLog(SegmentLog):
+    """Holds every compressor thread until `gate` is set."""
+
+    def __init__(self, directory, **options):
+        self.gate = threading.Event()
+        super().__init__(directory, **options)
+
+    def _compress(self, path):
+        self.gate.wait(5)
+        super()._compress(path)
+
+
+class RetentionTests(SegmentLogTestCase):
+    def wait_for_compression(self, log):
+        for _ in range(500):
+            with log._lock:
+                if not log._compressing:
+                    return
+            threading.Event().wait(0.01)
+        self.fail("compression did not finish")
+
+    def test_segments_waiting_for_compression_are_kept(self):
+        log = GatedCompressionLog(self.directory, compression="gzip", max_segment_age=3600)
+        self.logs.append(log)
+        for ts in (1000.0, 5000.0, 10000.0):
+            log.append({"ts": ts}, ts=ts)
+
+        self.assertEqual(log.delete_before(20000.0), 0)
+        log.gate.set()
+        self.wait_for_compression(log)
+
+        self.assertEqual(log.delete_before(20000.0), 2)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(log.get_stats()["active_segment"])])
+        self.assertEqual([record for _, record in log.replay()], [{"ts": 10000.0}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_storage import (MAX_ROWS_PER_STATEMENT, SAMPLES_TABLE, ConnectionPool, PoolTimeout,  # noqa: E402
+                           SQLiteStorage)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def make_pool(self, **options):
+        return ConnectionPool(FakeConnection, lambda conn: conn.healthy, **options)
+
+    def test_idle_connection_is_reused(self):
+        pool = self.make_pool()
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual((pool.stats["created"], pool.stats["reused"], pool.stats["in_use"]), (1, 1, 0))
+
+    def test_acquire_times_out_when_every_connection_is_in_use(self):
+        pool = self.make_pool(max_size=1, acquire_timeout=0.01)
+        conn = pool.acquire()
+
+        self.assertRaises(PoolTimeout, pool.acquire)
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+
+    def test_connection_that_fails_its_ping_after_an_error_is_discarded(self):
+        pool = self.make_pool()
+        with self.assertRaises(RuntimeError):
+            with pool.connection() as conn:
+                conn.healthy = False
+                raise RuntimeError("lost connection")
+
+        self.assertTrue(conn.closed)
+        with pool.connection() as replacement:
+            self.assertIsNot(replacement, conn)
+        self.assertEqual(pool.stats["discarded"], 1)
+
+
+class SQLiteStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(os.path.join(self.dir, "test.db"))
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dir)
+
+    def test_insert_spans_statements_and_skips_existing_keys(self):
+        rows = [("h1", "cpu_usage", float(ts), 1.0) for ts in range(MAX_ROWS_PER_STATEMENT + 10)]
+        self.storage.insert_samples(rows)
+        self.storage.insert_samples([("h1", "cpu_usage", 0.0, 99.0)])
+
+        series = self.storage.query_series("h1", "cpu_usage", 0, MAX_ROWS_PER_STATEMENT + 10)
+        self.assertEqual(len(series), MAX_ROWS_PER_STATEMENT + 10)
+        self.assertEqual(tuple(series[0]), (0.0, 1.0))
+
+    def test_agent_statuses_are_upserted(self):
+        self.storage.upsert_agent_statuses([("web1", "online", datetime.fromtimestamp(1000))])
+        self.storage.upsert_agent_statuses([("web1", "offline", datetime.fromtimestamp(2000))])
+
+        self.assertEqual(self.storage.load_agents(), {"web1": {"status": "offline", "last_seen": 2000.0}})
+
+    def test_expired_rows_are_deleted_in_batches(self):
+        self.storage.insert_samples([("h1", "cpu_usage", float(ts), 1.0) for ts in range(10)])
+
+        self.assertEqual(self.storage.delete_expired(SAMPLES_TABLE, 8, limit=5), 5)
+        self.assertEqual(self.storage.delete_expired(SAMPLES_TABLE, 8, limit=5), 3)
+        self.assertEqual([row[0] for row in self.storage.query_series("h1", "cpu_usage", 0, 10)], [8.0, 9.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
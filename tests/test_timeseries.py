@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agama_storage import SQLiteStorage  # noqa: E402
+from agama_timeseries import RollupEngine, downsample, query_downsampled, time_weighted  # noqa: E402
+
+# A value steady for five minutes (written once, then on refresh), then a burst of changes
+STEADY_THEN_BURST = [(0.0, 10.0), (300.0, 10.0)] + [(590.0 + i, 100.0) for i in range(10)]
+
+
+class TimeWeightedTests(unittest.TestCase):
+    def test_steady_value_weighs_by_time_not_by_samples(self):
+        ts, values = zip(*STEADY_THEN_BURST)
+        result = downsample(ts, values, 0, 600, 600, fill_window=300)
+
+        # 590s at 10 and 10s at 100, not 2 samples at 10 against 10 at 100
+        self.assertAlmostEqual(result["avg"][0], (590 * 10 + 10 * 100) / 600)
+        self.assertEqual((result["min"][0], result["max"][0], result["last"][0], result["count"][0]),
+                         (10.0, 100.0, 100.0, 12))
+
+    def test_value_holds_into_following_buckets_up_to_hold(self):
+        result = downsample([0.0], [5.0], 0, 600, 60, fill_window=150)
+
+        self.assertEqual(result["t"], [0.0, 60.0, 120.0])
+        self.assertEqual(result["avg"], [5.0, 5.0, 5.0])
+        self.assertEqual(result["count"], [1, 0, 0])
+
+    def test_value_held_into_a_piece_counts_for_min_max_and_last(self):
+        mins, maxs, sums, counts, lasts, covered = time_weighted([0.0, 90.0], [1.0, 3.0], [60.0, 120.0], 300)
+
+        self.assertEqual((mins[0], maxs[0], lasts[0], counts[0]), (1.0, 3.0, 3.0, 1))
+        self.assertEqual((sums[0], covered[0]), (30 * 1.0 + 30 * 3.0, 60.0))
+
+    def test_without_hold_each_sample_counts_once(self):
+        ts, values = zip(*STEADY_THEN_BURST)
+        result = downsample(ts, values, 0, 600, 600)
+
+        self.assertAlmostEqual(result["avg"][0], (2 * 10 + 10 * 100) / 12)
+
+
+class RollupTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(os.path.join(self.dir, "test.db"))
+        self.storage.insert_samples([("h1", "cpu_usage", ts, value) for ts, value in STEADY_THEN_BURST])
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dir)
+
+    def test_rollup_average_is_time_weighted(self):
+        engine = RollupEngine(self.storage, {}, lag=0, hold=300)
+        engine.roll_up(7200)
+
+        minutes = {row[2]: row for row in self.storage.fetch_rollups("1m", 0, 600)}
+        # The steady value fills every minute it held, not just the ones it was written in
+        self.assertEqual(sorted(minutes), [60.0 * i for i in range(10)])
+        hour = self.storage.query_rollup_series("1h", "h1", "cpu_usage", 0, 3600)[0]
+        _, low, high, total, count, last, covered = hour
+        self.assertEqual((low, high, count, last), (10.0, 100.0, 12, 100.0))
+        # The burst's last value holds on for `hold` after it
+        self.assertAlmostEqual(total / covered, (590 * 10 + 309 * 100) / 899)
+
+    def test_query_over_rollups_matches_raw(self):
+        engine = RollupEngine(self.storage, {}, lag=0, hold=300)
+        engine.roll_up(7200)
+
+        raw = query_downsampled(self.storage, "h1", 0, 600, 600, fill_window=300)["cpu_usage"]
+        rolled = query_downsampled(self.storage, "h1", 0, 600, 600, fill_window=300,
+                                   plan=engine.plan(0, 600, 600, 7200))["cpu_usage"]
+        self.assertAlmostEqual(raw["avg"][0], rolled["avg"][0])
+        self.assertEqual(raw["count"], rolled["count"])
+
+
+if __name__ == "__main__":
+    unittest.main()